@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import zlib
+try:
+    import zstandard
+    has_zstandard = True
+except ModuleNotFoundError:
+    has_zstandard = False
+try:
+    import lz4.frame
+    has_lz4 = True
+except ModuleNotFoundError:
+    has_lz4 = False
+
+# File name suffix per compression method
+suffixes = {
+    'gzip': '.gz',
+    'bz2': '.bz2',
+    'xz': '.xz',
+    'zstd': '.zst',
+    'lz4': '.lz4',
+}
+
+# Default compression level per method
+default_levels = {
+    'gzip': 6,
+    'bz2': 9,
+    'xz': 6,
+    'zstd': 3,
+    'lz4': 0,
+}
+
+def available_methods():
+    methods = ['gzip', 'bz2', 'xz']
+    if has_zstandard:
+        methods.append('zstd')
+    if has_lz4:
+        methods.append('lz4')
+    return methods
+
+# Leading bytes of each format
+magics = [
+    ('gzip', b'\x1f\x8b\x08'),
+    ('bz2', b'BZh'),
+    ('xz', b'\xfd7zXZ\x00'),
+    ('zstd', b'\x28\xb5\x2f\xfd'),
+    ('lz4', b'\x04\x22\x4d\x18'),
+]
+
+def detect_method(fname):
+    # Compression method from the file content, None for uncompressed or unreadable files
+    try:
+        with open(fname, 'rb') as f:
+            head = f.read(6)
+    except OSError:
+        return None
+    for method, magic in magics:
+        if head.startswith(magic):
+            # bz2 magic is followed by the block size 1-9
+            if method == 'bz2' and not head[3:4] in b'123456789':
+                continue
+            return method
+    return None
+
+def method_by_name(fname):
+    # Compression method from the file name suffix, None for uncompressed files
+    for method, suffix in suffixes.items():
+        if fname.endswith(suffix):
+            return method
+    return None
+
+def open_compressed(fname, method, mode='wb'):
+    # fname may also be a file object
+    if method == 'gzip':
+        return gzip.open(fname, mode)
+    elif method == 'bz2':
+        return bz2.open(fname, mode)
+    elif method == 'xz':
+        return lzma.open(fname, mode)
+    elif method == 'zstd':
+        if not has_zstandard:
+            raise ValueError('zstd compression requires the zstandard module')
+        if 'r' in mode:
+            # Blocks written by compress_block are separate frames
+            if isinstance(fname, (str, bytes, os.PathLike)):
+                return zstandard.ZstdDecompressor().stream_reader(open(fname, 'rb'),
+                    read_across_frames=True, closefd=True)
+            return zstandard.ZstdDecompressor().stream_reader(fname, read_across_frames=True, closefd=False)
+        return zstandard.open(fname, mode)
+    elif method == 'lz4':
+        if not has_lz4:
+            raise ValueError('lz4 compression requires the lz4 module')
+        return lz4.frame.open(fname, mode)
+    raise ValueError('Unknown compression method {}'.format(method))
+
+def compress_file(fname, method):
+    """Compresses a file next to it and removes the original.
+
+    Parameters:
+    fname (str): file to compress
+    method (str): one of suffixes
+
+    Returns the name of the compressed file.
+    """
+    out_name = fname + suffixes[method]
+    with open(fname, 'rb') as f_in, open_compressed(out_name, method, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out, 0x100000)
+    os.remove(fname)
+    return out_name
+
+def compress_block(data, method, level = None):
+    """Compresses data as a complete stream of the given method.
+
+    Concatenated streams are valid files of all methods, so blocks can be
+    appended to a file one by one.
+
+    Parameters:
+    data (bytes): data to compress
+    method (str): one of available_methods()
+    level (int): compression level, None for default_levels
+    """
+    if level is None:
+        level = default_levels[method]
+    if method == 'gzip':
+        # zlib with gzip header, compatible with Python 3.7
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    elif method == 'bz2':
+        return bz2.compress(data, level)
+    elif method == 'xz':
+        return lzma.compress(data, preset=level)
+    elif method == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    elif method == 'lz4':
+        return lz4.frame.compress(data, compression_level=level)
+    raise ValueError('Unknown compression method {}'.format(method))
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+import scat.util as util
+import scat.compression
+from scat.parsers.qualcomm import diagcmd
+from scat.parsers.samsung import sdmcmd
+
+import logging
+import mmap
+import os
+import struct
+
+logger = logging.getLogger('scat.index')
+
+# Sidecar index stored next to the dump as <dump>.idx
+# Header: magic, size of the indexed dump
+# Record: offset, length, command, radio ID, timestamp flag, log ID,
+#         timestamp as POSIX seconds
+index_header = struct.Struct('<8sQ')
+index_record = struct.Struct('<QIBBBHd')
+index_magic = b'SCATIDX1'
+
+def index_name(fname):
+    return fname + '.idx'
+
+def dump_type(parser, fname):
+    # Mirrors the file type detection of read_dump()
+    if scat.compression.detect_method(fname) is not None:
+        return None
+    if parser.shortname == 'qc':
+        if fname.find('.dlf') > 0:
+            return 'dlf'
+        elif fname.find('.hdf') > 0:
+            return None
+        return 'qmdl'
+    elif parser.shortname == 'sec':
+        if fname.find('.sdmraw') > 0:
+            return 'sdmraw'
+        elif fname.find('.sdm') > 0:
+            return 'sdm'
+        return 'sdmraw'
+    return None
+
+def scan_qmdl(parser, buf):
+    start = 0
+    while True:
+        end = buf.find(b'\x7e', start)
+        if end < 0:
+            break
+        if end == start:
+            start = end + 1
+            continue
+
+        pkt = parser.decode_diag(buf[start:end])
+        if pkt is not None and len(pkt) > 0:
+            radio_id = 0
+            if pkt[0] == diagcmd.DIAG_MULTI_RADIO_CMD_F and len(pkt) > 8:
+                radio_id = parser.sanitize_radio_id(struct.unpack('<L', pkt[4:8])[0])
+                pkt = pkt[8:]
+
+            log_id = 0
+            ts = None
+            if pkt[0] == diagcmd.DIAG_LOG_F and len(pkt) >= 16:
+                log_id, qxdm_ts = struct.unpack('<HQ', pkt[6:16])
+                ts = util.parse_qxdm_ts(qxdm_ts).timestamp()
+            elif pkt[0] == diagcmd.DIAG_EXT_MSG_F and len(pkt) >= 12:
+                ts = util.parse_qxdm_ts(struct.unpack('<Q', pkt[4:12])[0]).timestamp()
+            yield (start, end + 1 - start, pkt[0], radio_id, log_id, ts)
+        start = end + 1
+
+def scan_dlf(buf):
+    pos = 0
+    while pos + 12 <= len(buf):
+        pkt_len, log_id, qxdm_ts = struct.unpack('<HHQ', buf[pos:pos+12])
+        if pkt_len < 12 or pos + pkt_len > len(buf):
+            break
+        yield (pos, pkt_len, diagcmd.DIAG_LOG_F, 0, log_id, util.parse_qxdm_ts(qxdm_ts).timestamp())
+        pos += pkt_len
+
+def scan_sdmraw(buf):
+    # SDM timestamps are device ticks, not usable for seeking by time
+    pos = buf.find(b'\x7f')
+    while pos >= 0 and pos + 15 <= len(buf):
+        sdm_pkt_hdr = sdmcmd.parse_sdm_header(buf[pos+1:pos+15])
+        pkt_end = pos + 2 + sdm_pkt_hdr.length1
+        if (pkt_end <= len(buf) and buf[pkt_end - 1] == 0x7e
+                and sdm_pkt_hdr.length2 + 3 == sdm_pkt_hdr.length1):
+            yield (pos, pkt_end - pos, sdm_pkt_hdr.direction, sdm_pkt_hdr.radio_id,
+                (sdm_pkt_hdr.group << 8) | sdm_pkt_hdr.command, None)
+            pos = buf.find(b'\x7f', pkt_end)
+        else:
+            pos = buf.find(b'\x7f', pos + 2)
+
+def scan_sdm(buf):
+    pos = 0
+    while pos + 2 <= len(buf):
+        pkt_len = struct.unpack('<H', buf[pos:pos+2])[0]
+        if pos + 2 + pkt_len > len(buf):
+            break
+        if pkt_len >= 17:
+            magic, ts_low, ts_up, seqnr, direction, group, command = struct.unpack('<HHLHBBB', buf[pos+2:pos+15])
+            if magic == 0x7f39:
+                radio_id, group_real = sdmcmd.split_sdm_group(group)
+                ts = None
+                if ts_low != 0 or ts_up != 0:
+                    ts = util.parse_sdm_ts(ts_up, ts_low).timestamp()
+                yield (pos, pkt_len + 2, direction, radio_id, (group_real << 8) | command, ts)
+        pos += pkt_len + 2
+
+def build_index(parser, fname):
+    """Scans a dump file once and writes its sidecar index.
+
+    Parameters:
+    parser: QualcommParser or SamsungParser matching the dump
+    fname (str): uncompressed dump file
+
+    Returns the number of indexed packets.
+    """
+    kind = dump_type(parser, fname)
+    if kind is None:
+        raise ValueError('Indexing is not supported for {}'.format(fname))
+
+    count = 0
+    with open(fname, 'rb') as f, open(index_name(fname), 'wb') as idx:
+        dump_size = os.fstat(f.fileno()).st_size
+        idx.write(index_header.pack(index_magic, dump_size))
+        if dump_size == 0:
+            return 0
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            if kind == 'qmdl':
+                entries = scan_qmdl(parser, buf)
+            elif kind == 'dlf':
+                entries = scan_dlf(buf)
+            elif kind == 'sdmraw':
+                entries = scan_sdmraw(buf)
+            else:
+                entries = scan_sdm(buf)
+
+            for offset, length, cmd, radio_id, log_id, ts in entries:
+                if ts is None:
+                    idx.write(index_record.pack(offset, length, cmd, radio_id, 0, log_id, 0.0))
+                else:
+                    idx.write(index_record.pack(offset, length, cmd, radio_id, 1, log_id, ts))
+                count += 1
+    return count
+
+def read_index(fname):
+    # Returns the index records of the dump file, or None if the index is
+    # missing or does not match the dump
+    try:
+        with open(index_name(fname), 'rb') as idx:
+            data = idx.read()
+    except FileNotFoundError:
+        return None
+
+    if len(data) < index_header.size:
+        return None
+    magic, dump_size = index_header.unpack(data[0:index_header.size])
+    if magic != index_magic or dump_size != os.path.getsize(fname):
+        logger.log(logging.WARNING, 'Index {} is outdated'.format(index_name(fname)))
+        return None
+    body = data[index_header.size:]
+    return index_record.iter_unpack(body[0:len(body) - len(body) % index_record.size])
+
+def lookup(parser, fname, log_ids=None, start=None, end=None):
+    """Selects packets of a dump file using its sidecar index.
+
+    The index is built first if it does not exist yet. Packets without
+    timestamp are selected based on the last timestamp before them.
+
+    Parameters:
+    parser: QualcommParser or SamsungParser matching the dump
+    fname (str): dump file
+    log_ids (list): log IDs to select (Samsung: group << 8 | command)
+    start (datetime): select packets at or after this time
+    end (datetime): select packets before this time
+
+    Returns a list of (offset, length), or None if the dump can not be indexed
+    or a time filter is given but the dump has no timestamps.
+    """
+    if dump_type(parser, fname) is None:
+        return None
+
+    records = read_index(fname)
+    if records is None:
+        logger.log(logging.INFO, 'Building index for {}'.format(fname))
+        build_index(parser, fname)
+        records = read_index(fname)
+
+    log_ids = set(log_ids) if log_ids else None
+    start_ts = start.timestamp() if start else None
+    end_ts = end.timestamp() if end else None
+
+    entries = []
+    last_ts = None
+    for offset, length, cmd, radio_id, has_ts, log_id, ts in records:
+        if has_ts:
+            last_ts = ts
+        if log_ids is not None and log_id not in log_ids:
+            continue
+        if start_ts is not None and (last_ts is None or last_ts < start_ts):
+            continue
+        if end_ts is not None and (last_ts is None or last_ts >= end_ts):
+            continue
+        entries.append((offset, length))
+
+    if (start_ts is not None or end_ts is not None) and last_ts is None:
+        # E.g. raw SDM dumps only carry device ticks
+        logger.log(logging.WARNING, '{} has no packet timestamps, time filters can not be applied'.format(fname))
+        return None
+    return entries
@@ -1,47 +1,99 @@
 #!/usr/bin/env python3
 # coding: utf8
 
-import gzip, bz2
+import logging
+import mmap
 import scat.util as util
+import scat.compression
+from scat.iodevices.readahead import ReadAheadReader
+from scat.iodevices.follow import FollowReader
 
 class FileIO:
-    def _open_file(self, fname):
+    def _close_file(self):
+        if self.mapped is not None:
+            try:
+                self.mapped.close()
+            except BufferError:
+                # Frame views are still referenced, let the GC unmap it
+                pass
+            self.mapped = None
         if self.f:
             self.f.close()
+            self.f = None
+
+    def _open_file(self, fname):
+        self._close_file()
 
-        if fname.find('.gz') > 0:
-            self.f = gzip.open(fname, 'rb')
-        elif fname.find('.bz2') > 0:
-            self.f = bz2.open(fname, 'rb')
+        method = scat.compression.detect_method(fname)
+        # Only the last file is followed, earlier ones are complete
+        if self.follow and len(self.fnames) == 0:
+            if method is None:
+                self.f = FollowReader(fname, idle_timeout=self.follow_timeout)
+                self.mapped_pos = 0
+                return
+            logging.getLogger('scat.fileio').log(logging.WARNING,
+                'Compressed file {} can not be followed, reading it once'.format(fname))
+
+        if method is not None:
+            # Decompressed on separate threads/processes while parsing
+            self.f = ReadAheadReader(fname, method, self.decompress_jobs)
         else:
             self.f = open(fname, 'rb')
+            if self.use_mmap:
+                try:
+                    self.mapped = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+                except (ValueError, OSError):
+                    # Empty file or mmap not supported
+                    self.mapped = None
+        self.mapped_pos = 0
 
-    def __init__(self, fnames):
+    def __init__(self, fnames, use_mmap=False, decompress_jobs=1, follow=False, follow_timeout=None):
         self.fnames = fnames[:]
         self.fnames.reverse()
         self.fname = ''
         self.file_available = True
         self.f = None
         self.block_until_data = False
+        # When set, mapped holds the whole uncompressed file as one buffer
+        self.use_mmap = use_mmap
+        self.mapped = None
+        self.mapped_pos = 0
+        # Parallel decompression of multi-member gzip/bz2 files
+        self.decompress_jobs = decompress_jobs
+        # Keep reading the last file while it grows
+        self.follow = follow
+        self.follow_timeout = follow_timeout
 
         self.open_next_file()
 
     def read(self, read_size, decode_hdlc = False):
         buf = b''
-        try:
-            buf = self.f.read(read_size)
-            buf = bytes(buf)
-        except:
-            return b''
+        if self.mapped is not None:
+            buf = self.mapped[self.mapped_pos:self.mapped_pos + read_size]
+            self.mapped_pos += len(buf)
+        else:
+            try:
+                buf = self.f.read(read_size)
+                buf = bytes(buf)
+            except:
+                return b''
         if decode_hdlc:
             buf = util.unwrap(buf)
         return buf
 
+    def read_at(self, offset, read_size):
+        # Random access for indexed reading, only for uncompressed files
+        if self.mapped is not None:
+            return self.mapped[offset:offset + read_size]
+        self.f.seek(offset)
+        return self.f.read(read_size)
+
     def open_next_file(self):
         try:
             self.fname = self.fnames.pop()
         except IndexError:
             self.file_available = False
+            self._close_file()
             return
         self._open_file(self.fname)
 
@@ -53,5 +105,4 @@ class FileIO:
         self.read(read_size)
 
     def __exit__(self, exc_type, exc_value, traceback):
-        if self.f:
-            self.f.close()
+        self._close_file()
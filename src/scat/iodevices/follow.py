@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+import logging
+import os
+import time
+try:
+    import inotify_simple
+    has_inotify = True
+except ModuleNotFoundError:
+    has_inotify = False
+
+class FollowReader:
+    """Reads a file while it is written, like tail -F.
+
+    read() waits until new data is appended. If the file is truncated,
+    reading restarts at its beginning. If the file name is replaced by a
+    new file (log rotation), the rest of the old file is read before the
+    new one is opened. Waiting uses inotify if the inotify_simple module is
+    available, otherwise the file is polled.
+    """
+    def __init__(self, fname, poll_interval = 0.05, idle_timeout = None):
+        """
+        Parameters:
+        fname (str): file to follow, may not exist yet
+        poll_interval (float): time in seconds between checks without inotify
+        idle_timeout (float): read() returns b'' after this many seconds without data, None to wait forever
+        """
+        self.fname = fname
+        self.poll_interval = poll_interval
+        self.idle_timeout = idle_timeout
+        self.logger = logging.getLogger('scat.follow')
+
+        self.f = None
+        self.file_id = None
+        self.open_file()
+
+        self.inotify = None
+        if has_inotify:
+            try:
+                self.inotify = inotify_simple.INotify()
+                flags = inotify_simple.flags
+                # Watching the directory also reports files being replaced
+                self.inotify.add_watch(os.path.dirname(os.path.abspath(fname)),
+                    flags.MODIFY | flags.CREATE | flags.MOVED_TO | flags.DELETE | flags.CLOSE_WRITE)
+            except OSError as e:
+                self.logger.log(logging.WARNING, 'Cannot use inotify, polling instead: {}'.format(e))
+                self.inotify = None
+
+    def open_file(self):
+        try:
+            self.f = open(self.fname, 'rb')
+        except FileNotFoundError:
+            return False
+        st = os.fstat(self.f.fileno())
+        self.file_id = (st.st_dev, st.st_ino)
+        return True
+
+    def replaced(self):
+        # True if the file name refers to another file than the open one
+        try:
+            st = os.stat(self.fname)
+        except FileNotFoundError:
+            return False
+        return (st.st_dev, st.st_ino) != self.file_id
+
+    def wait(self):
+        if self.inotify is not None:
+            # Events may be missed on network file systems, check at least every second
+            self.inotify.read(timeout=1000)
+        else:
+            time.sleep(self.poll_interval)
+
+    def read(self, size):
+        idle_start = time.monotonic()
+        while True:
+            if self.f is None:
+                if not self.open_file():
+                    if self.idle_timeout is not None and time.monotonic() - idle_start >= self.idle_timeout:
+                        return b''
+                    self.wait()
+                    continue
+                self.logger.log(logging.INFO, 'Following {}'.format(self.fname))
+
+            buf = self.f.read(size)
+            if len(buf) > 0:
+                return buf
+
+            # At the end of the open file
+            if os.fstat(self.f.fileno()).st_size < self.f.tell():
+                self.logger.log(logging.INFO, '{} was truncated, reading from the start'.format(self.fname))
+                self.f.seek(0)
+                continue
+            if self.replaced():
+                # Data written just before the file was replaced
+                buf = self.f.read(size)
+                if len(buf) > 0:
+                    return buf
+                self.logger.log(logging.INFO, '{} was replaced, reopening'.format(self.fname))
+                self.f.close()
+                self.f = None
+                continue
+
+            if self.idle_timeout is not None and time.monotonic() - idle_start >= self.idle_timeout:
+                return b''
+            self.wait()
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+import scat.compression
+
+import bz2
+import concurrent.futures
+import logging
+import lzma
+import mmap
+import queue
+import re
+import threading
+import zlib
+from collections import deque
+
+# Start of a gzip member or a bz2 stream with its first block. These can
+# also occur inside compressed data, so parts split at them are verified
+member_starts = {
+    'gzip': re.compile(rb'\x1f\x8b\x08'),
+    'bz2': re.compile(rb'BZh[1-9]1AY&SY'),
+}
+
+# Errors of broken or truncated compressed data
+decompress_errors = (OSError, EOFError, ValueError, zlib.error, lzma.LZMAError)
+
+def decompress_members(data, method):
+    # Raises ValueError unless data consists of complete gzip members or bz2 streams
+    out = []
+    while len(data) > 0:
+        if method == 'gzip':
+            decompressor = zlib.decompressobj(31)
+        else:
+            decompressor = bz2.BZ2Decompressor()
+        out.append(decompressor.decompress(data))
+        if not decompressor.eof:
+            raise ValueError('Incomplete {} member'.format(method))
+        data = decompressor.unused_data
+    return b''.join(out)
+
+def decompress_range(fname, offset, length, method):
+    # Runs in worker threads or processes
+    with open(fname, 'rb') as f:
+        f.seek(offset)
+        return decompress_members(f.read(length), method)
+
+class ReadAheadReader:
+    """Decompresses a dump file ahead of the reader.
+
+    A separate thread decompresses the file into a bounded queue of blocks.
+    With jobs > 1, gzip and bz2 files consisting of many members (written
+    by CompressedRawWriter, bgzip or pbzip2) are split at member boundaries
+    and the parts are decompressed in parallel, on threads for gzip and on
+    processes for bz2. If a part turns out not to end at a member boundary,
+    the rest of the file is decompressed by the single thread.
+    """
+    def __init__(self, fname, method, jobs = 1, block_size = 0x100000, chunk_size = 0x400000, max_pending = 8):
+        """
+        Parameters:
+        fname (str): compressed file
+        method (str): compression method, see scat.compression
+        jobs (int): number of parallel workers for multi-member gzip and bz2 files
+        block_size (int): size of decompressed blocks of the single thread
+        chunk_size (int): minimum compressed size of parts decompressed in parallel
+        max_pending (int): number of blocks or parts decompressed ahead
+        """
+        self.fname = fname
+        self.method = method
+        self.block_size = block_size
+        self.chunk_size = chunk_size
+        self.max_pending = max_pending
+        self.logger = logging.getLogger('scat.readahead')
+
+        self.block = memoryview(b'')
+        self.block_pos = 0
+        self.closed = False
+
+        # Single thread mode
+        self.thread = None
+        self.queue = None
+        self.finished = False
+
+        # Parallel mode: (offset, future) per part, next part offset
+        self.f = None
+        self.mapped = None
+        self.executor = None
+        self.parts = deque()
+        self.next_offset = None
+
+        if jobs > 1 and method in member_starts:
+            self.f = open(fname, 'rb')
+            try:
+                self.mapped = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # Empty file or mmap not supported
+                self.mapped = None
+
+        if self.mapped is not None:
+            if method == 'bz2':
+                # bz2 decompression holds the GIL for a large part of the time
+                self.executor = concurrent.futures.ProcessPoolExecutor(jobs)
+            else:
+                self.executor = concurrent.futures.ThreadPoolExecutor(jobs)
+            self.next_offset = 0
+        else:
+            self.start_thread(0)
+
+    def start_thread(self, offset):
+        f = open(self.fname, 'rb')
+        f.seek(offset)
+        try:
+            reader = scat.compression.open_compressed(f, self.method, 'rb')
+        except ValueError:
+            f.close()
+            raise
+        self.queue = queue.Queue(self.max_pending)
+        self.thread = threading.Thread(target=self.read_loop, args=(f, reader), daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        while not self.closed:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def read_loop(self, f, reader):
+        try:
+            while not self.closed:
+                block = reader.read(self.block_size)
+                if len(block) == 0:
+                    break
+                self.put(block)
+        except decompress_errors as e:
+            self.put(e)
+        finally:
+            reader.close()
+            f.close()
+        self.put(None)
+
+    def next_part_end(self, offset):
+        # Returns None if no member starts within two chunk sizes
+        size = len(self.mapped)
+        if offset + 2 * self.chunk_size >= size:
+            return size
+        m = member_starts[self.method].search(self.mapped, offset + self.chunk_size, offset + 2 * self.chunk_size)
+        if m is None:
+            return None
+        return m.start()
+
+    def submit_parts(self):
+        while self.next_offset is not None and len(self.parts) < self.max_pending:
+            if self.next_offset >= len(self.mapped):
+                self.next_offset = None
+                break
+            end = self.next_part_end(self.next_offset)
+            if end is None:
+                # Large members, the rest is read by the single thread
+                self.parts.append((self.next_offset, None))
+                self.next_offset = None
+                break
+            self.parts.append((self.next_offset, self.executor.submit(decompress_range,
+                self.fname, self.next_offset, end - self.next_offset, self.method)))
+            self.next_offset = end
+
+    def stop_parallel(self):
+        for _, future in self.parts:
+            if future is not None:
+                future.cancel()
+        self.parts.clear()
+        self.next_offset = None
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        if self.mapped is not None:
+            self.mapped.close()
+            self.mapped = None
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def next_block(self):
+        # Returns None at the end of the file
+        if self.executor is not None:
+            self.submit_parts()
+            if len(self.parts) == 0:
+                self.stop_parallel()
+                return None
+
+            offset, future = self.parts.popleft()
+            if future is not None:
+                try:
+                    return future.result()
+                except decompress_errors as e:
+                    # The part did not start or end at a member boundary. All
+                    # parts before ended exactly at offset, so it is one
+                    self.logger.log(logging.DEBUG, 'Cannot decompress part at {}: {}'.format(offset, e))
+            self.stop_parallel()
+            self.start_thread(offset)
+
+        if self.queue is None or self.finished:
+            return None
+        item = self.queue.get()
+        if item is None:
+            self.finished = True
+            return None
+        if isinstance(item, Exception):
+            self.finished = True
+            raise item
+        return item
+
+    def read(self, size):
+        if self.block_pos >= len(self.block):
+            block = self.next_block()
+            while block is not None and len(block) == 0:
+                block = self.next_block()
+            if block is None:
+                return b''
+            self.block = memoryview(block)
+            self.block_pos = 0
+
+        if self.block_pos + size <= len(self.block):
+            buf = self.block[self.block_pos:self.block_pos + size].tobytes()
+            self.block_pos += size
+            return buf
+
+        # Rest of the current block followed by the next blocks
+        buf = bytearray(self.block[self.block_pos:])
+        self.block_pos = len(self.block)
+        while len(buf) < size:
+            data = self.read(size - len(buf))
+            if len(data) == 0:
+                break
+            buf += data
+        return bytes(buf)
+
+    def close(self):
+        self.closed = True
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.stop_parallel()
+        self.block = memoryview(b'')
@@ -3,23 +3,145 @@
 
 import serial
 import scat.util as util
+import logging
+import threading
+
+class RingBuffer:
+    """Fixed size byte FIFO between one producer and one consumer thread.
+
+    Data which does not fit is dropped and counted in dropped_bytes. An
+    error of the producer is raised by get() after the buffered data.
+    """
+    def __init__(self, size):
+        self.buf = bytearray(size)
+        self.size = size
+        self.read_pos = 0
+        self.fill = 0
+        self.dropped_bytes = 0
+        self.error = None
+        self.cond = threading.Condition()
+
+    def put(self, data):
+        with self.cond:
+            put_len = min(len(data), self.size - self.fill)
+            self.dropped_bytes += len(data) - put_len
+
+            write_pos = (self.read_pos + self.fill) % self.size
+            first_len = min(put_len, self.size - write_pos)
+            self.buf[write_pos:write_pos + first_len] = data[0:first_len]
+            self.buf[0:put_len - first_len] = data[first_len:put_len]
+            self.fill += put_len
+            if put_len > 0:
+                self.cond.notify()
+
+    def put_error(self, error):
+        with self.cond:
+            self.error = error
+            self.cond.notify()
+
+    def get(self, max_size, timeout=None):
+        with self.cond:
+            if self.fill == 0 and self.error is None:
+                self.cond.wait(timeout)
+            if self.fill == 0 and self.error is not None:
+                raise self.error
+
+            get_len = min(max_size, self.fill)
+            first_len = min(get_len, self.size - self.read_pos)
+            data = bytes(self.buf[self.read_pos:self.read_pos + first_len])
+            if get_len > first_len:
+                data += self.buf[0:get_len - first_len]
+            self.read_pos = (self.read_pos + get_len) % self.size
+            self.fill -= get_len
+            return data
+
+    def __len__(self):
+        return self.fill
 
 class SerialIO:
+    # Port timeout and minimum read size of the background reader
+    reader_modes = {
+        'latency': (0.01, 1),
+        'throughput': (0.1, 0x1000),
+    }
+
     def __init__(self, port_name, baudrate=115200, rts=True, dsr=True):
         self.port = serial.Serial(port_name, baudrate=baudrate, timeout=0.5, rtscts=rts, dsrdtr=dsr)
         self.block_until_data = True
+        self.logger = logging.getLogger('scat.serialio')
+
+        # Background reader, see start_reader()
+        self.reader_thread = None
+        self.reader_stop = threading.Event()
+        self.ring_buffer = None
+        self.reported_overrun_bytes = 0
 
     def __enter__(self):
         return self
 
     def read(self, read_size, decode_hdlc = False):
         buf = b''
-        buf = self.port.read(read_size)
+        if self.reader_thread is not None:
+            self.report_overrun()
+            buf = self.ring_buffer.get(read_size, timeout=0.5)
+        else:
+            buf = self.port.read(read_size)
         buf = bytes(buf)
         if decode_hdlc:
             buf = util.unwrap(buf)
         return buf
 
+    def backlog(self):
+        # Fill level of the ring buffer
+        if self.reader_thread is None:
+            return 0.0
+        return len(self.ring_buffer) / self.ring_buffer.size
+
+    def report_overrun(self):
+        if self.ring_buffer.dropped_bytes != self.reported_overrun_bytes:
+            self.logger.log(logging.WARNING, 'Serial reader overrun: dropped {} bytes in total'.format(self.ring_buffer.dropped_bytes))
+            self.reported_overrun_bytes = self.ring_buffer.dropped_bytes
+
+    def reader_loop(self, min_read_size):
+        while not self.reader_stop.is_set():
+            try:
+                buf = self.port.read(max(self.port.in_waiting, min_read_size))
+            except serial.SerialException as e:
+                # Raised by read() once the buffered data is consumed
+                self.logger.log(logging.WARNING, 'Serial read error: {}'.format(e))
+                self.ring_buffer.put_error(e)
+                break
+            if len(buf) > 0:
+                self.ring_buffer.put(buf)
+
+    def start_reader(self, mode='throughput', buffer_size=0x100000):
+        """Drains the serial port into a ring buffer in a background thread.
+
+        Parameters:
+        mode (str): 'latency' hands over every byte as soon as it arrives,
+                    'throughput' waits for larger reads
+        buffer_size (int): size of the ring buffer
+        """
+        if self.reader_thread is not None:
+            return
+
+        timeout, min_read_size = self.reader_modes[mode]
+        self.port.timeout = timeout
+        self.ring_buffer = RingBuffer(buffer_size)
+        self.reported_overrun_bytes = 0
+
+        self.reader_stop.clear()
+        self.reader_thread = threading.Thread(target=self.reader_loop, args=(min_read_size, ), daemon=True)
+        self.reader_thread.start()
+
+    def stop_reader(self):
+        if self.reader_thread is None:
+            return
+        self.reader_stop.set()
+        self.reader_thread.join()
+        self.reader_thread = None
+        self.report_overrun()
+
     def write(self, write_buf, encode_hdlc = False):
         if encode_hdlc:
             write_buf = util.wrap(write_buf)
@@ -30,4 +152,5 @@ class SerialIO:
         self.read(read_size)
 
     def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_reader()
         self.port.close()
@@ -4,16 +4,35 @@
 import usb
 import scat.util as util
 import logging
+import errno
+import queue
+import threading
+from array import array
 
 class USBIO:
     def __init__(self):
         self.usb_dev = None
         self.block_until_data = True
+        self.logger = logging.getLogger('scat.usbio')
+
+        # Background reader, see start_reader()
+        self.reader_thread = None
+        self.reader_stop = threading.Event()
+        self.free_buffers = None
+        self.filled_buffers = None
+        self.num_buffers = 0
+        self.overflow_bytes = 0
+        self.reported_overflow_bytes = 0
+        self.reader_error = None
 
     def __enter__(self):
         return self
 
     def read(self, read_size, decode_hdlc = False):
+        if self.reader_thread is not None:
+            # Returns one completed transfer regardless of read_size
+            return self.read_queued(decode_hdlc)
+
         buf = b''
         try:
             buf = self.r_handle.read(read_size)
@@ -24,6 +43,94 @@ class USBIO:
             buf = util.unwrap(buf)
         return buf
 
+    def report_overflow(self):
+        if self.overflow_bytes != self.reported_overflow_bytes:
+            self.logger.log(logging.WARNING, 'USB reader overflow: dropped {} bytes in total'.format(self.overflow_bytes))
+            self.reported_overflow_bytes = self.overflow_bytes
+
+    def read_queued(self, decode_hdlc = False):
+        self.report_overflow()
+
+        try:
+            transfer_buf, transfer_len = self.filled_buffers.get(timeout=0.5)
+        except queue.Empty:
+            # An error of the reader thread is raised after the queued transfers
+            if self.reader_error is not None and self.filled_buffers.empty():
+                raise self.reader_error
+            return b''
+        buf = bytes(memoryview(transfer_buf)[0:transfer_len])
+        self.free_buffers.put(transfer_buf)
+
+        if decode_hdlc:
+            buf = util.unwrap(buf)
+        return buf
+
+    def backlog(self):
+        # Fraction of the transfer buffers waiting for the parser
+        if self.reader_thread is None:
+            return 0.0
+        return self.filled_buffers.qsize() / self.num_buffers
+
+    def reader_loop(self, transfer_size):
+        # Used when all preallocated buffers are waiting for the parser
+        scratch_buf = array('B', bytes(transfer_size))
+
+        while not self.reader_stop.is_set():
+            try:
+                transfer_buf = self.free_buffers.get_nowait()
+            except queue.Empty:
+                transfer_buf = None
+
+            try:
+                transfer_len = self.r_handle.read(transfer_buf if transfer_buf is not None else scratch_buf, timeout=100)
+            except usb.core.USBError as e:
+                if e.errno != errno.ETIMEDOUT:
+                    # E.g. ENODEV after unplugging, raised by read()
+                    self.logger.log(logging.WARNING, 'USB read error: {}'.format(e))
+                    self.reader_error = e
+                    self.reader_stop.set()
+                transfer_len = 0
+
+            if transfer_buf is None:
+                self.overflow_bytes += transfer_len
+            elif transfer_len > 0:
+                self.filled_buffers.put((transfer_buf, transfer_len))
+            else:
+                self.free_buffers.put(transfer_buf)
+
+    def start_reader(self, transfer_size=0x4000, num_buffers=64):
+        """Reads the bulk IN endpoint in a background thread.
+
+        Transfers are read into preallocated buffers and queued for read().
+        When the parser falls behind and all buffers are queued, the device
+        is still drained and the dropped bytes are counted in overflow_bytes.
+
+        Parameters:
+        transfer_size (int): size of each bulk IN transfer
+        num_buffers (int): number of preallocated transfer buffers
+        """
+        if self.reader_thread is not None:
+            return
+
+        self.free_buffers = queue.Queue()
+        self.filled_buffers = queue.Queue()
+        self.num_buffers = num_buffers
+        for i in range(num_buffers):
+            self.free_buffers.put(array('B', bytes(transfer_size)))
+
+        self.reader_error = None
+        self.reader_stop.clear()
+        self.reader_thread = threading.Thread(target=self.reader_loop, args=(transfer_size, ), daemon=True)
+        self.reader_thread.start()
+
+    def stop_reader(self):
+        if self.reader_thread is None:
+            return
+        self.reader_stop.set()
+        self.reader_thread.join()
+        self.reader_thread = None
+        self.report_overflow()
+
     def write(self, write_buf, encode_hdlc = False):
         if encode_hdlc:
             write_buf = util.wrap(write_buf)
@@ -81,6 +188,7 @@ class USBIO:
         self.dev.set_configuration(config)
 
     def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_reader()
         if self.usb_dev is not None:
             usb.util.dispose_resources(self.usb_dev)
 
@@ -4,8 +4,12 @@
 import scat.iodevices
 import scat.writers
 import scat.parsers
+import scat.parallel
+import scat.index
+import scat.compression
 
 import os, sys
+import datetime
 import argparse
 import signal
 import faulthandler
@@ -13,6 +17,7 @@ import logging
 import importlib.metadata
 
 current_parser = None
+open_writers = []
 logger = logging.getLogger('scat')
 __version__ = importlib.metadata.version(__package__ or 'scat')
 
@@ -23,9 +28,19 @@ if os.name != 'nt':
 def sigint_handler(signal, frame):
     global current_parser
     current_parser.stop_diag()
+    close_writers()
     sys.exit(0)
 
 
+def close_writers():
+    # Writes out buffered packets, not every writer holds resources
+    global open_writers
+    for writer in open_writers:
+        if hasattr(writer, '__exit__'):
+            writer.__exit__(None, None, None)
+    open_writers = []
+
+
 def hexint(string):
     if string[0:2] == '0x' or string[0:2] == '0X':
         return int(string[2:], 16)
@@ -33,6 +48,66 @@ def hexint(string):
         return int(string)
 
 
+def bytesize(string):
+    # Accepts an optional K, M or G suffix
+    units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+    if string[-1:].upper() in units:
+        return int(string[:-1]) * units[string[-1:].upper()]
+    return hexint(string)
+
+
+def make_rotation(args):
+    # Every file writer needs its own rotation state
+    if args.rotate_size is None and args.rotate_interval is None and args.rotate_packets is None:
+        return None
+    return scat.writers.SegmentRotation(args.rotate_size, args.rotate_interval, args.rotate_packets,
+        args.rotate_compress, args.rotate_keep)
+
+
+output_kinds = ['udp', 'pcap', 'pcapng', 'json', 'raw']
+
+
+def output_spec(string):
+    # KIND:TARGET[@LAYERS[@RADIO_IDS]]
+    kind, sep, rest = string.partition(':')
+    if not sep or not kind in output_kinds:
+        raise argparse.ArgumentTypeError('expected KIND:TARGET with KIND one of {}'.format(', '.join(output_kinds)))
+    target, _, filters = rest.partition('@')
+    out_layers, _, radio_ids = filters.partition('@')
+    return (kind, target,
+        out_layers.split(',') if out_layers else None,
+        [int(x) for x in radio_ids.split(',')] if radio_ids else None)
+
+
+def make_writer(args, kind, target):
+    if kind == 'udp':
+        host, _, port = target.partition(':')
+        return scat.writers.SocketWriter(host if host else args.hostname, int(port) if port else args.port, args.port_up)
+    elif kind == 'pcapng':
+        return scat.writers.PcapngWriter(target, args.port, args.port_up,
+            args.pcap_buffer_size, args.pcap_flush_interval, args.pcapng_exported_pdu, make_rotation(args))
+    elif kind == 'pcap':
+        return scat.writers.PcapWriter(target, args.port, args.port_up,
+            args.pcap_buffer_size, args.pcap_flush_interval, make_rotation(args))
+    elif kind == 'json':
+        return scat.writers.JsonWriter(target)
+    elif kind == 'raw':
+        if args.raw_compress:
+            suffix = scat.compression.suffixes[args.raw_compress]
+            if not target.endswith(suffix):
+                target += suffix
+            return scat.writers.CompressedRawWriter(target, args.raw_compress)
+        return scat.writers.RawWriter(target, rotation=make_rotation(args))
+
+
+def isotime(string):
+    # Timestamps without timezone are treated as UTC
+    ts = datetime.datetime.fromisoformat(string)
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=datetime.timezone.utc)
+    return ts
+
+
 class ListUSBAction(argparse.Action):
     # List USB devices and then exit
     def __call__(self, parser, namespace, values, option_string=None):
@@ -42,6 +117,7 @@ class ListUSBAction(argparse.Action):
 
 def scat_main():
     global current_parser
+    global open_writers
     # Load parser modules
     parser_dict = {}
     for parser_module in dir(scat.parsers):
@@ -75,6 +151,10 @@ def scat_main():
     serial_group.add_argument('-b', '--baudrate', help='Set the serial baud rate', type=int, default=115200)
     serial_group.add_argument('--no-rts', action='store_true', help='Do not enable the RTS/CTS')
     serial_group.add_argument('--no-dsr', action='store_true', help='Do not enable the DSR/DTR')
+    serial_group.add_argument('--serial-reader', choices=['latency', 'throughput'],
+                              help='Read from the serial port in a background thread, tuned for low latency or high throughput')
+    serial_group.add_argument('--serial-buffer-size', help='Size of the background reader buffer. Default: 0x100000',
+                              type=hexint, default=0x100000)
 
     usb_group = parser.add_argument_group('USB device settings')
     usb_group.add_argument('-v', '--vendor', help='Specify USB vendor ID', type=hexint)
@@ -82,6 +162,41 @@ def scat_main():
     usb_group.add_argument('-a', '--address', help='Specify USB device address(bus:address)', type=str)
     usb_group.add_argument('-c', '--config', help='Specify USB configuration number for DM port', type=int, default=-1)
     usb_group.add_argument('-i', '--interface', help='Specify USB interface number for DM port', type=int, default=2)
+    usb_group.add_argument('--usb-async', action='store_true',
+                           help='Read from the DM port in a background thread to avoid losing data while parsing')
+    usb_group.add_argument('--usb-transfer-size', help='Size of each USB transfer with --usb-async. Default: 0x4000',
+                           type=hexint, default=0x4000)
+    usb_group.add_argument('--usb-buffers', help='Number of USB transfers queued for parsing with --usb-async. Default: 64',
+                           type=int, default=64)
+
+    dump_group = parser.add_argument_group('Dump file settings')
+    dump_group.add_argument('--mmap', action='store_true',
+                            help='Memory-map uncompressed dump files instead of reading them in chunks')
+    dump_group.add_argument('--decompress-jobs', type=int, default=1,
+                            help='Decompress gzip/bz2 dumps consisting of many members (e.g. written with --raw-compress, '
+                                 'bgzip or pbzip2) with the given number of threads (gzip) or processes (bz2). '
+                                 'Compressed dumps are always decompressed ahead on a separate thread. Default: 1')
+    dump_group.add_argument('-f', '--follow', action='store_true',
+                            help='Keep reading the last dump file while it is written, like tail -F. Handles the file '
+                                 'being truncated or replaced. Stop with Ctrl-C')
+    dump_group.add_argument('--follow-timeout', type=float,
+                            help='With --follow, stop after no data was appended for N seconds')
+    dump_group.add_argument('-j', '--jobs', type=int, default=1,
+                            help='Parse multiple dump files in parallel using the given number of processes. '
+                                 'A single QMDL file is decoded in chunks instead (Qualcomm only)')
+    dump_group.add_argument('--split-output', action='store_true',
+                            help='Write one PCAP file per dump file, in the format of --pcap-format, instead of one merged file. '
+                                 'Files are parsed in parallel with --jobs. Requires --pcap-file')
+    dump_group.add_argument('--build-index', action='store_true',
+                            help='Write a sidecar index (<dump>.idx) for each dump file and exit (Qualcomm and Samsung only)')
+    dump_group.add_argument('--log-id', type=hexint, action='append',
+                            help='Parse only packets with this log ID using the sidecar index, can be repeated. '
+                                 'For Samsung, the ID is (group << 8) | command. Dumps that can not be indexed are read whole')
+    dump_group.add_argument('--start-time', type=isotime,
+                            help='Parse only packets at or after this device time (ISO 8601, default UTC) using the sidecar index. '
+                                 'Dumps without timestamps (raw SDM) are read whole')
+    dump_group.add_argument('--end-time', type=isotime,
+                            help='Parse only packets before this device time (ISO 8601, default UTC) using the sidecar index')
 
     if 'qc' in parser_dict.keys():
         qc_group = parser.add_argument_group('Qualcomm specific settings')
@@ -99,6 +214,24 @@ def scat_main():
                               help='Display raw values of UE CA combo information on 4G/5G (0xB0CD/0xB826)')
         qc_group.add_argument('--disable-crc-check', action='store_true',
                               help='Disable CRC mismatch checks. Improves performance by avoiding CRC calculations.')
+        qc_group.add_argument('--crc-check-interval', type=int, default=1,
+                              help='Check CRC of every Nth packet only. Default: 1 (all packets)')
+        qc_group.add_argument('--capability-cache', metavar='FILE',
+                              help='Cache queried log and message ID ranges per firmware build in FILE, skipping the queries on later starts')
+        qc_group.add_argument('--mask-log-code', type=hexint, action='append',
+                              help='Enable only this log code on the device (e.g. 0xb0c0) instead of the --layer based defaults, can be repeated')
+        qc_group.add_argument('--mask-event', type=hexint, action='append',
+                              help='Enable only this event ID on the device, can be repeated. Implies --events')
+        qc_group.add_argument('--mask-ssid', type=hexint, action='append',
+                              help='Enable only this Extended Message Report SSID on the device, can be repeated. Implies --msgs')
+        qc_group.add_argument('--shed-log-code', type=hexint, action='append',
+                              help='Low priority log code (e.g. 0xb064) disabled on the device while the host falls behind, can be repeated')
+        qc_group.add_argument('--shed-high-water', type=float, default=0.75,
+                              help='Reader backlog (0.0 - 1.0) at which --shed-log-code codes are disabled. Default: 0.75')
+        qc_group.add_argument('--shed-low-water', type=float, default=0.25,
+                              help='Reader backlog (0.0 - 1.0) at which --shed-log-code codes are enabled again. Default: 0.25')
+        qc_group.add_argument('--shed-max-lag', type=float, default=2.0,
+                              help='Parse lag behind the device clock in seconds at which --shed-log-code codes are disabled. Default: 2.0')
 
     if 'sec' in parser_dict.keys():
         sec_group = parser.add_argument_group('Samsung specific settings')
@@ -117,6 +250,8 @@ def scat_main():
             hisi_group.add_argument('--msgs', action='store_true', help='Decode debug messages GSMTAP logging')
             hisi_group.add_argument('--disable-crc-check', action='store_true',
                                     help='Disable CRC mismatch checks. Improves performance by avoiding CRC calculations.')
+            hisi_group.add_argument('--crc-check-interval', type=int, default=1,
+                                    help='Check CRC of every Nth packet only. Default: 1 (all packets)')
         except argparse.ArgumentError:
             pass
 
@@ -128,9 +263,43 @@ def scat_main():
                           type=str, default='127.0.0.1')
 
     ip_group.add_argument('-F', '--pcap-file', help='Write GSMTAP packets directly to specified PCAP file')
+    ip_group.add_argument('--output', type=output_spec, action='append',
+                          help='Additional output as KIND:TARGET[@LAYERS[@RADIO_IDS]], can be given multiple times. '
+                               'KIND is one of {}. TARGET is a host[:port] for udp, a file name otherwise, - for json '
+                               'on standard output. LAYERS and RADIO_IDS are comma separated, without LAYERS the '
+                               'layers of -L are used. raw writes the QMDL/SDM stream of serial/USB devices. '
+                               'Example: --output udp:127.0.0.1@rrc,nas --output pcap:radio1.pcap@@1'.format(', '.join(output_kinds)))
+    ip_group.add_argument('--raw-compress', choices=scat.compression.available_methods(),
+                          help='Compress QMDL/SDM outputs while writing, the file name gets the suffix of the method. '
+                               'These outputs are not rotated')
+    ip_group.add_argument('--pcap-format', choices=['pcap', 'pcapng'], default='pcap',
+                          help='File format of --pcap-file. pcapng uses one interface per radio ID. Default: pcap')
+    ip_group.add_argument('--pcapng-exported-pdu', action='store_true',
+                          help='With --pcap-format pcapng, store GSMTAP and IP packets without the Ethernet/IP/UDP wrapper')
+    ip_group.add_argument('--pcap-buffer-size', type=hexint, default=0x100000,
+                          help='Collect PCAP records up to this size before writing. Default: 0x100000')
+    ip_group.add_argument('--pcap-flush-interval', type=float, default=1.0,
+                          help='Write buffered PCAP records at least every N seconds. Default: 1.0')
+    ip_group.add_argument('--async-writer', choices=scat.writers.AsyncWriter.policies,
+                          help='Write output on a separate thread. The argument selects what happens when the queue is full: '
+                               'wait, drop the oldest or drop the newest packet')
+    ip_group.add_argument('--async-queue-size', type=int, default=0x10000,
+                          help='Number of packets queued with --async-writer. Default: 65536')
     ip_group.add_argument('-C', '--combine-stdout', action='store_true',
                           help='Write standard output messages as osmocore log file, along with other GSMTAP packets.')
 
+    rotate_group = parser.add_argument_group('Output rotation settings')
+    rotate_group.add_argument('--rotate-size', type=bytesize,
+                              help='Start a new PCAP/QMDL/SDM segment file after N bytes, K/M/G suffixes are accepted')
+    rotate_group.add_argument('--rotate-interval', type=float,
+                              help='Start a new segment file every N seconds')
+    rotate_group.add_argument('--rotate-packets', type=int,
+                              help='Start a new segment file after N packets')
+    rotate_group.add_argument('--rotate-compress', choices=scat.compression.available_methods(),
+                              help='Compress finished segment files in the background')
+    rotate_group.add_argument('--rotate-keep', type=int,
+                              help='Keep only the last N finished segment files')
+
     args = parser.parse_args()
 
     GSMTAP_IP = args.hostname
@@ -149,6 +318,23 @@ def scat_main():
             print('Error: invalid layer {} specified. Available layers: {}'.format(l, ', '.join(valid_layers)))
             sys.exit(1)
 
+    outputs = args.output if args.output else []
+    for kind, target, out_layers, radio_ids in outputs:
+        for l in (out_layers if out_layers else []):
+            if not l in valid_layers:
+                print('Error: invalid layer {} specified. Available layers: {}'.format(l, ', '.join(valid_layers)))
+                sys.exit(1)
+        if kind == 'raw' and (out_layers or radio_ids):
+            print('Error: raw outputs can not be filtered by layer or radio ID.')
+            sys.exit(1)
+        if kind == 'raw' and not (args.serial or args.usb):
+            print('Error: raw outputs require a serial or USB device.')
+            sys.exit(1)
+
+    if args.follow and (args.jobs > 1 or args.split_output or args.build_index or args.log_id or args.start_time or args.end_time):
+        print('Error: --follow can not be combined with --jobs, --split-output, --build-index or index filters.')
+        sys.exit(1)
+
     # Device preparation
     io_device = None
     if args.serial:
@@ -169,34 +355,65 @@ def scat_main():
             io_device.set_configuration(args.config)
         io_device.claim_interface(args.interface)
     elif args.dump:
-        io_device = scat.iodevices.FileIO(args.dump)
+        io_device = scat.iodevices.FileIO(args.dump, args.mmap, args.decompress_jobs, args.follow, args.follow_timeout)
     else:
         print('Error: no device specified.')
         sys.exit(1)
 
     # Writer preparation
-    if args.pcap_file == None:
+    if args.split_output:
+        if args.pcap_file == None:
+            print('Error: --split-output requires --pcap-file.')
+            sys.exit(1)
+        if not args.dump:
+            print('Error: --split-output requires dump files.')
+            sys.exit(1)
+        if args.output or make_rotation(args) is not None:
+            print('Error: --split-output can not be combined with --output or output rotation.')
+            sys.exit(1)
+        # Each worker process writes its own PCAP file
+        writer = scat.writers.NullWriter()
+    elif len([x for x in outputs if x[0] != 'raw']) > 0:
+        # Parse once, write to every output with its own filter
+        writer = scat.writers.FanoutWriter()
+        if args.pcap_file != None:
+            outputs = [(args.pcap_format, args.pcap_file, None, None)] + outputs
+        parser_layers = set()
+        for kind, target, out_layers, radio_ids in outputs:
+            if kind == 'raw':
+                continue
+            out_writer = make_writer(args, kind, target)
+            if args.async_writer:
+                out_writer = scat.writers.AsyncWriter(out_writer, args.async_queue_size, args.async_writer)
+            writer.add_writer(out_writer, out_layers if out_layers else layers, radio_ids)
+            parser_layers.update(out_layers if out_layers else layers)
+        layers = [l for l in valid_layers if l in parser_layers]
+    elif args.pcap_file == None:
         writer = scat.writers.SocketWriter(GSMTAP_IP, GSMTAP_PORT, IP_OVER_UDP_PORT)
     else:
-        writer = scat.writers.PcapWriter(args.pcap_file, GSMTAP_PORT, IP_OVER_UDP_PORT)
+        writer = make_writer(args, args.pcap_format, args.pcap_file)
+    if args.async_writer and not isinstance(writer, scat.writers.FanoutWriter):
+        writer = scat.writers.AsyncWriter(writer, args.async_queue_size, args.async_writer)
+    open_writers = [writer]
 
     current_parser = parser_dict[args.type]
     current_parser.set_io_device(io_device)
     current_parser.set_writer(writer)
 
     if args.debug:
-        logger.setLevel(logging.DEBUG)
-        current_parser.set_parameter({'log_level': logging.DEBUG})
+        log_level = logging.DEBUG
     else:
-        logger.setLevel(logging.INFO)
-        current_parser.set_parameter({'log_level': logging.INFO})
+        log_level = logging.INFO
+    logger.setLevel(log_level)
+    current_parser.set_parameter({'log_level': log_level})
     ch = logging.StreamHandler(stream=sys.stdout)
     f = logging.Formatter('%(asctime)s %(name)s (%(funcName)s) %(levelname)s: %(message)s')
     ch.setFormatter(f)
     logger.addHandler(ch)
 
+    parser_params = {}
     if args.type == 'qc':
-        current_parser.set_parameter({
+        parser_params = {
             'qsr-hash': args.qsr_hash,
             'qsr4-hash': args.qsr4_hash,
             'events': args.events,
@@ -204,22 +421,38 @@ def scat_main():
             'cacombos': args.cacombos,
             'combine-stdout': args.combine_stdout,
             'disable-crc-check': args.disable_crc_check,
+            'crc-check-interval': args.crc_check_interval,
+            'capability-cache': args.capability_cache,
+            'log-codes': args.mask_log_code,
+            'event-ids': args.mask_event,
+            'emr-ssids': args.mask_ssid,
+            'shed-log-codes': args.shed_log_code,
+            'shed-high-water': args.shed_high_water,
+            'shed-low-water': args.shed_low_water,
+            'shed-max-lag': args.shed_max_lag,
             'layer': layers,
-            'json': args.json})
+            'json': args.json}
     elif args.type == 'sec':
-        current_parser.set_parameter({
+        parser_params = {
             'model': args.model,
             'start-magic': args.start_magic,
             'trace': args.trace,
             'ilm': args.ilm,
             'combine-stdout': args.combine_stdout,
-            'layer': layers})
+            'layer': layers}
     elif args.type == 'hisi':
-        current_parser.set_parameter({
+        parser_params = {
             'msgs': args.msgs,
             'combine-stdout': args.combine_stdout,
             'disable-crc-check': args.disable_crc_check,
-            'layer': layers})
+            'crc-check-interval': args.crc_check_interval,
+            'layer': layers}
+    if args.log_id or args.start_time or args.end_time:
+        parser_params['index-filter'] = {
+            'log_ids': args.log_id,
+            'start': args.start_time,
+            'end': args.end_time}
+    current_parser.set_parameter(parser_params)
 
     # Run process
     if args.serial or args.usb:
@@ -229,20 +462,60 @@ def scat_main():
 
         signal.signal(signal.SIGINT, sigint_handler)
 
+        if args.usb and args.usb_async:
+            io_device.start_reader(args.usb_transfer_size, args.usb_buffers)
+        elif args.serial and args.serial_reader:
+            io_device.start_reader(args.serial_reader, args.serial_buffer_size)
+
+        raw_files = [x[1] for x in outputs if x[0] == 'raw']
         if not (args.qmdl == None) and args.type == 'qc':
-            current_parser.run_diag(scat.writers.RawWriter(args.qmdl))
-        if not (args.sdmraw == None) and args.type == 'sec':
-            current_parser.run_diag(scat.writers.RawWriter(args.sdmraw))
+            raw_files.insert(0, args.qmdl)
+        elif not (args.sdmraw == None) and args.type == 'sec':
+            raw_files.insert(0, args.sdmraw)
+
+        raw_writer = None
+        if len(raw_files) > 0:
+            raw_writer = scat.writers.FanoutWriter()
+            for fname in raw_files:
+                out_writer = make_writer(args, 'raw', fname)
+                if args.async_writer:
+                    out_writer = scat.writers.AsyncWriter(out_writer, args.async_queue_size, args.async_writer)
+                raw_writer.add_writer(out_writer)
+            open_writers.append(raw_writer)
+            current_parser.run_diag(raw_writer)
         else:
             current_parser.run_diag()
 
         current_parser.stop_diag()
+    elif args.dump and args.build_index:
+        for fname in args.dump:
+            try:
+                count = scat.index.build_index(current_parser, fname)
+                logger.log(logging.INFO, 'Indexed {} packets of {}'.format(count, fname))
+            except ValueError as e:
+                logger.log(logging.WARNING, str(e))
     elif args.dump:
-        current_parser.read_dump()
+        if args.split_output or (args.jobs > 1 and len(args.dump) > 1):
+            parser_params['log_level'] = log_level
+            scat.parallel.read_dump_parallel(type(current_parser), parser_params, args.dump, writer, args.jobs,
+                io_args={'use_mmap': args.mmap},
+                split_output=args.pcap_file if args.split_output else None,
+                port_cp=GSMTAP_PORT, port_up=IP_OVER_UDP_PORT,
+                pcap_format=args.pcap_format, exported_pdu=args.pcapng_exported_pdu)
+        else:
+            if args.type == 'qc':
+                current_parser.set_parameter({'jobs': args.jobs})
+            try:
+                current_parser.read_dump()
+            except KeyboardInterrupt:
+                # Not every dump format handles it, stopping --follow is expected
+                pass
     else:
         assert ('Invalid input handler?')
         sys.exit(1)
 
+    close_writers()
+
 
 if __name__ == '__main__':
     scat_main()
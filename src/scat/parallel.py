@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+import scat.iodevices
+import scat.writers
+import scat.util as util
+import scat.compression
+
+from array import array
+from collections import deque
+import datetime
+import heapq
+import logging
+import multiprocessing
+import os
+import struct
+import tempfile
+from pathlib import Path
+
+logger = logging.getLogger('scat.parallel')
+
+class SpoolWriter:
+    """Stores write_cp/write_up calls into a file for later merging.
+
+    Record: type (0 = CP, 1 = UP), radio ID, timestamp flag, timestamp as
+    POSIX seconds, payload length, layer length, layer, payload.
+    """
+    record_header = struct.Struct('<BBBdIB')
+    # Keeps the layer for per-output filters of FanoutWriter
+    takes_layer = True
+
+    def __init__(self, fname):
+        self.spool_file = open(fname, 'wb')
+
+    def __enter__(self):
+        return self
+
+    def write_pkt(self, pkt_type, sock_content, radio_id, ts, layer):
+        layer = layer.encode() if layer is not None else b''
+        if ts is None:
+            hdr = self.record_header.pack(pkt_type, radio_id, 0, 0.0, len(sock_content), len(layer))
+        else:
+            hdr = self.record_header.pack(pkt_type, radio_id, 1, ts.timestamp(), len(sock_content), len(layer))
+        self.spool_file.write(hdr)
+        self.spool_file.write(layer)
+        self.spool_file.write(sock_content)
+
+    def write_cp(self, sock_content, radio_id=0, ts=None, layer=None):
+        self.write_pkt(0, sock_content, radio_id, ts, layer)
+
+    def write_up(self, sock_content, radio_id=0, ts=None, layer=None):
+        self.write_pkt(1, sock_content, radio_id, ts, layer)
+
+    def close(self):
+        self.spool_file.close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def read_spool(fname):
+    # Yields (sort key, type, radio ID, timestamp, payload, layer)
+    # Records without timestamp inherit the previous one for ordering
+    hdr_len = SpoolWriter.record_header.size
+    last_ts = float('-inf')
+    with open(fname, 'rb') as f:
+        while True:
+            hdr = f.read(hdr_len)
+            if len(hdr) < hdr_len:
+                break
+            pkt_type, radio_id, has_ts, ts, pkt_len, layer_len = SpoolWriter.record_header.unpack(hdr)
+            layer = f.read(layer_len).decode() if layer_len > 0 else None
+            sock_content = f.read(pkt_len)
+            if has_ts:
+                last_ts = ts
+                ts = datetime.datetime.fromtimestamp(ts, tz=datetime.timezone.utc)
+            else:
+                ts = None
+            yield (last_ts, pkt_type, radio_id, ts, sock_content, layer)
+
+def replay_file(task):
+    parser_class, params, fname, io_args, writer_args = task
+
+    parser = parser_class()
+    parser.set_parameter(params)
+    parser.set_io_device(scat.iodevices.FileIO([fname], **io_args))
+
+    if writer_args[0] == 'pcap':
+        writer = scat.writers.PcapWriter(*writer_args[1:])
+    elif writer_args[0] == 'pcapng':
+        writer = scat.writers.PcapngWriter(*writer_args[1:])
+    else:
+        writer = SpoolWriter(writer_args[1])
+    parser.set_writer(writer)
+
+    try:
+        parser.read_dump()
+    finally:
+        writer.__exit__(None, None, None)
+    return fname
+
+def split_output_name(pcap_file, fname, used_names, pcap_format='pcap'):
+    pcap_path = Path(pcap_file)
+    suffix = pcap_path.suffix if pcap_path.suffix else '.' + pcap_format
+    out_name = pcap_path.with_name('{}_{}{}'.format(pcap_path.stem, Path(fname).stem, suffix))
+    i = 1
+    while out_name in used_names:
+        out_name = pcap_path.with_name('{}_{}_{}{}'.format(pcap_path.stem, Path(fname).stem, i, suffix))
+        i += 1
+    used_names.add(out_name)
+    return str(out_name)
+
+def read_dump_parallel(parser_class, params, fnames, writer, jobs, io_args={},
+        split_output=None, port_cp=4729, port_up=47290, pcap_format='pcap', exported_pdu=False):
+    """Parses each dump file in its own worker process.
+
+    Parameters:
+    parser_class (type): parser to instantiate in each worker
+    params (dict): parameters passed to set_parameter() of each parser
+    fnames (list): dump files
+    writer: writer receiving the merged output, ordered by packet timestamp
+    jobs (int): number of worker processes
+    io_args (dict): extra arguments for FileIO
+    split_output (str): if set, write one PCAP file per input based on this
+                        file name instead of merging into writer
+    pcap_format (str): 'pcap' or 'pcapng', file format of split_output
+    exported_pdu (bool): passed to PcapngWriter of split_output
+    """
+    if split_output:
+        used_names = set()
+        tasks = []
+        for fname in fnames:
+            out_name = split_output_name(split_output, fname, used_names, pcap_format)
+            if pcap_format == 'pcapng':
+                writer_args = ('pcapng', out_name, port_cp, port_up, 0x100000, 1.0, exported_pdu)
+            else:
+                writer_args = ('pcap', out_name, port_cp, port_up)
+            tasks.append((parser_class, params, fname, io_args, writer_args))
+        with multiprocessing.Pool(jobs) as pool:
+            for fname in pool.imap_unordered(replay_file, tasks):
+                logger.log(logging.INFO, 'Finished {}'.format(fname))
+        return
+
+    with tempfile.TemporaryDirectory(prefix='scat-') as spool_dir:
+        tasks = []
+        spool_names = []
+        for i, fname in enumerate(fnames):
+            spool_name = os.path.join(spool_dir, '{}.spool'.format(i))
+            spool_names.append(spool_name)
+            tasks.append((parser_class, params, fname, io_args, ('spool', spool_name)))
+        with multiprocessing.Pool(jobs) as pool:
+            for fname in pool.imap_unordered(replay_file, tasks):
+                logger.log(logging.INFO, 'Finished {}'.format(fname))
+
+        takes_layer = getattr(writer, 'takes_layer', False)
+        for record in heapq.merge(*[read_spool(x) for x in spool_names], key=lambda x: x[0]):
+            if takes_layer:
+                if record[1] == 0:
+                    writer.write_cp(record[4], record[2], record[3], record[5])
+                else:
+                    writer.write_up(record[4], record[2], record[3], record[5])
+            elif record[1] == 0:
+                writer.write_cp(record[4], record[2], record[3])
+            else:
+                writer.write_up(record[4], record[2], record[3])
+
+# Intra-file parallel decoding of HDLC framed dumps (QMDL)
+chunk_size = 0x1000000
+chunk_parser = None
+
+def init_chunk_worker(parser_class, params):
+    global chunk_parser
+    chunk_parser = parser_class()
+    chunk_parser.set_parameter(params)
+
+def is_splittable(fname):
+    # Compressed dumps can not be read from arbitrary offsets
+    return os.path.isfile(fname) and scat.compression.detect_method(fname) is None
+
+def read_chunk(fname, start, end):
+    # A chunk owns every frame starting within [start, end). Read one byte
+    # ahead to find the first frame boundary, and read past the end until
+    # the last owned frame is terminated.
+    with open(fname, 'rb') as f:
+        read_start = start - 1 if start > 0 else 0
+        f.seek(read_start)
+        buf = bytearray(f.read(end - read_start))
+
+        if start > 0:
+            first_pos = buf.find(b'\x7e')
+            if first_pos < 0:
+                # Frame spans the whole chunk, owned by the previous chunk
+                return buf, len(buf)
+            first_pos += 1
+        else:
+            first_pos = 0
+
+        if len(buf) > 0 and buf[-1] != 0x7e:
+            while True:
+                ext = f.read(0x10000)
+                if len(ext) == 0:
+                    break
+                ext_pos = ext.find(b'\x7e')
+                if ext_pos >= 0:
+                    buf += ext[0:ext_pos + 1]
+                    break
+                buf += ext
+
+    return buf, first_pos
+
+def decode_chunk(task):
+    fname, start, end = task
+    buf, first_pos = read_chunk(fname, start, end)
+
+    packets = bytearray()
+    lengths = array('L')
+    for frame in util.iter_hdlc_frames(buf, start=first_pos):
+        pkt = chunk_parser.decode_diag(frame[:-1])
+        if pkt is None or not chunk_parser.is_diag_parsed(pkt):
+            continue
+        packets += pkt
+        lengths.append(len(pkt))
+    return bytes(packets), lengths
+
+def decode_dump_parallel(parser_class, params, fname, jobs):
+    """Decodes a QMDL file in chunks using a process pool.
+
+    HDLC unescaping, CRC checks and dropping of packets the parser ignores
+    are done in the workers. Decoded packets are yielded in file order, so
+    that stateful parsing can be done by the caller in a single pass.
+    """
+    file_size = os.path.getsize(fname)
+    tasks = iter([(fname, x, min(x + chunk_size, file_size)) for x in range(0, file_size, chunk_size)])
+
+    with multiprocessing.Pool(jobs, initializer=init_chunk_worker, initargs=(parser_class, params)) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(decode_chunk, (task, )))
+            if len(pending) >= jobs * 2:
+                break
+
+        while len(pending) > 0:
+            packets, lengths = pending.popleft().get()
+            task = next(tasks, None)
+            if task is not None:
+                pending.append(pool.apply_async(decode_chunk, (task, )))
+
+            pos = 0
+            for pkt_len in lengths:
+                yield packets[pos:pos + pkt_len]
+                pos += pkt_len
@@ -36,8 +36,12 @@ class HisiliconParser:
 
         self.io_device = None
         self.writer = None
+        self.writer_takes_layer = False
         self.combine_stdout = False
         self.check_crc = True
+        # Verify CRC of every Nth packet only
+        self.crc_check_interval = 1
+        self.crc_check_count = 0
         self.layers = []
 
         self.name = 'hisilicon'
@@ -74,6 +78,8 @@ class HisiliconParser:
 
     def set_writer(self, writer):
         self.writer = writer
+        # Writers with per-output layer filters get the layer of each packet
+        self.writer_takes_layer = getattr(writer, 'takes_layer', False)
 
     def set_parameter(self, params):
         for p in params:
@@ -85,8 +91,13 @@ class HisiliconParser:
                 self.combine_stdout = params[p]
             elif p == 'disable-crc-check':
                 self.check_crc = not params[p]
+            elif p == 'crc-check-interval':
+                self.crc_check_interval = max(params[p], 1)
             elif p == 'layer':
                 self.layers = params[p]
+            elif p == 'index-filter':
+                if params[p] is not None:
+                    self.logger.log(logging.WARNING, 'Index filters are not supported for HiSilicon dumps, reading whole files')
 
     def init_diag(self):
         pass
@@ -98,18 +109,23 @@ class HisiliconParser:
         if len(pkt) < 3:
             return
 
-        if hdlc_encoded:
-            pkt = util.unwrap(pkt)
-
         if has_crc:
-            # Check CRC only if check_crc is enabled
+            # Check CRC only if check_crc is enabled, on every Nth packet
+            check_crc = False
             if self.check_crc:
-                crc = util.dm_crc16(pkt[:-2])
-                crc_pkt = (pkt[-1] << 8) | pkt[-2]
-                if crc != crc_pkt:
-                    self.logger.log(logging.WARNING, "CRC mismatch: expected 0x{:04x}, got 0x{:04x}".format(crc, crc_pkt))
-                    self.logger.log(logging.DEBUG, util.xxd(pkt))
-            pkt = pkt[:-2]
+                self.crc_check_count += 1
+                if self.crc_check_count >= self.crc_check_interval:
+                    self.crc_check_count = 0
+                    check_crc = True
+
+            # Unescape, check and strip CRC at once
+            pkt, crc_pkt = util.decode_diag_frame(pkt, hdlc_encoded, check_crc)
+            if crc_pkt is not None:
+                crc = util.dm_crc16(pkt)
+                self.logger.log(logging.WARNING, "CRC mismatch: expected 0x{:04x}, got 0x{:04x}".format(crc, crc_pkt))
+                self.logger.log(logging.DEBUG, util.xxd(pkt))
+        elif hdlc_encoded:
+            pkt = util.unwrap(pkt)
 
         return self.parse_diag_log(pkt)
 
@@ -122,36 +138,40 @@ class HisiliconParser:
     def run_dump(self):
         self.logger.log(logging.INFO, 'Starting diag from dump')
 
-        oldbuf = b''
-        loop = True
-        cur_pos = 0
+        deframer = util.HdlcDeframer(0x100000)
         try:
-            while loop:
+            if getattr(self.io_device, 'mapped', None) is not None:
+                # Memory-mapped dump, scan the whole file in place
+                for frame in util.iter_hdlc_frames(self.io_device.mapped, include_trailing=True):
+                    if frame[-1] == 0x7e:
+                        frame = frame[:-1]
+                    parse_result = self.parse_diag(frame)
+
+                    if parse_result is not None:
+                        self.postprocess_parse_result(parse_result)
+                return
+
+            while True:
                 buf = self.io_device.read(0x90000)
                 if len(buf) == 0:
                     if self.io_device.block_until_data:
                         continue
                     else:
-                        loop = False
+                        break
 
-                last_pkt_pos = buf.rfind(b'\x7e')
-                if last_pkt_pos > 0:
-                    buf_t = oldbuf + buf[0:last_pkt_pos]
-                    oldbuf = buf[last_pkt_pos:]
-                    buf = buf_t
-                else:
-                    buf = oldbuf + buf
-
-                buf_atom = buf.split(b'\x7e')
-
-                for pkt in buf_atom:
-                    if len(pkt) == 0:
-                        continue
-                    parse_result = self.parse_diag(pkt)
+                for frame in deframer.feed(buf):
+                    parse_result = self.parse_diag(frame[:-1])
 
                     if parse_result is not None:
                         self.postprocess_parse_result(parse_result)
 
+            # LPD dumps may end without trailing 0x7e
+            pkt = deframer.flush()
+            if pkt:
+                parse_result = self.parse_diag(pkt)
+                if parse_result is not None:
+                    self.postprocess_parse_result(parse_result)
+
         except KeyboardInterrupt:
             return
 
@@ -179,8 +199,12 @@ class HisiliconParser:
         if 'cp' in parse_result:
             if 'layer' in parse_result:
                 if parse_result['layer'] in self.layers:
-                    for sock_content in parse_result['cp']:
-                        self.writer.write_cp(sock_content, radio_id, ts)
+                    if self.writer_takes_layer:
+                        for sock_content in parse_result['cp']:
+                            self.writer.write_cp(sock_content, radio_id, ts, parse_result['layer'])
+                    else:
+                        for sock_content in parse_result['cp']:
+                            self.writer.write_cp(sock_content, radio_id, ts)
             else:
                 for sock_content in parse_result['cp']:
                     self.writer.write_cp(sock_content, radio_id, ts)
@@ -188,8 +212,12 @@ class HisiliconParser:
         if 'up' in parse_result:
             if 'layer' in parse_result:
                 if parse_result['layer'] in self.layers:
-                    for sock_content in parse_result['up']:
-                        self.writer.write_up(sock_content, radio_id, ts)
+                    if self.writer_takes_layer:
+                        for sock_content in parse_result['up']:
+                            self.writer.write_up(sock_content, radio_id, ts, parse_result['layer'])
+                    else:
+                        for sock_content in parse_result['up']:
+                            self.writer.write_up(sock_content, radio_id, ts)
             else:
                 for sock_content in parse_result['up']:
                     self.writer.write_up(sock_content, radio_id, ts)
@@ -8,6 +8,9 @@ import struct
 DIAG_VERNO_F = 0x00
 DIAG_STATUS_F = 0x0c
 DIAG_LOG_F = 0x10            # Log packet Request/Reponse
+DIAG_BAD_CMD_F = 0x13        # Invalid command response
+DIAG_BAD_PARM_F = 0x14       # Invalid parameter response
+DIAG_BAD_LEN_F = 0x15        # Invalid packet length response
 DIAG_DIAG_VER_F = 0x1c       # Version response
 DIAG_TS_F = 0x1d
 DIAG_SUBSYS_CMD_F = 0x4b
@@ -17,6 +20,8 @@ DIAG_LOG_CONFIG_F = 0x73     # Logging configuration packet
 DIAG_EXT_MSG_F = 0x79        # Request for extended message report
 DIAG_EXT_BUILD_ID_F = 0x7c
 DIAG_EXT_MSG_CONFIG_F = 0x7d # Request for Extended message report
+DIAG_EVENT_MASK_GET_F = 0x81 # Retrieve event mask
+DIAG_EVENT_MASK_SET_F = 0x82 # Set event mask
 DIAG_SUBSYS_CMD_VER_2_F = 0x80
 DIAG_QSR_EXT_MSG_TERSE_F = 0x92  # QSR extended messages
 DIAG_QSR4_EXT_MSG_TERSE_F = 0x99 # QSR4 extended messages
@@ -502,6 +507,45 @@ def log_mask_scat_nr(num_max_items=0x09ff, layers=[]):
 def log_mask_empty_tdscdma(num_max_items=0x0207):
     return create_log_config_set_mask(DIAG_SUBSYS_ID_TDSCDMA, num_max_items)
 
+def create_log_config_set_masks(*log_codes):
+    # Full log codes (e.g. 0xB0C0) to one set mask command per equipment ID,
+    # each covering items up to the highest selected one. The mask size is
+    # the number of items, so the highest item needs one more
+    items = {}
+    for log_code in log_codes:
+        items.setdefault(log_code >> 12, []).append(log_code & 0xfff)
+
+    return [create_log_config_set_mask(equip_id, max(items[equip_id]) + 1, *items[equip_id])
+        for equip_id in sorted(items)]
+
+def clear_log_config_mask_items(cmd, *log_codes):
+    # Returns a copy of a set mask command with the given log codes disabled,
+    # log codes of other equipment IDs are ignored
+    equip_id, num_items = struct.unpack('<LL', cmd[8:16])
+    mask = bytearray(cmd)
+
+    for log_code in log_codes:
+        item = log_code & 0xfff
+        pos_byte = 16 + int(item / 8)
+        if log_code >> 12 != equip_id or item >= num_items or pos_byte >= len(mask):
+            continue
+        mask[pos_byte] &= ~(1 << (item % 8)) & 0xff
+
+    return bytes(mask)
+
+def create_event_mask_set(num_bits, *event_ids):
+    # Command ID, padding, reserved, num_bits | bitfields
+    diag_event_mask_header = struct.pack('<BBHH',
+        DIAG_EVENT_MASK_SET_F, 0x00, 0x0000, num_bits)
+    diag_event_mask_payload = bytearray(b'\x00' * bytes_reqd_for_bit(num_bits))
+
+    for event_id in event_ids:
+        if event_id >= num_bits:
+            continue
+        diag_event_mask_payload[int(event_id / 8)] |= (1 << (event_id % 8))
+
+    return diag_event_mask_header + bytes(diag_event_mask_payload)
+
 def create_extended_message_config_set_mask(first_ssid, last_ssid, *masks):
     # Command ID, Operation | first_ssid, last_ssid, runtime_masks
     diag_log_config_mask_header = struct.pack('<BBHHH',
@@ -523,3 +567,15 @@ def create_extended_message_config_set_mask(first_ssid, last_ssid, *masks):
         ext_msg_config_mask_payload += struct.pack('<L', x)
 
     return diag_log_config_mask_header + ext_msg_config_mask_payload
+
+def create_extended_message_config_set_masks(id_ranges, level, *ssids):
+    # One set mask command per ID range containing selected SSIDs, limited
+    # to the selected part of the range
+    cmds = []
+    for first_ssid, last_ssid in id_ranges:
+        selected = [x for x in ssids if first_ssid <= x <= last_ssid]
+        if len(selected) == 0:
+            continue
+        cmds.append(create_extended_message_config_set_mask(min(selected), max(selected),
+            *[(x, level) for x in selected]))
+    return cmds
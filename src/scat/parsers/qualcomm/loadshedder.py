@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+from scat.parsers.qualcomm import diagcmd
+import scat.util as util
+
+import datetime
+import logging
+import os
+import time
+
+class LoadShedder:
+    """Disables low priority log codes on the device while the host falls behind.
+
+    Overload is detected from the backlog of the IO device (fill level of
+    the reader queue, 0.0 - 1.0) and from the parse lag, i.e. how far the
+    device timestamps of parsed packets trail the host clock compared to
+    the lowest lag seen so far. The log masks are re-sent without the low
+    priority codes on overload, and restored once the load has dropped.
+    """
+    def __init__(self, parser, log_mask_cmds, shed_log_codes,
+            high_water=0.75, low_water=0.25, max_lag=2.0, hold_time=5.0):
+        """
+        Parameters:
+        parser (QualcommParser): parser using the IO device and writer
+        log_mask_cmds (list): log config set mask commands programmed by prepare_diag
+        shed_log_codes (list): full log codes (e.g. 0xB064) to disable under overload
+        high_water (float): backlog to start shedding at
+        low_water (float): backlog to restore the masks at
+        max_lag (float): parse lag in seconds to start shedding at
+        hold_time (float): minimum time in seconds between two decisions
+        """
+        self.parser = parser
+        self.logger = logging.getLogger('scat.loadshedder')
+        self.normal_cmds = list(log_mask_cmds)
+        self.shed_cmds = [diagcmd.clear_log_config_mask_items(x, *shed_log_codes) for x in log_mask_cmds]
+        self.high_water = high_water
+        self.low_water = low_water
+        self.max_lag = max_lag
+        self.hold_time = hold_time
+
+        self.shedding = False
+        self.last_change = 0.0
+        self.min_lag = None
+        self.lag = 0.0
+        # Responses to the set mask commands, not to be parsed as regular packets
+        self.pending_responses = 0
+
+    def observe(self, device_ts):
+        # Parse lag relative to the lowest one seen, removing the clock offset
+        # between device and host
+        lag = time.time() - device_ts.timestamp()
+        if self.min_lag is None or lag < self.min_lag:
+            self.min_lag = lag
+        self.lag = lag - self.min_lag
+
+    def update(self, backlog):
+        """Decides whether to shed or restore, called once per read buffer.
+
+        Parameters:
+        backlog (float): fill level of the IO device reader queue, 0.0 - 1.0
+        """
+        now = time.monotonic()
+        if now - self.last_change < self.hold_time:
+            return
+
+        if not self.shedding and (backlog >= self.high_water or self.lag >= self.max_lag):
+            self.apply(True, now, 'backlog {:.0%}, lag {:.1f}s: disabling low priority log codes'.format(backlog, self.lag))
+        elif self.shedding and backlog <= self.low_water and self.lag < self.max_lag / 2:
+            self.apply(False, now, 'backlog {:.0%}, lag {:.1f}s: restoring low priority log codes'.format(backlog, self.lag))
+
+    def apply(self, shedding, now, reason):
+        self.shedding = shedding
+        self.last_change = now
+
+        cmds = self.shed_cmds if shedding else self.normal_cmds
+        for cmd in cmds:
+            self.parser.io_device.write(util.generate_packet(cmd), False)
+        self.pending_responses += len(cmds)
+
+        self.logger.log(logging.WARNING if shedding else logging.INFO, 'Load shedding: {}'.format(reason))
+        self.write_log(reason)
+
+    def take_response(self):
+        # Returns True if a log config response belongs to a mask sent here
+        if self.pending_responses > 0:
+            self.pending_responses -= 1
+            return True
+        return False
+
+    def write_log(self, text):
+        ts = datetime.datetime.now()
+        osmocore_log_hdr = util.create_osmocore_logging_header(
+            timestamp = ts,
+            process_name = 'scat',
+            pid = os.getpid(),
+            level = 3,
+            subsys_name = self.__class__.__name__,
+            filename = os.path.basename(__file__),
+        )
+        gsmtap_hdr = util.create_gsmtap_header(
+            version = 2,
+            payload_type = util.gsmtap_type.OSMOCORE_LOG)
+        self.parser.writer.write_cp(gsmtap_hdr + osmocore_log_hdr + text.encode('utf-8'), 0, ts)
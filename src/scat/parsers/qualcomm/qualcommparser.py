@@ -17,12 +17,17 @@ from scat.parsers.qualcomm.diagcommoneventparser import DiagCommonEventParser
 from scat.parsers.qualcomm.diaglteeventparser import DiagLteEventParser
 from scat.parsers.qualcomm.diaggsmeventparser import DiagGsmEventParser
 from scat.parsers.qualcomm.diagfallbackeventparser import DiagFallbackEventParser
+from scat.parsers.qualcomm.loadshedder import LoadShedder
 
 import scat.util as util
+import scat.index
+import scat.parallel
 import struct
 import datetime
+import json
 import logging
-from collections import namedtuple
+import os
+from collections import namedtuple, deque
 import binascii
 from inspect import currentframe, getframeinfo
 from pathlib import Path
@@ -51,17 +56,40 @@ class QualcommParser:
 
         self.io_device = None
         self.writer = None
+        self.writer_takes_layer = False
         self.parse_msgs = False
         self.parse_events = False
         self.qsr_hash_filename = ''
         self.qsr4_hash_filename = ''
         self.emr_id_range = []
         self.log_id_range = {}
+        # Queried message levels per EMR ID range, None if not known yet
+        self.emr_id_reported = False
+        self.emr_level_range = None
+        # Capability cache file, entry of the connected device
+        self.capability_cache = None
+        self.capability_key = None
+        # Deframer of command responses, keeps partial frames between batches
+        self.command_deframer = None
+        # Exact selection programmed into the device masks instead of the
+        # layer based defaults
+        self.log_codes = []
+        self.event_ids = []
+        self.emr_ssids = []
+        # Log codes disabled while the host falls behind, see LoadShedder
+        self.shed_log_codes = []
+        self.shed_params = {}
+        self.load_shedder = None
         self.cacombos = False
         self.combine_stdout = False
         self.check_crc = True
+        # Verify CRC of every Nth packet only
+        self.crc_check_interval = 1
+        self.crc_check_count = 0
         self.layers = []
         self.json = False
+        self.jobs = 1
+        self.index_filter = None
 
         self.name = 'qualcomm'
         self.shortname = 'qc'
@@ -100,6 +128,8 @@ class QualcommParser:
 
     def set_writer(self, writer):
         self.writer = writer
+        # Writers with per-output layer filters get the layer of each packet
+        self.writer_takes_layer = getattr(writer, 'takes_layer', False)
 
     def set_parameter(self, params):
         for p in params:
@@ -121,10 +151,36 @@ class QualcommParser:
                 self.combine_stdout = params[p]
             elif p == 'disable-crc-check':
                 self.check_crc = not params[p]
+            elif p == 'crc-check-interval':
+                self.crc_check_interval = max(params[p], 1)
             elif p == 'layer':
                 self.layers = params[p]
             elif p == 'json':
                 self.json = params[p]
+            elif p == 'jobs':
+                self.jobs = params[p]
+            elif p == 'index-filter':
+                self.index_filter = params[p]
+            elif p == 'capability-cache':
+                self.capability_cache = params[p]
+            elif p == 'log-codes':
+                self.log_codes = list(params[p] or [])
+            elif p == 'event-ids':
+                self.event_ids = list(params[p] or [])
+                if len(self.event_ids) > 0:
+                    self.parse_events = True
+            elif p == 'emr-ssids':
+                self.emr_ssids = list(params[p] or [])
+                if len(self.emr_ssids) > 0:
+                    self.parse_msgs = True
+            elif p == 'shed-log-codes':
+                self.shed_log_codes = list(params[p] or [])
+            elif p == 'shed-high-water':
+                self.shed_params['high_water'] = params[p]
+            elif p == 'shed-low-water':
+                self.shed_params['low_water'] = params[p]
+            elif p == 'shed-max-lag':
+                self.shed_params['max_lag'] = params[p]
 
     def sanitize_radio_id(self, radio_id):
         if radio_id <= 0:
@@ -134,138 +190,305 @@ class QualcommParser:
         else:
             return (radio_id - 1)
 
-    def init_diag(self):
-        self.logger.log(logging.INFO, 'Initializing diag')
-        # Disable static event reporting
-        self.io_device.read(0x1000)
+    def send_commands(self, cmds):
+        """Sends DIAG commands back to back, then waits for their responses.
 
-        self.io_device.write(util.generate_packet(struct.pack('<B', diagcmd.DIAG_VERNO_F)), False)
-        ver_buf = self.io_device.read(0x1000)
-        result = self.parse_diag(ver_buf[:-1])
-        if result:
-            self.postprocess_parse_result(result)
+        Responses are matched to the commands by command code. Other
+        packets received in the meantime are discarded.
 
-        self.io_device.write(util.generate_packet(struct.pack('<B', diagcmd.DIAG_EXT_BUILD_ID_F)), False)
-        build_id_buf = self.io_device.read(0x1000)
-        result = self.parse_diag(build_id_buf[:-1])
-        if result:
-            self.postprocess_parse_result(result)
+        Parameters:
+        cmds (list): (command without CRC (bytes), parse response (bool))
 
-        self.io_device.write_then_read_discard(util.generate_packet(struct.pack('<BB', diagcmd.DIAG_EVENT_REPORT_F, 0x00)), 0x1000, False)
+        Returns the parse results of the responses to be parsed, in order of arrival.
+        """
+        pending = {}
+        for cmd, parse in cmds:
+            pending.setdefault(cmd[0], deque()).append(parse)
+            self.io_device.write(util.generate_packet(cmd), False)
+
+        num_pending = len(cmds)
+        results = []
+        if self.command_deframer is None:
+            self.command_deframer = util.HdlcDeframer()
+        deframer = self.command_deframer
+        empty_reads = 0
+        while num_pending > 0 and empty_reads < 2:
+            buf = self.io_device.read(0x1000)
+            if len(buf) == 0:
+                empty_reads += 1
+                continue
+            empty_reads = 0
+
+            for frame in deframer.feed(buf):
+                pkt = self.decode_diag(frame[:-1])
+                if pkt is None or len(pkt) == 0:
+                    continue
+
+                cmd_code = pkt[0]
+                if cmd_code in (diagcmd.DIAG_BAD_CMD_F, diagcmd.DIAG_BAD_PARM_F, diagcmd.DIAG_BAD_LEN_F) and len(pkt) > 1:
+                    # Error response followed by the rejected command
+                    cmd_code = pkt[1]
+                    self.logger.log(logging.WARNING, 'Command {:#04x} rejected with {:#04x}'.format(cmd_code, pkt[0]))
+                if cmd_code not in pending or len(pending[cmd_code]) == 0:
+                    continue
+
+                parse = pending[cmd_code].popleft()
+                num_pending -= 1
+                if parse and pkt[0] == cmd_code:
+                    result = self.parse_diag(pkt, hdlc_encoded=False, has_crc=False)
+                    if result:
+                        self.postprocess_parse_result(result)
+                        results.append(result)
+
+        if num_pending > 0:
+            self.logger.log(logging.WARNING, 'No response to {} command(s)'.format(num_pending))
+        return results
+
+    log_mask_empty = (
+        (diagcmd.DIAG_SUBSYS_ID_1X, diagcmd.log_mask_empty_1x),
+        (diagcmd.DIAG_SUBSYS_ID_WCDMA, diagcmd.log_mask_empty_wcdma),
+        (diagcmd.DIAG_SUBSYS_ID_GSM, diagcmd.log_mask_empty_gsm),
+        (diagcmd.DIAG_SUBSYS_ID_UMTS, diagcmd.log_mask_empty_umts),
+        (diagcmd.DIAG_SUBSYS_ID_DTV, diagcmd.log_mask_empty_dtv),
+        (diagcmd.DIAG_SUBSYS_ID_LTE, diagcmd.log_mask_empty_lte),
+        (diagcmd.DIAG_SUBSYS_ID_TDSCDMA, diagcmd.log_mask_empty_tdscdma),
+    )
+
+    log_mask_scat = (
+        (diagcmd.DIAG_SUBSYS_ID_1X, diagcmd.log_mask_scat_1x),
+        (diagcmd.DIAG_SUBSYS_ID_WCDMA, diagcmd.log_mask_scat_wcdma),
+        (diagcmd.DIAG_SUBSYS_ID_GSM, diagcmd.log_mask_scat_gsm),
+        (diagcmd.DIAG_SUBSYS_ID_UMTS, diagcmd.log_mask_scat_umts),
+        (diagcmd.DIAG_SUBSYS_ID_LTE, diagcmd.log_mask_scat_lte),
+    )
+
+    # Used when the device does not report extended message ID ranges
+    default_emr_id_range = (
+        (0x0000, 0x0065), (0x01f4, 0x01fa), (0x03e8, 0x033f), (0x07d0, 0x07d8),
+        (0x0bb8, 0x0bc6), (0x0fa0, 0x0faa), (0x1194, 0x11ae), (0x11f8, 0x1206),
+        (0x1388, 0x13a6), (0x157c, 0x158c), (0x1770, 0x17c0), (0x1964, 0x1979),
+        (0x1b58, 0x1b5b), (0x1bbc, 0x1bc7), (0x1c20, 0x1c21), (0x1f40, 0x1f40),
+        (0x2134, 0x214c), (0x2328, 0x2330), (0x251c, 0x2525), (0x27d8, 0x27e2),
+        (0x280b, 0x280f), (0x283c, 0x283c), (0x286e, 0x2886),
+    )
+
+    def load_capabilities(self, key):
+        # Returns the cached capabilities of a firmware build, or None
+        try:
+            with open(self.capability_cache, 'r') as f:
+                cache = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            self.logger.log(logging.WARNING, 'Ignoring capability cache {}: {}'.format(self.capability_cache, e))
+            return None
+        if not isinstance(cache, dict) or key not in cache:
+            return None
 
-        self.io_device.write(util.generate_packet(struct.pack('<LL', diagcmd.DIAG_LOG_CONFIG_F, diagcmd.LOG_CONFIG_RETRIEVE_ID_RANGES_OP)), False)
-        log_config_buf = self.io_device.read(0x1000)
-        result = self.parse_diag(log_config_buf[:-1])
-        if result:
-            self.postprocess_parse_result(result)
+        # A malformed entry is treated like a cache miss and queried again
+        entry = cache[key]
+        try:
+            emr_id_range = entry['emr_id_range']
+            emr_level_range = entry['emr_level_range']
+            return {
+                'log_id_range': {int(k): int(v) for k, v in entry['log_id_range'].items()},
+                'emr_id_range': None if emr_id_range is None else [(int(x[0]), int(x[1])) for x in emr_id_range],
+                'emr_level_range': None if emr_level_range is None else
+                    [(int(x[0]), int(x[1]), [(int(y[0]), int(y[1])) for y in x[2]]) for x in emr_level_range],
+            }
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+            self.logger.log(logging.WARNING, 'Ignoring malformed capability cache entry in {}: {!r}'.format(self.capability_cache, e))
+            return None
 
-        # Send empty masks
-        if diagcmd.DIAG_SUBSYS_ID_1X in self.log_id_range:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_1x(self.log_id_range[diagcmd.DIAG_SUBSYS_ID_1X])), 0x1000, False)
-        else:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_1x()), 0x1000, False)
-        if diagcmd.DIAG_SUBSYS_ID_WCDMA in self.log_id_range:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_wcdma(self.log_id_range[diagcmd.DIAG_SUBSYS_ID_WCDMA])), 0x1000, False)
-        else:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_wcdma()), 0x1000, False)
-        if diagcmd.DIAG_SUBSYS_ID_GSM in self.log_id_range:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_gsm(self.log_id_range[diagcmd.DIAG_SUBSYS_ID_GSM])), 0x1000, False)
-        else:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_gsm()), 0x1000, False)
-        if diagcmd.DIAG_SUBSYS_ID_UMTS in self.log_id_range:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_umts(self.log_id_range[diagcmd.DIAG_SUBSYS_ID_UMTS])), 0x1000, False)
-        else:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_umts()), 0x1000, False)
-        if diagcmd.DIAG_SUBSYS_ID_DTV in self.log_id_range:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_dtv(self.log_id_range[diagcmd.DIAG_SUBSYS_ID_DTV])), 0x1000, False)
-        else:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_dtv()), 0x1000, False)
-        if diagcmd.DIAG_SUBSYS_ID_LTE in self.log_id_range:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_lte(self.log_id_range[diagcmd.DIAG_SUBSYS_ID_LTE])), 0x1000, False)
+    def save_capabilities(self):
+        # Stores the queried capabilities of the connected device, keeping
+        # the entries of other firmware builds
+        try:
+            with open(self.capability_cache, 'r') as f:
+                cache = json.load(f)
+            if not isinstance(cache, dict):
+                cache = {}
+        except (OSError, ValueError):
+            cache = {}
+
+        cache[self.capability_key] = {
+            'log_id_range': {str(k): v for k, v in self.log_id_range.items()},
+            'emr_id_range': self.emr_id_range if self.emr_id_reported else None,
+            'emr_level_range': self.emr_level_range,
+        }
+
+        tmp_name = self.capability_cache + '.tmp'
+        try:
+            with open(tmp_name, 'w') as f:
+                json.dump(cache, f)
+            os.replace(tmp_name, self.capability_cache)
+        except OSError as e:
+            self.logger.log(logging.WARNING, 'Cannot write capability cache {}: {}'.format(self.capability_cache, e))
+
+    def init_diag(self):
+        self.logger.log(logging.INFO, 'Initializing diag')
+        # One deframer for all commands of the handshake, a response may be
+        # split across the reads of two batches
+        self.command_deframer = util.HdlcDeframer()
+        # Disable static event reporting
+        self.io_device.read(0x1000)
+
+        version_cmds = [
+            (struct.pack('<B', diagcmd.DIAG_VERNO_F), True),
+            (struct.pack('<B', diagcmd.DIAG_EXT_BUILD_ID_F), True),
+            (struct.pack('<BB', diagcmd.DIAG_EVENT_REPORT_F, 0x00), False),
+        ]
+        # The masks below depend on the returned ID ranges
+        query_cmds = [
+            (struct.pack('<LL', diagcmd.DIAG_LOG_CONFIG_F, diagcmd.LOG_CONFIG_RETRIEVE_ID_RANGES_OP), True),
+            (struct.pack('<BB', diagcmd.DIAG_EXT_MSG_CONFIG_F, 0x01), True),
+        ]
+
+        capabilities = None
+        self.capability_key = None
+        if self.capability_cache:
+            # Capabilities only depend on the firmware build
+            results = self.send_commands(version_cmds)
+            if len(results) > 0:
+                self.capability_key = '\n'.join(sorted(x['stdout'] for x in results if 'stdout' in x))
+                capabilities = self.load_capabilities(self.capability_key)
+            if capabilities is None:
+                results = self.send_commands(query_cmds)
         else:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_lte()), 0x1000, False)
-        if diagcmd.DIAG_SUBSYS_ID_TDSCDMA in self.log_id_range:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_tdscdma(self.log_id_range[diagcmd.DIAG_SUBSYS_ID_TDSCDMA])), 0x1000, False)
+            results = self.send_commands(version_cmds + query_cmds)
+
+        if capabilities is not None:
+            self.logger.log(logging.INFO, 'Using cached DIAG capabilities')
+            self.log_id_range = capabilities['log_id_range']
+            self.emr_id_reported = capabilities['emr_id_range'] is not None
+            self.emr_id_range = capabilities['emr_id_range'] or []
+            self.emr_level_range = capabilities['emr_level_range']
         else:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_empty_tdscdma()), 0x1000, False)
+            id_range_results = [x for x in results if 'id_range' in x]
+            self.emr_id_reported = len(id_range_results) > 0
+            if self.emr_id_reported:
+                self.emr_id_range = id_range_results[0]['id_range']
+            self.emr_level_range = None
+            if self.capability_key:
+                self.save_capabilities()
 
-        self.io_device.write(util.generate_packet(struct.pack('<BB', diagcmd.DIAG_EXT_MSG_CONFIG_F, 0x01)), False)
-        ext_msg_buf = self.io_device.read(0x1000)
-        result = self.parse_diag(ext_msg_buf[:-1])
-        if result:
-            self.postprocess_parse_result(result)
+        # Send empty masks
+        cmds = []
+        for subsys_id, log_mask in self.log_mask_empty:
+            if subsys_id in self.log_id_range:
+                cmds.append((log_mask(self.log_id_range[subsys_id]), False))
+            else:
+                cmds.append((log_mask(), False))
 
         emr = lambda x, y: diagcmd.create_extended_message_config_set_mask(x, y)
-        if 'id_range' in result:
-            self.emr_id_range = result['id_range']
-            for x in result['id_range']:
-                self.io_device.write_then_read_discard(util.generate_packet(emr(x[0], x[1])), 0x1000, False)
-        else:
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x0000, 0x0065)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x01f4, 0x01fa)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x03e8, 0x033f)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x07d0, 0x07d8)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x0bb8, 0x0bc6)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x0fa0, 0x0faa)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x1194, 0x11ae)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x11f8, 0x1206)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x1388, 0x13a6)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x157c, 0x158c)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x1770, 0x17c0)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x1964, 0x1979)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x1b58, 0x1b5b)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x1bbc, 0x1bc7)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x1c20, 0x1c21)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x1f40, 0x1f40)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x2134, 0x214c)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x2328, 0x2330)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x251c, 0x2525)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x27d8, 0x27e2)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x280b, 0x280f)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x283c, 0x283c)), 0x1000, False)
-            self.io_device.write_then_read_discard(util.generate_packet(emr(0x286e, 0x2886)), 0x1000, False)
+        for x in (self.emr_id_range if self.emr_id_reported else self.default_emr_id_range):
+            cmds.append((emr(x[0], x[1]), False))
+        self.send_commands(cmds)
 
     def prepare_diag(self):
         self.logger.log(logging.INFO, 'Starting diag')
 
-        emr_level_range = []
-        if self.parse_msgs:
-            if len(self.emr_id_range) > 0:
-                for x in self.emr_id_range:
-                    self.io_device.write(util.generate_packet(struct.pack('<BBHH', diagcmd.DIAG_EXT_MSG_CONFIG_F, 0x02, x[0], x[1])), False)
-                    ext_msg_level_buf = self.io_device.read(0x1000)
-                    result = self.parse_diag(ext_msg_level_buf[:-1])
-                    if result:
-                        self.postprocess_parse_result(result)
-                    emr_level_range.append((result['start'], result['end'], result['level']))
-
-            if len(emr_level_range) > 0:
-                for x in emr_level_range:
-                    self.io_device.write_then_read_discard(util.generate_packet(diagcmd.create_extended_message_config_set_mask(x[0], x[1], *x[2])), 0x1000, False)
+        queries = []
+        query_levels = (len(self.emr_ssids) == 0 and self.parse_msgs and len(self.emr_id_range) > 0
+            and self.emr_level_range is None)
+        if query_levels:
+            queries += [(struct.pack('<BBHH', diagcmd.DIAG_EXT_MSG_CONFIG_F, 0x02, x[0], x[1]), True) for x in self.emr_id_range]
+        if len(self.event_ids) > 0:
+            queries.append((struct.pack('<BBH', diagcmd.DIAG_EVENT_MASK_GET_F, 0x00, 0x0000), True))
+        results = self.send_commands(queries) if len(queries) > 0 else []
+
+        cmds = []
+        if len(self.emr_ssids) > 0:
+            emr_id_range = self.emr_id_range if self.emr_id_reported else self.default_emr_id_range
+            unknown_ssids = [x for x in self.emr_ssids if not any(r[0] <= x <= r[1] for r in emr_id_range)]
+            if len(unknown_ssids) > 0:
+                self.logger.log(logging.WARNING, 'SSIDs not supported by the device: {}'.format(', '.join(str(x) for x in unknown_ssids)))
+            for cmd in diagcmd.create_extended_message_config_set_masks(emr_id_range, 0x1f, *self.emr_ssids):
+                cmds.append((cmd, False))
+        elif self.parse_msgs and len(self.emr_id_range) > 0:
+            if query_levels:
+                self.emr_level_range = [(x['start'], x['end'], x['level']) for x in results if 'level' in x]
+                if self.capability_key:
+                    self.save_capabilities()
+            for x in self.emr_level_range:
+                cmds.append((diagcmd.create_extended_message_config_set_mask(x[0], x[1], *x[2]), False))
 
         # Static event reporting Enable
-        self.io_device.write_then_read_discard(util.generate_packet(struct.pack('<BB', diagcmd.DIAG_EVENT_REPORT_F, 0x01)), 0x1000, False)
-
-        if diagcmd.DIAG_SUBSYS_ID_1X in self.log_id_range:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_scat_1x(self.log_id_range[diagcmd.DIAG_SUBSYS_ID_1X], self.layers)), 0x1000, False)
+        cmds.append((struct.pack('<BB', diagcmd.DIAG_EVENT_REPORT_F, 0x01), False))
+        if len(self.event_ids) > 0:
+            # Enabling reports sets all bits, restrict to the selected events
+            num_bits = [x['num_bits'] for x in results if 'num_bits' in x]
+            num_bits = num_bits[0] if len(num_bits) > 0 else max(self.event_ids) + 1
+            cmds.append((diagcmd.create_event_mask_set(num_bits, *self.event_ids), False))
+
+        log_mask_cmds = []
+        if len(self.log_codes) > 0:
+            for log_code in self.log_codes:
+                equip_id = log_code >> 12
+                if equip_id in self.log_id_range and (log_code & 0xfff) > self.log_id_range[equip_id]:
+                    self.logger.log(logging.WARNING, 'Log code {:#06x} not supported by the device'.format(log_code))
+            log_mask_cmds = diagcmd.create_log_config_set_masks(*self.log_codes)
         else:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_scat_1x(layers=self.layers)), 0x1000, False)
-        if diagcmd.DIAG_SUBSYS_ID_WCDMA in self.log_id_range:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_scat_wcdma(self.log_id_range[diagcmd.DIAG_SUBSYS_ID_WCDMA], self.layers)), 0x1000, False)
-        else:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_scat_wcdma(layers=self.layers)), 0x1000, False)
-        if diagcmd.DIAG_SUBSYS_ID_GSM in self.log_id_range:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_scat_gsm(self.log_id_range[diagcmd.DIAG_SUBSYS_ID_GSM], self.layers)), 0x1000, False)
-        else:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_scat_gsm(layers=self.layers)), 0x1000, False)
-        if diagcmd.DIAG_SUBSYS_ID_UMTS in self.log_id_range:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_scat_umts(self.log_id_range[diagcmd.DIAG_SUBSYS_ID_UMTS], self.layers)), 0x1000, False)
-        else:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_scat_umts(layers=self.layers)), 0x1000, False)
-        if diagcmd.DIAG_SUBSYS_ID_LTE in self.log_id_range:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_scat_lte(self.log_id_range[diagcmd.DIAG_SUBSYS_ID_LTE], self.layers)), 0x1000, False)
+            for subsys_id, log_mask in self.log_mask_scat:
+                if subsys_id in self.log_id_range:
+                    log_mask_cmds.append(log_mask(self.log_id_range[subsys_id], self.layers))
+                else:
+                    log_mask_cmds.append(log_mask(layers=self.layers))
+        cmds += [(x, False) for x in log_mask_cmds]
+        self.send_commands(cmds)
+
+        if len(self.shed_log_codes) > 0:
+            self.load_shedder = LoadShedder(self, log_mask_cmds, self.shed_log_codes, **self.shed_params)
+
+    def decode_diag(self, pkt, hdlc_encoded = True, has_crc = True):
+        # Removes HDLC escaping and checks/strips CRC16, returns None if the
+        # packet is too short to contain anything
+
+        if len(pkt) < (3 if has_crc else 1):
+            return None
+
+        if has_crc:
+            # Check CRC only if check_crc is enabled, on every Nth packet
+            check_crc = False
+            if self.check_crc:
+                self.crc_check_count += 1
+                if self.crc_check_count >= self.crc_check_interval:
+                    self.crc_check_count = 0
+                    check_crc = True
+
+            # Unescape, check and strip CRC at once
+            pkt, crc_pkt = util.decode_diag_frame(pkt, hdlc_encoded, check_crc)
+            if crc_pkt is not None:
+                crc = util.dm_crc16(pkt)
+                self.logger.log(logging.WARNING, "CRC mismatch: expected 0x{:04x}, got 0x{:04x}".format(crc, crc_pkt))
+                self.logger.log(logging.DEBUG, util.xxd(pkt))
+        elif hdlc_encoded:
+            pkt = util.unwrap(pkt)
+
+        return pkt
+
+    def is_diag_parsed(self, pkt):
+        # Returns False if parse_diag() would ignore the decoded packet
+        # without touching any parser state
+        if len(pkt) < 1:
+            return False
+
+        if pkt[0] == diagcmd.DIAG_LOG_F:
+            if len(pkt) < 16:
+                return False
+            log_id = struct.unpack('<H', pkt[6:8])[0]
+            return log_id in self.process.keys()
+        elif pkt[0] == diagcmd.DIAG_MULTI_RADIO_CMD_F:
+            return self.is_diag_parsed(pkt[8:])
+        elif pkt[0] == diagcmd.DIAG_EVENT_REPORT_F:
+            return self.parse_events
+        elif pkt[0] in (diagcmd.DIAG_EXT_MSG_F, diagcmd.DIAG_QSR_EXT_MSG_TERSE_F, diagcmd.DIAG_QSR4_EXT_MSG_TERSE_F):
+            return self.parse_msgs
+        elif pkt[0] in (diagcmd.DIAG_VERNO_F, diagcmd.DIAG_EXT_BUILD_ID_F, diagcmd.DIAG_LOG_CONFIG_F, diagcmd.DIAG_EXT_MSG_CONFIG_F,
+                diagcmd.DIAG_EVENT_MASK_GET_F):
+            return True
         else:
-            self.io_device.write_then_read_discard(util.generate_packet(diagcmd.log_mask_scat_lte(layers=self.layers)), 0x1000, False)
+            return False
 
     def parse_diag(self, pkt, hdlc_encoded = True, has_crc = True, args = None):
         # Should contain DIAG command and CRC16
@@ -273,23 +496,10 @@ class QualcommParser:
         # When the pkt is not HDLC encoded, hdlc_encoded should be set to True
         # radio_id = 0 for default, larger than 1 for SIM 1 and such
 
-        if len(pkt) < 3:
+        pkt = self.decode_diag(pkt, hdlc_encoded, has_crc)
+        if pkt is None:
             return
 
-        if hdlc_encoded:
-            pkt = util.unwrap(pkt)
-
-        # Check and strip CRC if existing
-        if has_crc:
-            # Check CRC only if check_crc is enabled
-            if self.check_crc:
-                crc = util.dm_crc16(pkt[:-2])
-                crc_pkt = (pkt[-1] << 8) | pkt[-2]
-                if crc != crc_pkt:
-                    self.logger.log(logging.WARNING, "CRC mismatch: expected 0x{:04x}, got 0x{:04x}".format(crc, crc_pkt))
-                    self.logger.log(logging.DEBUG, util.xxd(pkt))
-            pkt = pkt[:-2]
-
         if pkt[0] == diagcmd.DIAG_LOG_F:
             return self.parse_diag_log(pkt, args)
         elif pkt[0] == diagcmd.DIAG_EVENT_REPORT_F and self.parse_events:
@@ -307,44 +517,66 @@ class QualcommParser:
         elif pkt[0] == diagcmd.DIAG_EXT_BUILD_ID_F:
             return self.parse_diag_ext_build_id(pkt)
         elif pkt[0] == diagcmd.DIAG_LOG_CONFIG_F:
+            if self.load_shedder and self.load_shedder.take_response():
+                return None
             return self.parse_diag_log_config(pkt)
         elif pkt[0] == diagcmd.DIAG_EXT_MSG_CONFIG_F:
             return self.parse_diag_ext_msg_config(pkt)
+        elif pkt[0] == diagcmd.DIAG_EVENT_MASK_GET_F:
+            return self.parse_diag_event_mask(pkt)
         else:
             #print("Not parsing non-Log packet %02x" % pkt[0])
             #util.xxd(pkt)
             return None
 
     def run_diag(self, writer_qmdl = None):
-        oldbuf = b''
-        loop = True
+        deframer = util.HdlcDeframer()
+        dropped_bytes = 0
         try:
-            while loop:
+            if getattr(self.io_device, 'mapped', None) is not None:
+                # Memory-mapped dump, scan the whole file in place
+                for frame in util.iter_hdlc_frames(self.io_device.mapped):
+                    parse_result = self.parse_diag(frame[:-1])
+
+                    if writer_qmdl:
+                        writer_qmdl.write_cp(frame)
+
+                    if parse_result is not None:
+                        self.postprocess_parse_result(parse_result)
+                return
+
+            while True:
                 buf = self.io_device.read(0x1000)
                 if len(buf) == 0:
                     if self.io_device.block_until_data:
                         continue
                     else:
-                        loop = False
-                buf = oldbuf + buf
-                buf_atom = buf.split(b'\x7e')
+                        break
 
-                if len(buf) < 1 or buf[-1] != 0x7e:
-                    oldbuf = buf_atom.pop()
-                else:
-                    oldbuf = b''
-
-                for pkt in buf_atom:
-                    if len(pkt) == 0:
-                        continue
-                    parse_result = self.parse_diag(pkt)
+                # Device time of the last frame which has one, for the lag estimate
+                last_ts = None
+                for frame in deframer.feed(buf):
+                    # frame is a view into the deframer including trailing 0x7e
+                    parse_result = self.parse_diag(frame[:-1])
 
                     if writer_qmdl:
-                        writer_qmdl.write_cp(pkt + b'\x7e')
+                        writer_qmdl.write_cp(frame)
 
                     if parse_result is not None:
+                        if 'ts' in parse_result:
+                            last_ts = parse_result['ts']
                         self.postprocess_parse_result(parse_result)
 
+                if self.load_shedder:
+                    if last_ts is not None:
+                        self.load_shedder.observe(last_ts)
+                    backlog = getattr(self.io_device, 'backlog', None)
+                    self.load_shedder.update(backlog() if backlog else 0.0)
+
+                if deframer.dropped_bytes != dropped_bytes:
+                    self.logger.log(logging.WARNING, 'Dropped {} bytes of unterminated data'.format(deframer.dropped_bytes - dropped_bytes))
+                    dropped_bytes = deframer.dropped_bytes
+
         except KeyboardInterrupt:
             return
 
@@ -356,80 +588,161 @@ class QualcommParser:
         self.io_device.write_then_read_discard(util.generate_packet(struct.pack('<LL', diagcmd.DIAG_LOG_CONFIG_F, diagcmd.LOG_CONFIG_DISABLE_OP)), 0x1000, False)
         self.io_device.write_then_read_discard(util.generate_packet(struct.pack('<BBHHH', diagcmd.DIAG_EXT_MSG_CONFIG_F, 0x05, 0x0000, 0x0000, 0x0000)), 0x1000, False)
 
-    def parse_dlf(self):
-        oldbuf = b''
-        while True:
-            buf = self.io_device.read(0x100000)
-            #print("%d"% len(buf))
-            if len(buf) == 0:
+    dlf_header = struct.Struct('<HHQ')
+
+    def parse_dlf_buf(self, buf):
+        # Parses all complete records in buf, returns the position of the
+        # first byte which is not consumed yet, or -1 if the file is corrupt
+        buf_len = len(buf)
+        pos = 0
+        while pos + 2 <= buf_len:
+            pkt_len = struct.unpack_from('<H', buf, pos)[0]
+            if pkt_len < 2:
+                return -1
+            if pos + pkt_len > buf_len:
                 break
-            buf = oldbuf + buf
 
-            pkt_len = struct.unpack('<H', buf[0:2])[0]
-            while len(buf) >= pkt_len:
-                # DLF lacks CRC16/other fancy stuff
-                pkt = buf[0:pkt_len]
-                pkt = b'\x10\x00' + pkt[0:2] + pkt
-                parse_result = self.parse_diag(pkt, has_crc=False, hdlc_encoded=False)
+            # DLF lacks CRC16/other fancy stuff
+            # Records without full log header are ignored, same as parse_diag_log()
+            if pkt_len >= self.dlf_header.size:
+                length, log_id, timestamp = self.dlf_header.unpack_from(buf, pos)
+                pkt_header = self.log_header(diagcmd.DIAG_LOG_F, 0, length, length, log_id, timestamp)
+                parse_result = self.process_diag_log(pkt_header, buf[pos + self.dlf_header.size:pos + pkt_len])
 
                 if parse_result is not None:
                     self.postprocess_parse_result(parse_result)
+            pos += pkt_len
+        return pos
 
-                buf = buf[pkt_len:]
+    def parse_dlf(self):
+        mapped = getattr(self.io_device, 'mapped', None)
+        if mapped is not None:
+            if self.parse_dlf_buf(mapped) < 0:
+                self.logger.log(logging.WARNING, 'Invalid DLF record length, stopping')
+            return
 
-                if len(buf) < 2:
-                    break
-                pkt_len = struct.unpack('<H', buf[0:2])[0]
+        oldbuf = b''
+        while True:
+            buf = self.io_device.read(0x100000)
+            if len(buf) == 0:
+                break
+            buf = oldbuf + buf
 
-            oldbuf = buf
+            cur_pos = self.parse_dlf_buf(buf)
+            if cur_pos < 0:
+                self.logger.log(logging.WARNING, 'Invalid DLF record length, stopping')
+                break
+            oldbuf = buf[cur_pos:]
 
     # Experimental HDF parser.
     # It scans the file for packets in the format "0x10 0x00 packet_length body"
     # Ignoring any additional fields that the file might contain
-    def parse_hdf(self):
+    def parse_hdf_buf(self, buf, final=False):
+        # Parses all complete packets in buf, returns the position of the
+        # first byte which is not consumed yet
+        buf_len = len(buf)
+        pos = 0
         while True:
-            header = self.io_device.read(1)
+            pos = buf.find(b'\x10\x00', pos)
+            if pos < 0:
+                # Trailing 0x10 may be the start of the next header
+                if not final and buf_len > 0 and buf[-1] == 0x10:
+                    return buf_len - 1
+                return buf_len
 
-            # EOF check
-            if len(header) == 0:
-                break
+            if pos + 6 > buf_len:
+                return buf_len if final else pos
 
-            # First byte must be 0x10
-            if header != b'\x10':
+            # pkt length from header and pkt length from body must be equal
+            if buf[pos+2:pos+4] != buf[pos+4:pos+6]:
+                pos += 1
                 continue
 
-            # Second byte must be 0x00
-            header += self.io_device.read(1)
-            if header != b'\x10\x00':
+            pkt_len = struct.unpack_from('<H', buf, pos + 2)[0]
+            if pkt_len < 3:
+                pos += 1
                 continue
 
-            # pkt length from header and pkt length from body must be equal
-            header += self.io_device.read(2)
-            body = self.io_device.read(2)
-            if header[2:4] != body[0:2]:
-                continue
+            pkt_end = pos + 4 + pkt_len
+            if pkt_end > buf_len and not final:
+                return pos
 
-            # Convert pkt length to int
-            pkt_len = struct.unpack('<H', header[2:4])[0]
+            parse_result = self.parse_diag(buf[pos:pkt_end], has_crc=False, hdlc_encoded=False)
+            if parse_result is not None:
+                self.postprocess_parse_result(parse_result)
+            pos = pkt_end
 
-            body_len = pkt_len - 2
+    def parse_hdf(self):
+        mapped = getattr(self.io_device, 'mapped', None)
+        if mapped is not None:
+            self.parse_hdf_buf(mapped, final=True)
+            return
 
-            if (body_len < 1):
-                continue
+        oldbuf = b''
+        while True:
+            buf = self.io_device.read(0x100000)
+            if len(buf) == 0:
+                break
+            buf = oldbuf + buf
 
-            # Read full body
-            body += self.io_device.read(body_len)
-            pkt = header + body
+            cur_pos = self.parse_hdf_buf(buf)
+            oldbuf = buf[cur_pos:]
+
+        # Last packet may be truncated
+        if len(oldbuf) > 0:
+            self.parse_hdf_buf(oldbuf, final=True)
+
+    def run_diag_parallel(self):
+        # Framing, unescaping and CRC checks are done in worker processes,
+        # parsing is done here in file order to keep the per-radio state
+        # (last cell IDs/EARFCNs, 1x segment reassembly) consistent
+        worker_params = {
+            'log_level': self.logger.level,
+            'events': self.parse_events,
+            'msgs': self.parse_msgs,
+            'disable-crc-check': not self.check_crc,
+            'crc-check-interval': self.crc_check_interval}
+        try:
+            for pkt in scat.parallel.decode_dump_parallel(QualcommParser, worker_params, self.io_device.fname, self.jobs):
+                parse_result = self.parse_diag(pkt, hdlc_encoded=False, has_crc=False)
 
-            parse_result = self.parse_diag(pkt, has_crc=False, hdlc_encoded=False)
-            if parse_result is not None:
-                self.postprocess_parse_result(parse_result)
+                if parse_result is not None:
+                    self.postprocess_parse_result(parse_result)
+        except KeyboardInterrupt:
+            return
+
+    def read_indexed(self, entries):
+        # Parses only the packets at given (offset, length) of the current dump
+        is_dlf = self.io_device.fname.find('.dlf') > 0
+        try:
+            for offset, length in entries:
+                buf = self.io_device.read_at(offset, length)
+                if is_dlf:
+                    self.parse_dlf_buf(buf)
+                    continue
+
+                parse_result = self.parse_diag(buf[:-1])
+                if parse_result is not None:
+                    self.postprocess_parse_result(parse_result)
+        except KeyboardInterrupt:
+            return
 
     def read_dump(self):
         while self.io_device.file_available:
             self.logger.log(logging.INFO, "Reading from {}".format(self.io_device.fname))
-            if self.io_device.fname.find('.qmdl') > 0:
-                self.run_diag()
+            entries = None
+            if self.index_filter is not None:
+                entries = scat.index.lookup(self, self.io_device.fname, **self.index_filter)
+                if entries is None:
+                    self.logger.log(logging.WARNING, 'Cannot use index for {}, reading whole file'.format(self.io_device.fname))
+
+            if entries is not None:
+                self.read_indexed(entries)
+            elif self.io_device.fname.find('.qmdl') > 0:
+                if self.jobs > 1 and scat.parallel.is_splittable(self.io_device.fname):
+                    self.run_diag_parallel()
+                else:
+                    self.run_diag()
             elif self.io_device.fname.find('.dlf') > 0:
                 self.parse_dlf()
             elif self.io_device.fname.find('.hdf') > 0:
@@ -453,8 +766,12 @@ class QualcommParser:
         if 'cp' in parse_result:
             if 'layer' in parse_result:
                 if parse_result['layer'] in self.layers:
-                    for sock_content in parse_result['cp']:
-                        self.writer.write_cp(sock_content, radio_id, ts)
+                    if self.writer_takes_layer:
+                        for sock_content in parse_result['cp']:
+                            self.writer.write_cp(sock_content, radio_id, ts, parse_result['layer'])
+                    else:
+                        for sock_content in parse_result['cp']:
+                            self.writer.write_cp(sock_content, radio_id, ts)
             else:
                 for sock_content in parse_result['cp']:
                     self.writer.write_cp(sock_content, radio_id, ts)
@@ -462,8 +779,12 @@ class QualcommParser:
         if 'up' in parse_result:
             if 'layer' in parse_result:
                 if parse_result['layer'] in self.layers:
-                    for sock_content in parse_result['up']:
-                        self.writer.write_up(sock_content, radio_id, ts)
+                    if self.writer_takes_layer:
+                        for sock_content in parse_result['up']:
+                            self.writer.write_up(sock_content, radio_id, ts, parse_result['layer'])
+                    else:
+                        for sock_content in parse_result['up']:
+                            self.writer.write_up(sock_content, radio_id, ts)
             else:
                 for sock_content in parse_result['up']:
                     self.writer.write_up(sock_content, radio_id, ts)
@@ -504,6 +825,16 @@ class QualcommParser:
         pkt_header = self.log_header._make(struct.unpack('<BBHHHQ', pkt[0:16]))
         pkt_body = pkt[16:]
 
+        return self.process_diag_log(pkt_header, pkt_body, args)
+
+    def process_diag_log(self, pkt_header, pkt_body, args=None):
+        """Dispatches the DIAG_LOG_F packet to the log parsers.
+
+        Parameters:
+        pkt_header (QcDiagLogHeader): parsed DIAG_LOG_F header
+        pkt_body (bytes): log data following the header
+        args (dict): 'radio_id' (int): used SIM or subscription ID on multi-SIM devices
+        """
         if len(pkt_body) != (pkt_header.length2 - 12):
             self.logger.log(logging.WARNING, "Packet length mismatch: expected {}, got {}".format(pkt_header.length2, len(pkt_body)+12))
 
@@ -787,6 +1118,17 @@ class QualcommParser:
 
             return {'stdout': stdout, 'start': pkt_header.start_id, 'end': pkt_header.end_id, 'level': levels}
 
+    def parse_diag_event_mask(self, pkt):
+        if len(pkt) < 6:
+            return None
+        header = namedtuple('QcDiagEventMask', 'cmd_code error_code reserved num_bits')
+        header_val = header._make(struct.unpack('<BBHH', pkt[0:6]))
+        if header_val.error_code != 0:
+            return None
+
+        stdout = 'Event mask: {} events'.format(header_val.num_bits)
+        return {'stdout': stdout, 'num_bits': header_val.num_bits}
+
 __entry__ = QualcommParser
 
 def name():
@@ -2,6 +2,7 @@
 # coding: utf8
 
 import scat.util as util
+import scat.index
 import struct
 import logging
 import datetime
@@ -54,6 +55,7 @@ class SamsungParser:
 
         self.io_device = None
         self.writer = None
+        self.writer_takes_layer = False
 
         self.name = 'samsung'
         self.shortname = 'sec'
@@ -67,6 +69,7 @@ class SamsungParser:
         self.ilm = False
         self.combine_stdout = False
         self.layers = []
+        self.index_filter = None
 
         self.trace_group = None
         self.ilm_group = None
@@ -109,6 +112,8 @@ class SamsungParser:
 
     def set_writer(self, writer):
         self.writer = writer
+        # Writers with per-output layer filters get the layer of each packet
+        self.writer_takes_layer = getattr(writer, 'takes_layer', False)
 
     def update_icd_ver(self, version):
         for p in self.sdm_parsers:
@@ -135,6 +140,8 @@ class SamsungParser:
                 self.combine_stdout = params[p]
             elif p == 'layer':
                 self.layers = params[p]
+            elif p == 'index-filter':
+                self.index_filter = params[p]
 
     def init_diag(self):
         self.io_device.write(generate_sdm_packet(0xa0, 0x00, sdm_control_message.CONTROL_START, struct.pack('>L', self.start_magic)))
@@ -184,66 +191,72 @@ class SamsungParser:
     def parse_diag(self, pkt):
         return self.parse_diag_log(pkt)
 
-    def run_diag(self, writer_sdmraw=None):
-        self.logger.log(logging.INFO, 'Starting diag')
-
-        oldbuf = b''
-        loop = True
+    def parse_sdmraw_buf(self, buf, writer_sdmraw=None):
+        # Parses all complete packets in buf, returns the position of the
+        # first byte which is not consumed yet
         cur_pos = 0
-        try:
-            while loop:
-                buf = self.io_device.read(0x1000)
-                if len(buf) == 0:
-                    if self.io_device.block_until_data:
-                        continue
-                    else:
-                        loop = False
-                buf = oldbuf + buf
+        while cur_pos < len(buf):
+            pos = buf.find(b'\x7f', cur_pos)
 
-                cur_pos = 0
-                while cur_pos < len(buf):
-                    pos = buf.find(b'\x7f', cur_pos)
+            if pos < 0:
+                self.logger.log(logging.WARNING, 'Cannot find the start of packet')
+                return len(buf)
 
-                    if pos < 0:
-                        self.logger.log(logging.WARNING, 'Cannot find the start of packet')
-                        oldbuf = buf
-                        break
+            if len(buf) < pos + 15:
+                # self.logger.log(logging.WARNING, 'Packet shorter than expected')
+                return pos
 
-                    if len(buf) < pos + 15:
-                        # self.logger.log(logging.WARNING, 'Packet shorter than expected')
-                        oldbuf = buf[pos:]
-                        break
+            sdm_pkt_hdr = sdmheader._make(struct.unpack('<HBHHBBBL', buf[pos+1:pos+15]))
 
-                    sdm_pkt_hdr = sdmheader._make(struct.unpack('<HBHHBBBL', buf[pos+1:pos+15]))
+            # Sanity check
+            if len(buf) < (pos + 2 + sdm_pkt_hdr.length1):
+                # self.logger.log(logging.WARNING, 'Current buffer shorter than the packet, storing it')
+                return pos
 
-                    # Sanity check
-                    if len(buf) < (pos + 2 + sdm_pkt_hdr.length1):
-                        # self.logger.log(logging.WARNING, 'Current buffer shorter than the packet, storing it')
-                        oldbuf = buf[pos:]
-                        break
+            if buf[pos+1+sdm_pkt_hdr.length1] != 0x7e:
+                self.logger.log(logging.WARNING, 'Packet start {:02x} and end {:02x} does not match, dropping'.format(buf[pos], buf[pos+1+sdm_pkt_hdr.length1]))
+                cur_pos = pos + 2
+                continue
 
-                    if buf[pos+1+sdm_pkt_hdr.length1] != 0x7e:
-                        self.logger.log(logging.WARNING, 'Packet start {:02x} and end {:02x} does not match, dropping'.format(buf[pos], buf[pos+1+sdm_pkt_hdr.length1]))
-                        cur_pos = pos + 2
-                        continue
+            if sdm_pkt_hdr.length2 + 3 != sdm_pkt_hdr.length1:
+                self.logger.log(logging.WARNING, 'Inner and outer length does not match, dropping')
+                cur_pos = pos + 2
+                continue
 
-                    if sdm_pkt_hdr.length2 + 3 != sdm_pkt_hdr.length1:
-                        self.logger.log(logging.WARNING, 'Inner and outer length does not match, dropping')
-                        cur_pos = pos + 2
-                        continue
+            pkt = buf[pos:pos + sdm_pkt_hdr.length1 + 2]
+            parse_result = self.parse_diag(pkt)
+
+            if writer_sdmraw:
+                writer_sdmraw.write_cp(pkt)
 
-                    parse_result = self.parse_diag(buf[pos:pos + sdm_pkt_hdr.length1 + 2])
+            if parse_result is not None:
+                self.postprocess_parse_result(parse_result)
 
-                    if writer_sdmraw:
-                        writer_sdmraw.write_cp(buf[pos:pos + sdm_pkt_hdr.length1 + 2])
+            cur_pos = (pos + sdm_pkt_hdr.length1 + 2)
 
-                    if parse_result is not None:
-                        self.postprocess_parse_result(parse_result)
+        return cur_pos
+
+    def run_diag(self, writer_sdmraw=None):
+        self.logger.log(logging.INFO, 'Starting diag')
+
+        oldbuf = b''
+        try:
+            if getattr(self.io_device, 'mapped', None) is not None:
+                # Memory-mapped dump, scan the whole file in place
+                self.parse_sdmraw_buf(self.io_device.mapped, writer_sdmraw)
+                return
 
-                    cur_pos = (pos + sdm_pkt_hdr.length1 + 2)
+            while True:
+                buf = self.io_device.read(0x1000)
+                if len(buf) == 0:
+                    if self.io_device.block_until_data:
+                        continue
+                    else:
+                        break
+                buf = oldbuf + buf
 
-                if cur_pos == len(buf):
-                    oldbuf = b''
+                cur_pos = self.parse_sdmraw_buf(buf, writer_sdmraw)
+                oldbuf = buf[cur_pos:]
 
         except KeyboardInterrupt:
             return
@@ -257,99 +270,113 @@ class SamsungParser:
         self.logger.log(logging.INFO, 'Starting diag from dump')
 
         oldbuf = b''
-        cur_pos = 0
         try:
+            if getattr(self.io_device, 'mapped', None) is not None:
+                # Memory-mapped dump, scan the whole file in place
+                self.parse_sdmraw_buf(self.io_device.mapped)
+                return
+
             while True:
                 buf = self.io_device.read(0x90000)
-                #util.xxd(buf, True)
                 if len(buf) == 0:
-                    continue
-                cur_pos = 0
-                first = False
-                while cur_pos < len(buf):
-                    #print('---- subpacket ----')
-                    #print(buf)
-                    #assert buf[cur_pos] == 0x7f
-                    if buf[cur_pos] != 0x7f:
-                        # if first:
-                        #     self.logger.log(logging.WARNING, 'Unexpected end of the packet, dropping it')
-                        #     self.logger.log(logging.DEBUG, util.xxd(buf))
-                        #     break
-                        cur_pos += 1
+                    if self.io_device.block_until_data:
                         continue
-                    first = True
-                    if cur_pos+SamsungParser.pkg_header_len < len(buf):
-                        len_1 = buf[cur_pos + 1] | (buf[cur_pos + 2] << 8)
-                        len_2 = buf[cur_pos + 3] | (buf[cur_pos + 4] << 8)
-                        #util.xxd(buf[cur_pos:cur_pos+len_1 + 2])
-                        #util.xxd(buf[cur_pos: cur_pos + len_1 + 2], True)
-                        self.parse_diag(buf[cur_pos:cur_pos + len_1 + 2])
-                    # cur_pos += (len_1 + 2)
-                    cur_pos += 1
-                    #print('%s/%s' % (cur_pos, len(buf)))
-                #print('---- end ----')
+                    else:
+                        break
+                buf = oldbuf + buf
+
+                cur_pos = self.parse_sdmraw_buf(buf)
+                oldbuf = buf[cur_pos:]
+
+            if len(oldbuf) > 0:
+                self.logger.log(logging.WARNING, 'Dropping {} bytes of truncated packet at the end of dump'.format(len(oldbuf)))
 
         except KeyboardInterrupt:
             return
 
+    # logger_ts is a timestamp added by application logger, it's stored as 48 bits unsigned int representing milliseconds since epoch.
+    # the timezone is specified in sdm file header, that header isn't supported by this parser.
+    logger_header_struct = namedtuple('SdmLoggerHeader', 'magic logger_ts_low logger_ts_up seqnr direction group command timestamp')
+
+    def parse_logger_buf(self, buf):
+        # Parses all complete packets in buf, returns the position of the
+        # first byte which is not consumed yet
+        cur_pos = 0
+        while cur_pos < len(buf):
+            if cur_pos + 2 > len(buf):
+                break
+            pkt_len = struct.unpack('<H', buf[cur_pos:cur_pos+2])[0]
+            if cur_pos + 2 + pkt_len > len(buf):
+                break
+            pkt = buf[cur_pos+2:cur_pos+2+pkt_len]
+            cur_pos += (2 + pkt_len)
+
+            # print(binascii.hexlify(pkt))
+            if len(pkt) < 17:
+                self.logger.log(logging.INFO, 'Skipping packet as shorter than expected')
+                continue
+            logger_header = self.logger_header_struct._make(struct.unpack('<HHLHBBBL', pkt[0:17]))
+            if not (logger_header.magic == 0x7f39):
+                self.logger.log(logging.INFO, 'Skipping packet as magic does not match')
+                continue
+            payload = pkt[17:]
+            parse_result = self.parse_diag(generate_sdm_packet(logger_header.direction, logger_header.group, logger_header.command, payload, logger_header.timestamp))
+            if parse_result is not None:
+                parse_result['ts'] = util.parse_sdm_ts(logger_header.logger_ts_up, logger_header.logger_ts_low)
+                self.postprocess_parse_result(parse_result)
+
+        return cur_pos
+
     def run_logger(self):
         self.logger.log(logging.INFO, 'Starting diag from logger output')
-        # logger_ts is a timestamp added by application logger, it's stored as 48 bits unsigned int representing milliseconds since epoch.
-        # the timezone is specified in sdm file header, that header isn't supported by this parser.
-        logger_header_struct = namedtuple('SdmLoggerHeader', 'magic logger_ts_low logger_ts_up seqnr direction group command timestamp')
 
         oldbuf = b''
-        loop = True
-        cur_pos = 0
         try:
-            while loop:
+            if getattr(self.io_device, 'mapped', None) is not None:
+                # Memory-mapped dump, scan the whole file in place
+                self.parse_logger_buf(self.io_device.mapped)
+                return
+
+            while True:
                 buf = self.io_device.read(0x1000)
                 if len(buf) == 0:
                     if self.io_device.block_until_data:
                         continue
                     else:
-                        loop = False
-                buf = oldbuf + buf
-
-                cur_pos = 0
-                while cur_pos < len(buf):
-                    if cur_pos + 2 > len(buf):
-                        oldbuf = buf[cur_pos:]
-                        break
-                    pkt_len = struct.unpack('<H', buf[cur_pos:cur_pos+2])[0]
-                    if cur_pos + pkt_len > len(buf):
-                        oldbuf = buf[cur_pos:]
                         break
-                    pkt = buf[cur_pos+2:cur_pos+2+pkt_len]
-                    if len(pkt) < pkt_len:
-                        oldbuf = buf[cur_pos:]
-                        break
-                    cur_pos += (2 + pkt_len)
+                buf = oldbuf + buf
 
-                    # print(binascii.hexlify(pkt))
-                    if len(pkt) < 17:
-                        self.logger.log(logging.INFO, 'Skipping packet as shorter than expected')
-                        continue
-                    logger_header = logger_header_struct._make(struct.unpack('<HHLHBBBL', pkt[0:17]))
-                    if not (logger_header.magic == 0x7f39):
-                        self.logger.log(logging.INFO, 'Skipping packet as magic does not match')
-                        continue
-                    payload = pkt[17:]
-                    parse_result = self.parse_diag(generate_sdm_packet(logger_header.direction, logger_header.group, logger_header.command, payload, logger_header.timestamp))
-                    if parse_result is not None:
-                        parse_result['ts'] = util.parse_sdm_ts(logger_header.logger_ts_up, logger_header.logger_ts_low)
-                        self.postprocess_parse_result(parse_result)
+                cur_pos = self.parse_logger_buf(buf)
+                oldbuf = buf[cur_pos:]
 
-                if cur_pos == len(buf):
-                    oldbuf = b''
+        except KeyboardInterrupt:
+            return
 
+    def read_indexed(self, entries):
+        # Parses only the packets at given (offset, length) of the current dump
+        is_logger = scat.index.dump_type(self, self.io_device.fname) == 'sdm'
+        try:
+            for offset, length in entries:
+                buf = self.io_device.read_at(offset, length)
+                if is_logger:
+                    self.parse_logger_buf(buf)
+                else:
+                    self.parse_sdmraw_buf(buf)
         except KeyboardInterrupt:
             return
 
     def read_dump(self):
         while self.io_device.file_available:
             self.logger.log(logging.INFO, "Reading from {}".format(self.io_device.fname))
-            if self.io_device.fname.find('.sdmraw') > 0:
+            entries = None
+            if self.index_filter is not None:
+                entries = scat.index.lookup(self, self.io_device.fname, **self.index_filter)
+                if entries is None:
+                    self.logger.log(logging.WARNING, 'Cannot use index for {}, reading whole file'.format(self.io_device.fname))
+
+            if entries is not None:
+                self.read_indexed(entries)
+            elif self.io_device.fname.find('.sdmraw') > 0:
                 self.run_diag()
             elif self.io_device.fname.find('.sdm') > 0:
                 self.run_logger()
@@ -373,8 +400,12 @@ class SamsungParser:
         if 'cp' in parse_result:
             if 'layer' in parse_result:
                 if parse_result['layer'] in self.layers:
-                    for sock_content in parse_result['cp']:
-                        self.writer.write_cp(sock_content, radio_id, ts)
+                    if self.writer_takes_layer:
+                        for sock_content in parse_result['cp']:
+                            self.writer.write_cp(sock_content, radio_id, ts, parse_result['layer'])
+                    else:
+                        for sock_content in parse_result['cp']:
+                            self.writer.write_cp(sock_content, radio_id, ts)
             else:
                 for sock_content in parse_result['cp']:
                     self.writer.write_cp(sock_content, radio_id, ts)
@@ -382,8 +413,12 @@ class SamsungParser:
         if 'up' in parse_result:
             if 'layer' in parse_result:
                 if parse_result['layer'] in self.layers:
-                    for sock_content in parse_result['up']:
-                        self.writer.write_up(sock_content, radio_id, ts)
+                    if self.writer_takes_layer:
+                        for sock_content in parse_result['up']:
+                            self.writer.write_up(sock_content, radio_id, ts, parse_result['layer'])
+                    else:
+                        for sock_content in parse_result['up']:
+                            self.writer.write_up(sock_content, radio_id, ts)
             else:
                 for sock_content in parse_result['up']:
                     self.writer.write_up(sock_content, radio_id, ts)
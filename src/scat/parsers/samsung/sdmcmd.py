@@ -471,16 +471,21 @@ def generate_sdm_packet(direction, group, command, payload, timestamp=0):
     pkt_header = struct.pack('<HBHHBBBL', pkt_len + 3, 0, pkt_len, 0, direction, group, command, timestamp)
     return b'\x7f' + pkt_header + payload + b'\x7e'
 
-def parse_sdm_header(hdr):
-    tmp_hdr = sdmheader._make(struct.unpack('<HBHHBBBL', hdr))
-    radio_id = (tmp_hdr.group) >> 5
-    group_real = tmp_hdr.group & 0x1F
+def split_sdm_group(group):
+    # Upper 3 bits of the group carry the radio ID
+    radio_id = group >> 5
+    group_real = group & 0x1F
     if radio_id <= 0:
         radio_id = 0
     elif radio_id > 2:
         radio_id = 1
     else:
         radio_id -= 1
+    return radio_id, group_real
+
+def parse_sdm_header(hdr):
+    tmp_hdr = sdmheader._make(struct.unpack('<HBHHBBBL', hdr))
+    radio_id, group_real = split_sdm_group(tmp_hdr.group)
 
     return sdmheader_ext(tmp_hdr.length1, tmp_hdr.zero, tmp_hdr.length2,
         tmp_hdr.stamp, tmp_hdr.direction, radio_id, group_real, tmp_hdr.command, tmp_hdr.timestamp)
\ No newline at end of file
@@ -14,6 +14,7 @@ class UnisocParser:
     def __init__(self):
         self.io_device = None
         self.writer = None
+        self.writer_takes_layer = False
         self.combine_stdout = False
 
         self.name = 'unisoc'
@@ -38,6 +39,8 @@ class UnisocParser:
 
     def set_writer(self, writer):
         self.writer = writer
+        # Writers with per-output layer filters get the layer of each packet
+        self.writer_takes_layer = getattr(writer, 'takes_layer', False)
 
     def set_parameter(self, params):
         for p in params:
@@ -183,8 +186,12 @@ class UnisocParser:
         if 'cp' in parse_result:
             if 'layer' in parse_result:
                 if parse_result['layer'] in self.layers:
-                    for sock_content in parse_result['cp']:
-                        self.writer.write_cp(sock_content, radio_id, ts)
+                    if self.writer_takes_layer:
+                        for sock_content in parse_result['cp']:
+                            self.writer.write_cp(sock_content, radio_id, ts, parse_result['layer'])
+                    else:
+                        for sock_content in parse_result['cp']:
+                            self.writer.write_cp(sock_content, radio_id, ts)
             else:
                 for sock_content in parse_result['cp']:
                     self.writer.write_cp(sock_content, radio_id, ts)
@@ -192,8 +199,12 @@ class UnisocParser:
         if 'up' in parse_result:
             if 'layer' in parse_result:
                 if parse_result['layer'] in self.layers:
-                    for sock_content in parse_result['up']:
-                        self.writer.write_up(sock_content, radio_id, ts)
+                    if self.writer_takes_layer:
+                        for sock_content in parse_result['up']:
+                            self.writer.write_up(sock_content, radio_id, ts, parse_result['layer'])
+                    else:
+                        for sock_content in parse_result['up']:
+                            self.writer.write_up(sock_content, radio_id, ts)
             else:
                 for sock_content in parse_result['up']:
                     self.writer.write_up(sock_content, radio_id, ts)
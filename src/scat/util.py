@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 # coding: utf8
 
+import binascii
 import struct
 import datetime
 import sys
@@ -49,14 +50,20 @@ crc_table = [
     0x7bc7, 0x6a4e, 0x58d5, 0x495c, 0x3de3, 0x2c6a, 0x1ef1, 0x0f78
     ]
 
+# Bit-reversed value of each byte
+crc_bitrev_table = bytes(int('{:08b}'.format(x)[::-1], 2) for x in range(256))
+
 def dm_crc16(arr):
     if has_libscrc:
         return libscrc.x25(arr)
     else:
-        ret = 0xffff
-        for b in arr:
-            ret = (ret >> 8) ^ crc_table[(ret ^ b) & 0xff]
-        return ret ^ 0xffff
+        # CRC16/X.25 is the bit-reflected form of the CRC16/CCITT computed by
+        # binascii.crc_hqx: reverse the input bits and the result instead of
+        # running a table lookup per byte in Python
+        if not isinstance(arr, (bytes, bytearray)):
+            arr = bytes(arr)
+        ret = binascii.crc_hqx(arr.translate(crc_bitrev_table), 0xffff)
+        return ((crc_bitrev_table[ret & 0xff] << 8) | crc_bitrev_table[ret >> 8]) ^ 0xffff
 
 def wrap(arr):
     t = arr.replace(b'\x7d', b'\x7d\x5d')
@@ -64,10 +71,129 @@ def wrap(arr):
     return t
 
 def unwrap(arr):
+    if type(arr) != bytes:
+        arr = bytes(arr)
+    # Most frames do not contain any escaped byte
+    if arr.find(b'\x7d') < 0:
+        return arr
     t = arr.replace(b'\x7d\x5e', b'\x7e')
     t = t.replace(b'\x7d\x5d', b'\x7d')
     return t
 
+# CRC16/X.25 over data followed by its little endian CRC16 always yields this
+dm_crc16_residue = 0x0f47
+
+def decode_diag_frame(frame, hdlc_encoded=True, check_crc=True):
+    """Removes HDLC escaping, verifies and strips the trailing CRC16.
+
+    Parameters:
+    frame (bytes, bytearray or memoryview): DIAG frame without trailing 0x7e
+    hdlc_encoded (bool): remove HDLC escaping
+    check_crc (bool): verify the CRC16
+
+    Returns a tuple (packet without CRC16 as bytes, received CRC16 if the
+    verification failed, otherwise None).
+    """
+    if hdlc_encoded:
+        pkt = unwrap(frame)
+    elif type(frame) != bytes:
+        pkt = bytes(frame)
+    else:
+        pkt = frame
+
+    # The CRC is verified over the whole frame, no need to slice it off first
+    if check_crc and len(pkt) >= 2 and dm_crc16(pkt) != dm_crc16_residue:
+        return pkt[:-2], (pkt[-1] << 8) | pkt[-2]
+    return pkt[:-2], None
+
+class HdlcDeframer:
+    """Incremental 0x7e-delimited frame splitter over a preallocated buffer.
+
+    Input is copied once into a fixed bytearray, and complete frames are
+    handed out as memoryview slices including the trailing 0x7e. A frame view
+    is only valid until the generator returned by feed() is resumed.
+    Unterminated data larger than the buffer is discarded and counted in
+    dropped_bytes instead of growing without bound.
+    """
+    def __init__(self, size=0x40000):
+        self.size = size
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.scan = 0
+        self.end = 0
+        self.dropped_bytes = 0
+
+    def __len__(self):
+        return self.end - self.start
+
+    def reset(self):
+        self.start = 0
+        self.scan = 0
+        self.end = 0
+
+    def _make_room(self):
+        if self.start > 0:
+            pending = self.end - self.start
+            self.view[0:pending] = self.view[self.start:self.end]
+            self.scan -= self.start
+            self.start = 0
+            self.end = pending
+        else:
+            # Buffer is full of a single unterminated frame
+            self.dropped_bytes += self.end
+            self.reset()
+
+    def _frames(self):
+        while True:
+            pos = self.buf.find(b'\x7e', self.scan, self.end)
+            if pos < 0:
+                self.scan = self.end
+                break
+            frame_start = self.start
+            self.start = self.scan = pos + 1
+            if pos > frame_start:
+                yield self.view[frame_start:pos + 1]
+
+        if self.start == self.end:
+            self.reset()
+
+    def feed(self, data):
+        data = memoryview(data)
+        data_len = len(data)
+        data_pos = 0
+        while data_pos < data_len:
+            if self.end == self.size:
+                self._make_room()
+            chunk_len = min(data_len - data_pos, self.size - self.end)
+            self.view[self.end:self.end + chunk_len] = data[data_pos:data_pos + chunk_len]
+            self.end += chunk_len
+            data_pos += chunk_len
+            yield from self._frames()
+
+    def flush(self):
+        # Returns the trailing unterminated data, if any
+        if self.end == self.start:
+            return None
+        frame = bytes(self.view[self.start:self.end])
+        self.reset()
+        return frame
+
+def iter_hdlc_frames(buf, include_trailing=False, start=0):
+    # Same as HdlcDeframer.feed(), but for a complete in-memory buffer
+    # (bytes, bytearray or mmap) which is scanned in place
+    view = memoryview(buf)
+    while True:
+        pos = buf.find(b'\x7e', start)
+        if pos < 0:
+            break
+        if pos > start:
+            yield view[start:pos + 1]
+        start = pos + 1
+
+    if include_trailing and start < len(buf):
+        yield view[start:]
+
 def generate_packet(arr):
     crc = struct.pack('<H', dm_crc16(arr))
     arr += crc
@@ -2,6 +2,12 @@
 # coding: utf8
 
 from scat.writers.pcapwriter import PcapWriter
+from scat.writers.pcapngwriter import PcapngWriter
 from scat.writers.socketwriter import SocketWriter
 from scat.writers.rawwriter import RawWriter
 from scat.writers.nullwriter import NullWriter
+from scat.writers.asyncwriter import AsyncWriter
+from scat.writers.rotation import SegmentRotation
+from scat.writers.fanoutwriter import FanoutWriter
+from scat.writers.jsonwriter import JsonWriter
+from scat.writers.compressedrawwriter import CompressedRawWriter
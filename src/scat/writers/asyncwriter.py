@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+import logging
+import queue
+import threading
+
+class AsyncWriter:
+    """Runs another writer on a separate thread, fed by a bounded queue.
+
+    When the queue is full, 'block' waits for space, 'drop-oldest' discards
+    the oldest queued packet and 'drop-newest' discards the new packet.
+    """
+    policies = ('block', 'drop-oldest', 'drop-newest')
+
+    def __init__(self, writer, queue_size = 0x10000, policy = 'block'):
+        """
+        Parameters:
+        writer: writer doing the actual output
+        queue_size (int): maximum number of queued packets
+        policy (str): one of policies, used when the queue is full
+        """
+        if policy not in self.policies:
+            raise ValueError('Unknown policy {}'.format(policy))
+        self.writer = writer
+        # Pass the layer of packets through if the writer wants it
+        self.takes_layer = getattr(writer, 'takes_layer', False)
+        self.policy = policy
+        self.queue = queue.Queue(queue_size)
+        self.dropped_packets = 0
+        self.logger = logging.getLogger('scat.asyncwriter')
+
+        self.thread = threading.Thread(target=self.writer_loop, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def writer_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            is_cp, sock_content, radio_id, ts, layer = item
+            try:
+                if self.takes_layer:
+                    if is_cp:
+                        self.writer.write_cp(sock_content, radio_id, ts, layer)
+                    else:
+                        self.writer.write_up(sock_content, radio_id, ts, layer)
+                elif is_cp:
+                    self.writer.write_cp(sock_content, radio_id, ts)
+                else:
+                    self.writer.write_up(sock_content, radio_id, ts)
+            except Exception as e:
+                self.logger.log(logging.WARNING, 'Writer error: {}'.format(e))
+
+    def put(self, item):
+        if self.policy == 'block':
+            self.queue.put(item)
+            return
+
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped_packets += 1
+            if self.policy == 'drop-oldest':
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+                self.queue.put(item)
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def write_cp(self, sock_content, radio_id=0, ts=None, layer=None):
+        # The content may be a view into a buffer which is reused
+        if type(sock_content) != bytes:
+            sock_content = bytes(sock_content)
+        self.put((True, sock_content, radio_id, ts, layer))
+
+    def write_up(self, sock_content, radio_id=0, ts=None, layer=None):
+        if type(sock_content) != bytes:
+            sock_content = bytes(sock_content)
+        self.put((False, sock_content, radio_id, ts, layer))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Writes out everything queued so far
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        if self.dropped_packets > 0:
+            self.logger.log(logging.WARNING, 'Dropped {} packets, writer queue full'.format(self.dropped_packets))
+        if hasattr(self.writer, '__exit__'):
+            self.writer.__exit__(exc_type, exc_value, traceback)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+import scat.compression
+
+import logging
+import queue
+import threading
+import time
+
+class CompressedRawWriter:
+    """Writes the raw QMDL/SDM stream compressed, on a separate thread.
+
+    Frames are collected into blocks, and every block is written as a
+    complete compressed stream. A block is finished when it reaches
+    block_size bytes or is older than flush_interval seconds, so a crash
+    loses at most the last block. The file can be read by FileIO like any
+    compressed dump.
+    """
+    def __init__(self, fname, method = 'gzip', level = None, block_size = 0x100000, flush_interval = 1.0,
+            header = b'', trailer = b'', max_pending = 4):
+        """
+        Parameters:
+        fname (str): file to write, should end with the suffix of method
+        method (str): compression method, see scat.compression
+        level (int): compression level, None for the default of method
+        block_size (int): size of uncompressed data per block
+        flush_interval (float): maximum time in seconds before a block is finished
+        header (bytes): written at the start of the file
+        trailer (bytes): written at the end of the file
+        max_pending (int): number of blocks waiting for compression before writes block
+        """
+        if method not in scat.compression.available_methods():
+            raise ValueError('Compression method {} is not available'.format(method))
+        self.method = method
+        self.level = level
+        self.raw_file = open(fname, 'wb')
+        self.trailer = trailer
+        self.logger = logging.getLogger('scat.compressedrawwriter')
+
+        self.buf = bytearray(header)
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+
+        # Held while the buffer is modified or handed over
+        self.lock = threading.Lock()
+
+        self.queue = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self.compress_loop, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def next_block(self):
+        if self.flush_interval is None:
+            return self.queue.get()
+        while True:
+            timeout = max(self.last_flush + self.flush_interval - time.monotonic(), 0.01)
+            try:
+                return self.queue.get(timeout=timeout)
+            except queue.Empty:
+                pass
+            # No new frames finished the block, finish it here. The lock may
+            # be held by write() waiting for queue space, so do not wait for it
+            if not self.lock.acquire(blocking=False):
+                continue
+            try:
+                # Blocks are handed over under the lock, none can be queued before this one
+                if self.queue.empty() and time.monotonic() - self.last_flush >= self.flush_interval:
+                    self.last_flush = time.monotonic()
+                    if len(self.buf) > 0:
+                        block = self.buf
+                        self.buf = bytearray()
+                        return block
+            finally:
+                self.lock.release()
+
+    def compress_loop(self):
+        while True:
+            block = self.next_block()
+            if block is None:
+                break
+            try:
+                self.raw_file.write(scat.compression.compress_block(block, self.method, self.level))
+                self.raw_file.flush()
+            except (OSError, ValueError) as e:
+                self.logger.log(logging.WARNING, 'Cannot write compressed block: {}'.format(e))
+
+    def write(self, sock_content):
+        with self.lock:
+            self.buf += sock_content
+            if len(self.buf) >= self.block_size:
+                self.flush()
+
+    def flush(self):
+        # Hands the current block to the compression thread, called with the lock held
+        if len(self.buf) > 0:
+            block = self.buf
+            self.buf = bytearray()
+            self.queue.put(block)
+        self.last_flush = time.monotonic()
+
+    def write_cp(self, sock_content, radio_id=0, ts=None):
+        self.write(sock_content)
+
+    def write_up(self, sock_content, radio_id=0, ts=None):
+        self.write(sock_content)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.lock:
+            self.buf += self.trailer
+            self.flush()
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self.raw_file.close()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+class FanoutWriter:
+    """Passes every packet to several writers, each with its own filter.
+
+    Packets without a layer, like osmocore log messages, are passed to
+    every writer matching the radio ID filter.
+    """
+    # Parsers pass the layer of each packet to writers having this set
+    takes_layer = True
+
+    def __init__(self):
+        # (writer, layers, radio IDs, writer takes layer)
+        self.sinks = []
+
+    def __enter__(self):
+        return self
+
+    def add_writer(self, writer, layers = None, radio_ids = None):
+        """
+        Parameters:
+        writer: writer receiving the packets
+        layers (list): layers passed to the writer, None for all
+        radio_ids (list): radio IDs passed to the writer, None for all
+        """
+        self.sinks.append((writer,
+            set(layers) if layers is not None else None,
+            set(radio_ids) if radio_ids is not None else None,
+            getattr(writer, 'takes_layer', False)))
+
+    def write_cp(self, sock_content, radio_id=0, ts=None, layer=None):
+        for writer, layers, radio_ids, takes_layer in self.sinks:
+            if layer is not None and layers is not None and layer not in layers:
+                continue
+            if radio_ids is not None and radio_id not in radio_ids:
+                continue
+            if takes_layer:
+                writer.write_cp(sock_content, radio_id, ts, layer)
+            else:
+                writer.write_cp(sock_content, radio_id, ts)
+
+    def write_up(self, sock_content, radio_id=0, ts=None, layer=None):
+        for writer, layers, radio_ids, takes_layer in self.sinks:
+            if layer is not None and layers is not None and layer not in layers:
+                continue
+            if radio_ids is not None and radio_id not in radio_ids:
+                continue
+            if takes_layer:
+                writer.write_up(sock_content, radio_id, ts, layer)
+            else:
+                writer.write_up(sock_content, radio_id, ts)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for writer, _, _, _ in self.sinks:
+            if hasattr(writer, '__exit__'):
+                writer.__exit__(exc_type, exc_value, traceback)
+        self.sinks = []
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+import datetime
+import json
+import sys
+
+class JsonWriter:
+    """Writes one JSON object per packet and line.
+
+    Every object has the timestamp, radio ID, plane ('cp' or 'up'), layer
+    and the hex encoded packet.
+    """
+    takes_layer = True
+
+    def __init__(self, fname):
+        """
+        Parameters:
+        fname (str): file to write, '-' for standard output
+        """
+        if fname == '-':
+            self.json_file = sys.stdout
+            self.close_file = False
+        else:
+            self.json_file = open(fname, 'w')
+            self.close_file = True
+
+    def __enter__(self):
+        return self
+
+    def write_pkt(self, plane, sock_content, radio_id, ts, layer):
+        if ts is None:
+            ts = datetime.datetime.now()
+        self.json_file.write(json.dumps({
+            'ts': ts.isoformat(),
+            'radio_id': radio_id,
+            'plane': plane,
+            'layer': layer,
+            'data': bytes(sock_content).hex()}) + '\n')
+
+    def write_cp(self, sock_content, radio_id=0, ts=None, layer=None):
+        self.write_pkt('cp', sock_content, radio_id, ts, layer)
+
+    def write_up(self, sock_content, radio_id=0, ts=None, layer=None):
+        self.write_pkt('up', sock_content, radio_id, ts, layer)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.close_file:
+            self.json_file.close()
+        else:
+            self.json_file.flush()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+import datetime
+import struct
+import threading
+import time
+
+class PcapngWriter:
+    """Writes GSMTAP packets as pcapng, with one interface per radio ID.
+
+    By default packets are wrapped in the same Ethernet/IPv4/UDP headers as
+    PcapWriter. With exported_pdu, the payload is stored with the Wireshark
+    exported PDU link type instead, tagged with the dissector to use.
+    """
+    LINKTYPE_ETHERNET = 1
+    LINKTYPE_WIRESHARK_UPPER_PDU = 252
+
+    EXP_PDU_TAG_END_OF_OPT = 0
+    EXP_PDU_TAG_PROTO_NAME = 12
+
+    block_header = struct.Struct('<LL')
+    shb_body = struct.Struct('<LHHq')
+    idb_body = struct.Struct('<HHL')
+    epb_body = struct.Struct('<LLLLL')
+    # Variable fields of the IPv4 (total length, ID) and UDP (length) headers
+    ip_len_id = struct.Struct('!HH')
+    udp_len = struct.Struct('!H')
+
+    def __init__(self, filename, port_cp = 4729, port_up = 47290, buffer_size = 0x100000, flush_interval = 1.0,
+            exported_pdu = False, rotation = None):
+        """
+        Parameters:
+        filename (str): pcapng file to write
+        port_cp (int): UDP destination port of control plane packets
+        port_up (int): UDP destination port of user plane packets
+        buffer_size (int): blocks are collected up to this size before writing
+        flush_interval (float): maximum time in seconds to keep blocks in the buffer
+        exported_pdu (bool): store GSMTAP and IP payloads without Ethernet/IP/UDP wrapper
+        rotation (SegmentRotation): split the output into segments of filename
+        """
+        self.port_cp = port_cp
+        self.port_up = port_up
+        self.exported_pdu = exported_pdu
+        self.ip_id = 0
+        self.base_address = 0x7f000001
+        self.rotation = rotation
+        if rotation is not None:
+            self.pcapng_file = rotation.start(filename)
+        else:
+            self.pcapng_file = open(filename, 'wb')
+        # Interface ID per radio ID, headers per (port, radio ID)
+        self.interfaces = {}
+        self.templates = {}
+        self.last_ts = None
+        self.last_ts_ns = 0
+
+        self.buf = bytearray()
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        # Held while the buffer or the file is modified
+        self.lock = threading.Lock()
+
+        self.write_header()
+
+        # Blocks are written out even if no further packets arrive
+        self.flush_thread = None
+        if flush_interval is not None:
+            self.stop_flush = threading.Event()
+            self.flush_thread = threading.Thread(target=self.flush_loop, daemon=True)
+            self.flush_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def write_header(self):
+        self.write_block(0x0a0d0d0a, self.shb_body.pack(0x1a2b3c4d, 1, 0, -1))
+        # Bytes written and packets of the current segment
+        self.segment_size = 0
+        self.segment_packets = 0
+
+    def rotate(self):
+        # Every segment is a separate section with its own interfaces
+        self.flush()
+        self.pcapng_file = self.rotation.next(self.pcapng_file)
+        self.interfaces = {}
+        self.write_header()
+
+    def write_block(self, block_type, body):
+        # body must be padded to 32 bits
+        block_len = 12 + len(body)
+        self.buf += self.block_header.pack(block_type, block_len)
+        self.buf += body
+        self.buf += struct.pack('<L', block_len)
+
+    def option(self, code, value):
+        padding = b'\x00' * (-len(value) % 4)
+        return struct.pack('<HH', code, len(value)) + value + padding
+
+    def interface(self, radio_id):
+        link_type = self.LINKTYPE_WIRESHARK_UPPER_PDU if self.exported_pdu else self.LINKTYPE_ETHERNET
+        options = b''.join([
+            self.option(2, 'radio{}'.format(radio_id).encode()), # if_name
+            self.option(9, b'\x09'),                             # if_tsresol: nanoseconds
+            self.option(0, b''),
+        ])
+        self.write_block(0x00000001, self.idb_body.pack(link_type, 0, 0x40000) + options)
+
+        if_id = len(self.interfaces)
+        self.interfaces[radio_id] = if_id
+        return if_id
+
+    def template(self, port, radio_id):
+        if self.exported_pdu:
+            proto_name = b'gsmtap' if port == self.port_cp else b'ip'
+            tags = (struct.pack('!HH', self.EXP_PDU_TAG_PROTO_NAME, len(proto_name) + (-len(proto_name) % 4))
+                + proto_name + b'\x00' * (-len(proto_name) % 4)
+                + struct.pack('!HH', self.EXP_PDU_TAG_END_OF_OPT, 0))
+            self.templates[(port, radio_id)] = tags
+            return tags
+
+        if radio_id <= 0:
+            dest_address = self.base_address
+        else:
+            dest_address = self.base_address + radio_id
+        ip_hdr = struct.pack('!BBHHBBBBHLL',
+                0x45, 0x00, 0, 0, 0x40, 0x00, 0x40, 0x11, 0xffff,
+                0x7f000001, dest_address)
+        udp_hdr = struct.pack('!HHHH', 13337, port, 0, 0xffff)
+        # Before IP length, between IP ID and UDP length, after UDP length
+        tmpl = (b'\x00' * 12 + b'\x08\x00' + ip_hdr[0:2], ip_hdr[6:] + udp_hdr[0:4], udp_hdr[6:])
+        self.templates[(port, radio_id)] = tmpl
+        return tmpl
+
+    def write_pkt(self, sock_content, port, radio_id=0, ts=None):
+        with self.lock:
+            # Start a new segment only when there is a packet for it
+            if self.rotation is not None:
+                if self.segment_packets > 0 and self.rotation.due(self.segment_size + len(self.buf), self.segment_packets):
+                    self.rotate()
+                self.segment_packets += 1
+            if ts is None:
+                ts = datetime.datetime.now()
+            if ts is not self.last_ts:
+                self.last_ts = ts
+                self.last_ts_ns = int(ts.timestamp()) * 1000000000 + ts.microsecond * 1000
+
+            if_id = self.interfaces.get(radio_id)
+            if if_id is None:
+                if_id = self.interface(radio_id)
+            tmpl = self.templates.get((port, radio_id))
+            if tmpl is None:
+                tmpl = self.template(port, radio_id)
+
+            content_len = len(sock_content)
+            if self.exported_pdu:
+                pkt_len = len(tmpl) + content_len
+            else:
+                pkt_len = 14 + 20 + 8 + content_len
+            padding = -pkt_len % 4
+            block_len = 12 + self.epb_body.size + pkt_len + padding
+
+            buf = self.buf
+            buf += self.block_header.pack(0x00000006, block_len)
+            buf += self.epb_body.pack(if_id, self.last_ts_ns >> 32, self.last_ts_ns & 0xffffffff, pkt_len, pkt_len)
+            if self.exported_pdu:
+                buf += tmpl
+            else:
+                buf += tmpl[0]
+                buf += self.ip_len_id.pack(content_len + 8 + 20, self.ip_id)
+                buf += tmpl[1]
+                buf += self.udp_len.pack(content_len + 8)
+                buf += tmpl[2]
+                self.ip_id = (self.ip_id + 1) & 0xffff
+            buf += sock_content
+            buf += b'\x00' * padding
+            buf += struct.pack('<L', block_len)
+
+            if len(buf) >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        if len(self.buf) > 0:
+            self.pcapng_file.write(self.buf)
+            self.segment_size += len(self.buf)
+            self.buf.clear()
+        self.pcapng_file.flush()
+        self.last_flush = time.monotonic()
+
+    def flush_loop(self):
+        timeout = self.flush_interval
+        while not self.stop_flush.wait(timeout):
+            with self.lock:
+                if len(self.buf) > 0 and time.monotonic() - self.last_flush >= self.flush_interval:
+                    self.flush()
+                if len(self.buf) > 0:
+                    # Sleep until the buffered blocks are due
+                    timeout = max(self.last_flush + self.flush_interval - time.monotonic(), 0.01)
+                else:
+                    timeout = max(self.flush_interval, 0.01)
+
+    def write_cp(self, sock_content, radio_id=0, ts=None):
+        self.write_pkt(sock_content, self.port_cp, radio_id, ts)
+
+    def write_up(self, sock_content, radio_id=0, ts=None):
+        self.write_pkt(sock_content, self.port_up, radio_id, ts)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.flush_thread is not None:
+            self.stop_flush.set()
+            self.flush_thread.join()
+            self.flush_thread = None
+        self.flush()
+        if self.rotation is not None:
+            self.rotation.close(self.pcapng_file)
+        else:
+            self.pcapng_file.close()
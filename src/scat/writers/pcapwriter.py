@@ -3,16 +3,64 @@
 
 import datetime
 import struct
+import threading
+import time
 
 class PcapWriter:
-    def __init__(self, filename, port_cp = 4729, port_up = 47290):
+    pcap_global_header = struct.Struct('<LHHLLLL')
+    pcap_record_header = struct.Struct('<LLLL')
+    # Variable fields of the IPv4 (total length, ID) and UDP (length) headers
+    ip_len_id = struct.Struct('!HH')
+    udp_len = struct.Struct('!H')
+
+    def __init__(self, filename, port_cp = 4729, port_up = 47290, buffer_size = 0x100000, flush_interval = 1.0,
+            rotation = None):
+        """
+        Parameters:
+        filename (str): PCAP file to write
+        port_cp (int): UDP destination port of control plane packets
+        port_up (int): UDP destination port of user plane packets
+        buffer_size (int): packets are collected up to this size before writing
+        flush_interval (float): maximum time in seconds to keep packets in the buffer
+        rotation (SegmentRotation): split the output into segments of filename
+        """
         self.port_cp = port_cp
         self.port_up = port_up
         self.ip_id = 0
         self.base_address = 0x7f000001
-        self.pcap_file = open(filename, 'wb')
+        self.rotation = rotation
+        if rotation is not None:
+            self.pcap_file = rotation.start(filename)
+        else:
+            self.pcap_file = open(filename, 'wb')
         self.eth_hdr = b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x08\x00'
-        pcap_global_hdr = struct.pack('<LHHLLLL',
+        # Constant parts of the Ethernet/IP/UDP headers per (port, radio ID)
+        self.templates = {}
+        # Packets of one parse result share the timestamp
+        self.last_ts = None
+        self.last_ts_sec = 0
+
+        self.buf = bytearray()
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.last_flush = time.monotonic()
+        # Held while the buffer or the file is modified
+        self.lock = threading.Lock()
+
+        self.write_header()
+
+        # Packets are written out even if no further packets arrive
+        self.flush_thread = None
+        if flush_interval is not None:
+            self.stop_flush = threading.Event()
+            self.flush_thread = threading.Thread(target=self.flush_loop, daemon=True)
+            self.flush_thread.start()
+
+    def __enter__(self):
+        return self
+
+    def write_header(self):
+        self.pcap_file.write(self.pcap_global_header.pack(
                 0xa1b2c3d4,
                 2,
                 4,
@@ -20,20 +68,17 @@ class PcapWriter:
                 0,
                 0xffff,
                 1,
-                )
-        self.pcap_file.write(pcap_global_hdr)
+                ))
+        # Bytes written and packets of the current segment
+        self.segment_size = self.pcap_global_header.size
+        self.segment_packets = 0
 
-    def __enter__(self):
-        return self
-
-    def write_pkt(self, sock_content, port, radio_id=0, ts=datetime.datetime.now()):
-        pcap_hdr = struct.pack('<LLLL',
-                int(ts.timestamp()) % 4294967296,
-                ts.microsecond,
-                len(sock_content) + 8 + 20 + 14,
-                len(sock_content) + 8 + 20 + 14,
-                )
+    def rotate(self):
+        self.flush()
+        self.pcap_file = self.rotation.next(self.pcap_file)
+        self.write_header()
 
+    def template(self, port, radio_id):
         if radio_id <= 0:
             dest_address = self.base_address
         else:
@@ -41,8 +86,8 @@ class PcapWriter:
         ip_hdr = struct.pack('!BBHHBBBBHLL',
                 0x45,                        # version, IHL, dsf
                 0x00,
-                len(sock_content) + 8 + 20,  # length
-                self.ip_id,                  # id
+                0,                           # length
+                0,                           # id
                 0x40,                        # flags/fragment offset
                 0x00,
                 0x40,                        # TTL
@@ -54,20 +99,85 @@ class PcapWriter:
         udp_hdr = struct.pack('!HHHH',
                 13337,                 # source port
                 port,                  # destination port
-                len(sock_content) + 8, # length
+                0,                     # length
                 0xffff,                # checksum
                 )
+        # Before IP length, between IP ID and UDP length, after UDP length
+        tmpl = (self.eth_hdr + ip_hdr[0:2], ip_hdr[6:] + udp_hdr[0:4], udp_hdr[6:])
+        self.templates[(port, radio_id)] = tmpl
+        return tmpl
+
+    def write_pkt(self, sock_content, port, radio_id=0, ts=None):
+        with self.lock:
+            # Start a new segment only when there is a packet for it
+            if self.rotation is not None:
+                if self.segment_packets > 0 and self.rotation.due(self.segment_size + len(self.buf), self.segment_packets):
+                    self.rotate()
+                self.segment_packets += 1
+            if ts is None:
+                ts = datetime.datetime.now()
+            if ts is not self.last_ts:
+                self.last_ts = ts
+                self.last_ts_sec = int(ts.timestamp()) % 4294967296
+            tmpl = self.templates.get((port, radio_id))
+            if tmpl is None:
+                tmpl = self.template(port, radio_id)
 
-        self.pcap_file.write(pcap_hdr + self.eth_hdr + ip_hdr + udp_hdr + sock_content)
-        self.ip_id += 1
-        if self.ip_id > 65535:
-            self.ip_id = 0
+            content_len = len(sock_content)
+            buf = self.buf
+            buf += self.pcap_record_header.pack(
+                    self.last_ts_sec,
+                    ts.microsecond,
+                    content_len + 8 + 20 + 14,
+                    content_len + 8 + 20 + 14,
+                    )
+            buf += tmpl[0]
+            buf += self.ip_len_id.pack(content_len + 8 + 20, self.ip_id)
+            buf += tmpl[1]
+            buf += self.udp_len.pack(content_len + 8)
+            buf += tmpl[2]
+            buf += sock_content
 
-    def write_cp(self, sock_content, radio_id=0, ts=datetime.datetime.now()):
+            self.ip_id += 1
+            if self.ip_id > 65535:
+                self.ip_id = 0
+
+            if len(buf) >= self.buffer_size:
+                self.flush()
+
+    def flush(self):
+        if len(self.buf) > 0:
+            self.pcap_file.write(self.buf)
+            self.segment_size += len(self.buf)
+            self.buf.clear()
+        self.pcap_file.flush()
+        self.last_flush = time.monotonic()
+
+    def flush_loop(self):
+        timeout = self.flush_interval
+        while not self.stop_flush.wait(timeout):
+            with self.lock:
+                if len(self.buf) > 0 and time.monotonic() - self.last_flush >= self.flush_interval:
+                    self.flush()
+                if len(self.buf) > 0:
+                    # Sleep until the buffered packets are due
+                    timeout = max(self.last_flush + self.flush_interval - time.monotonic(), 0.01)
+                else:
+                    timeout = max(self.flush_interval, 0.01)
+
+    def write_cp(self, sock_content, radio_id=0, ts=None):
         self.write_pkt(sock_content, self.port_cp, radio_id, ts)
 
-    def write_up(self, sock_content, radio_id=0, ts=datetime.datetime.now()):
+    def write_up(self, sock_content, radio_id=0, ts=None):
         self.write_pkt(sock_content, self.port_up, radio_id, ts)
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.pcap_file.close()
+        if self.flush_thread is not None:
+            self.stop_flush.set()
+            self.flush_thread.join()
+            self.flush_thread = None
+        self.flush()
+        if self.rotation is not None:
+            self.rotation.close(self.pcap_file)
+        else:
+            self.pcap_file.close()
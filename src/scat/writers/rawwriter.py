@@ -1,23 +1,56 @@
 #!/usr/bin/env python3
 # coding: utf8
 
-import datetime
-
 class RawWriter:
-    def __init__(self, fname, header=b'', trailer=b''):
-        self.raw_file = open(fname, 'wb')
-        self.raw_file.write(header)
+    def __init__(self, fname, header=b'', trailer=b'', rotation=None):
+        """
+        Parameters:
+        fname (str): file to write
+        header (bytes): written at the start of the file or each segment
+        trailer (bytes): written at the end of the file or each segment
+        rotation (SegmentRotation): split the output into segments of fname
+        """
+        self.rotation = rotation
+        if rotation is not None:
+            self.raw_file = rotation.start(fname)
+        else:
+            self.raw_file = open(fname, 'wb')
+        self.header = header
         self.trailer = trailer
+        self.write_header()
 
     def __enter__(self):
         return self
 
-    def write_cp(self, sock_content, radio_id=0, ts=datetime.datetime.now()):
-        self.raw_file.write(sock_content)
+    def write_header(self):
+        self.raw_file.write(self.header)
+        # Bytes written and packets of the current segment
+        self.segment_size = len(self.header)
+        self.segment_packets = 0
+
+    def rotate(self):
+        self.raw_file.write(self.trailer)
+        self.raw_file = self.rotation.next(self.raw_file)
+        self.write_header()
 
-    def write_up(self, sock_content, radio_id=0, ts=datetime.datetime.now()):
+    def write(self, sock_content):
+        # Start a new segment only when there is a packet for it
+        if self.rotation is not None:
+            if self.segment_packets > 0 and self.rotation.due(self.segment_size, self.segment_packets):
+                self.rotate()
+            self.segment_size += len(sock_content)
+            self.segment_packets += 1
         self.raw_file.write(sock_content)
 
+    def write_cp(self, sock_content, radio_id=0, ts=None):
+        self.write(sock_content)
+
+    def write_up(self, sock_content, radio_id=0, ts=None):
+        self.write(sock_content)
+
     def __exit__(self, exc_type, exc_value, traceback):
         self.raw_file.write(self.trailer)
-        self.raw_file.close()
+        if self.rotation is not None:
+            self.rotation.close(self.raw_file)
+        else:
+            self.raw_file.close()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# coding: utf8
+
+import scat.compression
+
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+class SegmentRotation:
+    """Splits the output of a writer into numbered segment files.
+
+    A new segment is started when the current one reaches max_size bytes,
+    max_packets packets or is older than max_duration seconds. Finished
+    segments are compressed on a background thread, and only the last
+    max_segments finished segments are kept.
+    """
+    def __init__(self, max_size = None, max_duration = None, max_packets = None,
+            compression = None, max_segments = None):
+        """
+        Parameters:
+        max_size (int): maximum segment size in bytes
+        max_duration (float): maximum segment duration in seconds
+        max_packets (int): maximum number of packets per segment
+        compression (str): compression method of finished segments, see scat.compression
+        max_segments (int): number of finished segments to keep
+        """
+        if compression is not None and compression not in scat.compression.available_methods():
+            raise ValueError('Compression method {} is not available'.format(compression))
+        self.max_size = max_size
+        self.max_duration = max_duration
+        self.max_packets = max_packets
+        self.compression = compression
+        self.max_segments = max_segments
+        self.logger = logging.getLogger('scat.rotation')
+
+        self.fname = None
+        self.index = 0
+        self.segment_start = 0.0
+        self.segment_name = None
+        self.finished_segments = []
+
+        self.queue = queue.Queue()
+        self.thread = None
+
+    def name(self, index):
+        path = Path(self.fname)
+        return str(path.with_name('{}_{:05d}{}'.format(path.stem, index, path.suffix)))
+
+    def start(self, fname):
+        # Returns the file object of the first segment
+        self.fname = fname
+        self.thread = threading.Thread(target=self.finish_loop, daemon=True)
+        self.thread.start()
+        return self.open_segment()
+
+    def open_segment(self):
+        self.index += 1
+        self.segment_name = self.name(self.index)
+        self.segment_start = time.monotonic()
+        return open(self.segment_name, 'wb')
+
+    def due(self, size, packets):
+        if self.max_size is not None and size >= self.max_size:
+            return True
+        if self.max_packets is not None and packets >= self.max_packets:
+            return True
+        if self.max_duration is not None and time.monotonic() - self.segment_start >= self.max_duration:
+            return True
+        return False
+
+    def next(self, f):
+        # Closes the current segment file f, returns the file object of the next one
+        f.close()
+        self.queue.put(self.segment_name)
+        return self.open_segment()
+
+    def finish_loop(self):
+        while True:
+            segment_name = self.queue.get()
+            if segment_name is None:
+                break
+
+            if self.compression is not None:
+                try:
+                    segment_name = scat.compression.compress_file(segment_name, self.compression)
+                except (OSError, ValueError) as e:
+                    self.logger.log(logging.WARNING, 'Cannot compress {}: {}'.format(segment_name, e))
+            self.finished_segments.append(segment_name)
+
+            while self.max_segments is not None and len(self.finished_segments) > self.max_segments:
+                old_name = self.finished_segments.pop(0)
+                try:
+                    os.remove(old_name)
+                except OSError as e:
+                    self.logger.log(logging.WARNING, 'Cannot remove {}: {}'.format(old_name, e))
+
+    def close(self, f):
+        # Closes the last segment file f and waits for background work
+        f.close()
+        if self.thread is None:
+            return
+        self.queue.put(self.segment_name)
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
@@ -1,39 +1,74 @@
 #!/usr/bin/env python3
 # coding: utf8
 
+import logging
 import socket
 import struct
 
 class SocketWriter:
-    def __init__(self, base_address, port_cp = 4729, port_up = 47290):
+    def __init__(self, base_address, port_cp = 4729, port_up = 47290, sndbuf = 0x400000):
+        """
+        Parameters:
+        base_address (str): destination IPv4 address of radio 0, radio N uses base_address + N
+        port_cp (int): UDP destination port of control plane packets
+        port_up (int): UDP destination port of user plane packets
+        sndbuf (int): requested send buffer size of each socket
+        """
         self.base_address = struct.unpack('!I', socket.inet_pton(socket.AF_INET, base_address))[0]
         self.port_cp = port_cp
-        self.sock_cp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock_cp_recv = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
         self.port_up = port_up
-        self.sock_up = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.sock_up_recv = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sndbuf = sndbuf
+        self.logger = logging.getLogger('scat.socketwriter')
+
+        # Connected non-blocking sockets per (radio ID, port)
+        self.socks = {}
+        # Datagrams not sent because the send buffer was full or the
+        # destination port was unreachable
+        self.dropped_packets = 0
+        self.refused_packets = 0
 
     def __enter__(self):
         return self
 
-    def write_cp(self, sock_content, radio_id=0, ts=None):
+    def open_socket(self, radio_id, port):
         if radio_id <= 0:
             dest_address = self.base_address
         else:
             dest_address = self.base_address + radio_id
-        dest_address_str = socket.inet_ntoa(struct.pack('!I', dest_address))
-        self.sock_cp.sendto(sock_content, (dest_address_str, self.port_cp))
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        except OSError:
+            pass
+        sock.connect((socket.inet_ntoa(struct.pack('!I', dest_address)), port))
+        sock.setblocking(False)
+        self.socks[(radio_id, port)] = sock
+        return sock
+
+    def send(self, sock_content, radio_id, port):
+        sock = self.socks.get((radio_id, port))
+        if sock is None:
+            sock = self.open_socket(radio_id, port)
+        try:
+            sock.send(sock_content)
+        except BlockingIOError:
+            self.dropped_packets += 1
+        except ConnectionRefusedError:
+            # ICMP port unreachable of an earlier datagram, nobody listening
+            self.refused_packets += 1
+
+    def write_cp(self, sock_content, radio_id=0, ts=None):
+        self.send(sock_content, radio_id, self.port_cp)
 
     def write_up(self, sock_content, radio_id=0, ts=None):
-        if radio_id <= 0:
-            dest_address = self.base_address
-        else:
-            dest_address = self.base_address + radio_id
-        dest_address_str = socket.inet_ntoa(struct.pack('!I', dest_address))
-        self.sock_up.sendto(sock_content, (dest_address_str, self.port_up))
+        self.send(sock_content, radio_id, self.port_up)
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.sock_cp_recv.close()
-        self.sock_up_recv.close()
+        if self.dropped_packets > 0:
+            self.logger.log(logging.WARNING, 'Dropped {} GSMTAP packets, socket send buffer full'.format(self.dropped_packets))
+        if self.refused_packets > 0:
+            self.logger.log(logging.WARNING, 'Dropped {} GSMTAP packets, destination port unreachable'.format(self.refused_packets))
+        for sock in self.socks.values():
+            sock.close()
+        self.socks = {}
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import unittest
+import threading
+
+from scat.writers import AsyncWriter
+
+class BlockingWriter:
+    # Blocks in the first write until released
+    def __init__(self):
+        self.packets = []
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.closed = False
+
+    def write_cp(self, sock_content, radio_id=0, ts=None):
+        self.entered.set()
+        self.release.wait()
+        self.packets.append(('cp', sock_content, radio_id))
+
+    def write_up(self, sock_content, radio_id=0, ts=None):
+        self.packets.append(('up', sock_content, radio_id))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.closed = True
+
+class TestAsyncWriter(unittest.TestCase):
+    def fill(self, policy):
+        inner = BlockingWriter()
+        writer = AsyncWriter(inner, 2, policy)
+        writer.write_cp(b'\x01')
+        inner.entered.wait()
+
+        # Queue holds two packets while the writer thread is blocked
+        buf = bytearray(b'\x02')
+        writer.write_cp(memoryview(buf))
+        writer.write_up(b'\x03', 1)
+        self.assertEqual(writer.queue_depth(), 2)
+        writer.write_cp(b'\x04')
+        writer.write_cp(b'\x05')
+        buf[0] = 0xff
+
+        inner.release.set()
+        writer.__exit__(None, None, None)
+        self.assertTrue(inner.closed)
+        return writer, inner
+
+    def test_drop_newest(self):
+        writer, inner = self.fill('drop-newest')
+        self.assertEqual(writer.dropped_packets, 2)
+        self.assertListEqual(inner.packets, [('cp', b'\x01', 0), ('cp', b'\x02', 0), ('up', b'\x03', 1)])
+
+    def test_drop_oldest(self):
+        writer, inner = self.fill('drop-oldest')
+        self.assertEqual(writer.dropped_packets, 2)
+        self.assertListEqual(inner.packets, [('cp', b'\x01', 0), ('cp', b'\x04', 0), ('cp', b'\x05', 0)])
+
+    def test_block(self):
+        inner = BlockingWriter()
+        inner.release.set()
+        writer = AsyncWriter(inner, 2, 'block')
+        for i in range(100):
+            writer.write_cp(bytes([i]))
+        writer.__exit__(None, None, None)
+        self.assertEqual(writer.dropped_packets, 0)
+        self.assertListEqual([x[1][0] for x in inner.packets], list(range(100)))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import unittest
+import gzip
+import os
+import tempfile
+import time
+
+from scat.writers import CompressedRawWriter
+from scat.iodevices import FileIO
+import scat.compression
+
+class TestCompressedRawWriter(unittest.TestCase):
+    def test_read_back(self):
+        frames = [bytes([i]) * (i + 1) + b'\x7e' for i in range(200)]
+        expected = b'H' + b''.join(frames) + b'T'
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for method in ('gzip', 'bz2', 'xz'):
+                fname = os.path.join(tmpdir, 'out.qmdl' + scat.compression.suffixes[method])
+                # Small blocks, the file consists of many compressed streams
+                writer = CompressedRawWriter(fname, method, block_size=1000, header=b'H', trailer=b'T')
+                for frame in frames:
+                    writer.write_cp(frame)
+                writer.__exit__(None, None, None)
+
+                io_device = FileIO([fname])
+                buf = b''
+                while True:
+                    data = io_device.read(0x1000)
+                    if len(data) == 0:
+                        break
+                    buf += data
+                io_device.__exit__(None, None, None)
+                self.assertEqual(buf, expected, method)
+
+    def test_flush_interval(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'out.qmdl.gz')
+            writer = CompressedRawWriter(fname, 'gzip', flush_interval=0.05)
+            writer.write_cp(b'\x01\x02\x7e')
+            # Finished without another frame arriving
+            deadline = time.monotonic() + 5
+            while os.path.getsize(fname) == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            with open(fname, 'rb') as f:
+                self.assertEqual(gzip.decompress(f.read()), b'\x01\x02\x7e')
+            writer.__exit__(None, None, None)
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            CompressedRawWriter('out.qmdl.rar', 'rar')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+import json
+import os
+import tempfile
+
+from scat.writers import FanoutWriter, JsonWriter
+from scat.parsers import QualcommParser
+
+class CollectWriter:
+    def __init__(self):
+        self.packets = []
+        self.closed = False
+
+    def write_cp(self, sock_content, radio_id=0, ts=None):
+        self.packets.append(('cp', sock_content, radio_id))
+
+    def write_up(self, sock_content, radio_id=0, ts=None):
+        self.packets.append(('up', sock_content, radio_id))
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.closed = True
+
+class TestFanoutWriter(unittest.TestCase):
+    def test_filters(self):
+        all_writer = CollectWriter()
+        rrc_writer = CollectWriter()
+        radio1_writer = CollectWriter()
+
+        writer = FanoutWriter()
+        writer.add_writer(all_writer)
+        writer.add_writer(rrc_writer, ['rrc'])
+        writer.add_writer(radio1_writer, None, [1])
+
+        writer.write_cp(b'\x01', 0, None, 'rrc')
+        writer.write_cp(b'\x02', 1, None, 'nas')
+        writer.write_up(b'\x03', 1, None, 'ip')
+        # Packets without layer pass every layer filter
+        writer.write_cp(b'\x04', 0)
+        writer.__exit__(None, None, None)
+
+        self.assertListEqual(all_writer.packets, [('cp', b'\x01', 0), ('cp', b'\x02', 1), ('up', b'\x03', 1), ('cp', b'\x04', 0)])
+        self.assertListEqual(rrc_writer.packets, [('cp', b'\x01', 0), ('cp', b'\x04', 0)])
+        self.assertListEqual(radio1_writer.packets, [('cp', b'\x02', 1), ('up', b'\x03', 1)])
+        self.assertTrue(all_writer.closed and rrc_writer.closed and radio1_writer.closed)
+
+    def test_parser_layers(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'out.json')
+            nas_writer = CollectWriter()
+            writer = FanoutWriter()
+            writer.add_writer(JsonWriter(fname))
+            writer.add_writer(nas_writer, ['nas'])
+
+            parser = QualcommParser()
+            parser.set_writer(writer)
+            parser.set_parameter({'layer': ['rrc', 'nas']})
+            ts = datetime.datetime(2024, 1, 1)
+            parser.postprocess_parse_result({'layer': 'rrc', 'cp': [b'\x01'], 'ts': ts})
+            parser.postprocess_parse_result({'layer': 'nas', 'cp': [b'\x02'], 'ts': ts, 'radio_id': 1})
+            parser.postprocess_parse_result({'layer': 'mac', 'cp': [b'\x03'], 'ts': ts})
+            writer.__exit__(None, None, None)
+
+            self.assertListEqual(nas_writer.packets, [('cp', b'\x02', 1)])
+            with open(fname) as f:
+                lines = [json.loads(l) for l in f]
+            self.assertListEqual(lines, [
+                {'ts': '2024-01-01T00:00:00', 'radio_id': 0, 'plane': 'cp', 'layer': 'rrc', 'data': '01'},
+                {'ts': '2024-01-01T00:00:00', 'radio_id': 1, 'plane': 'cp', 'layer': 'nas', 'data': '02'},
+            ])
+
+if __name__ == '__main__':
+    unittest.main()
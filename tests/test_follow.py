@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+import unittest
+import os
+import tempfile
+import threading
+import time
+
+from scat.iodevices import FileIO
+from scat.iodevices.follow import FollowReader
+
+class TestFollow(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fname = os.path.join(self.tmpdir.name, 'live.qmdl')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def append(self, data, mode='ab'):
+        with open(self.fname, mode) as f:
+            f.write(data)
+
+    def test_rotation(self):
+        reader = FollowReader(self.fname, poll_interval=0.01, idle_timeout=0.2)
+        # File does not exist yet
+        self.assertEqual(reader.read(100), b'')
+
+        self.append(b'abc')
+        self.assertEqual(reader.read(100), b'abc')
+        self.append(b'def')
+        self.assertEqual(reader.read(100), b'def')
+
+        # Truncated and rewritten
+        self.append(b'xy', 'wb')
+        self.assertEqual(reader.read(100), b'xy')
+
+        # Replaced by a new file, the rest of the old one is read first
+        self.append(b'z')
+        new_name = self.fname + '.new'
+        with open(new_name, 'wb') as f:
+            f.write(b'new')
+        os.replace(new_name, self.fname)
+        self.assertEqual(reader.read(100), b'z')
+        self.assertEqual(reader.read(100), b'new')
+
+        self.assertEqual(reader.read(100), b'')
+        reader.close()
+
+    def test_fileio(self):
+        self.append(b'\x01' * 10)
+        io_device = FileIO([self.fname], follow=True, follow_timeout=2.0)
+
+        def writer():
+            time.sleep(0.1)
+            self.append(b'\x02' * 10)
+        thread = threading.Thread(target=writer)
+        thread.start()
+
+        buf = b''
+        while len(buf) < 20:
+            data = io_device.read(0x1000)
+            if len(data) == 0:
+                break
+            buf += data
+        thread.join()
+        io_device.__exit__(None, None, None)
+        self.assertEqual(buf, b'\x01' * 10 + b'\x02' * 10)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+import os
+import struct
+import tempfile
+
+import scat.index
+import scat.util as util
+from scat.parsers.qualcomm.qualcommparser import QualcommParser
+
+class TestIndex(unittest.TestCase):
+    def log_packet(self, log_id, ts, body):
+        return util.generate_packet(struct.pack('<BBHHHQ', 0x10, 0, 12 + len(body), 12 + len(body), log_id, ts) + body)
+
+    def test_qmdl_index(self):
+        parser = QualcommParser()
+        # 1/800 s ticks in the upper 48 bits
+        pkts = [
+            self.log_packet(0xb0c0, 800 << 16, b'\x7e\x01'),
+            util.generate_packet(b'\x00'),
+            self.log_packet(0xb0c1, 1600 << 16, b'\x02'),
+            self.log_packet(0xb0c0, 2400 << 16, b'\x7d\x03'),
+        ]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'dump.qmdl')
+            with open(fname, 'wb') as f:
+                f.write(b'\x7e' + b''.join(pkts))
+
+            self.assertEqual(scat.index.build_index(parser, fname), 4)
+
+            offsets = [1]
+            for pkt in pkts:
+                offsets.append(offsets[-1] + len(pkt))
+
+            entries = scat.index.lookup(parser, fname, log_ids=[0xb0c0])
+            self.assertListEqual(entries, [(offsets[0], len(pkts[0])), (offsets[3], len(pkts[3]))])
+
+            epoch = datetime.datetime(1980, 1, 6, 0, 0, 1, tzinfo=datetime.timezone.utc)
+            entries = scat.index.lookup(parser, fname, start=epoch, end=epoch + datetime.timedelta(seconds=2))
+            self.assertListEqual(entries, [(offsets[x], len(pkts[x])) for x in range(3)])
+
+            # Index of a modified dump is rebuilt
+            with open(fname, 'ab') as f:
+                f.write(self.log_packet(0xb0c0, 3200 << 16, b'\x04'))
+            entries = scat.index.lookup(parser, fname, log_ids=[0xb0c0])
+            self.assertEqual(len(entries), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+
+from scat.parsers.qualcomm import diagcmd
+from scat.parsers.qualcomm.loadshedder import LoadShedder
+import scat.util as util
+
+class ListIO:
+    def __init__(self):
+        self.written = []
+
+    def write(self, write_buf, encode_hdlc=False):
+        self.written.append(write_buf)
+
+class ListWriter:
+    def __init__(self):
+        self.cp = []
+
+    def write_cp(self, sock_content, radio_id=0, ts=None):
+        self.cp.append(sock_content)
+
+class FakeParser:
+    def __init__(self):
+        self.io_device = ListIO()
+        self.writer = ListWriter()
+
+class TestLoadShedder(unittest.TestCase):
+    def test_shed_and_restore(self):
+        parser = FakeParser()
+        lte_mask = diagcmd.create_log_config_set_mask(0xb, 0x1ff, 0x0c0, 0x064)
+        gsm_mask = diagcmd.create_log_config_set_mask(0x5, 0x1ff, 0x064)
+        shedder = LoadShedder(parser, [lte_mask, gsm_mask], [0xb064], hold_time=10.0)
+
+        shedder.update(0.5)
+        self.assertEqual(len(parser.io_device.written), 0)
+
+        shedder.update(0.8)
+        self.assertTrue(shedder.shedding)
+        self.assertListEqual(parser.io_device.written, [
+            util.generate_packet(diagcmd.create_log_config_set_mask(0xb, 0x1ff, 0x0c0)),
+            util.generate_packet(gsm_mask)])
+        self.assertEqual(len(parser.writer.cp), 1)
+        self.assertIn(b'disabling low priority log codes', parser.writer.cp[0])
+
+        # Responses to the masks are consumed
+        self.assertTrue(shedder.take_response())
+        self.assertTrue(shedder.take_response())
+        self.assertFalse(shedder.take_response())
+
+        # No decision within the hold time
+        shedder.update(0.0)
+        self.assertTrue(shedder.shedding)
+
+        shedder.last_change -= 10.0
+        shedder.update(0.0)
+        self.assertFalse(shedder.shedding)
+        self.assertListEqual(parser.io_device.written[2:], [util.generate_packet(lte_mask), util.generate_packet(gsm_mask)])
+        self.assertIn(b'restoring low priority log codes', parser.writer.cp[1])
+
+    def test_parse_lag(self):
+        parser = FakeParser()
+        shedder = LoadShedder(parser, [diagcmd.create_log_config_set_mask(0xb, 0x1ff, 0x064)], [0xb064], max_lag=2.0)
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        shedder.observe(now - datetime.timedelta(seconds=30))
+        shedder.update(0.0)
+        self.assertFalse(shedder.shedding)
+
+        # Device timestamps fall behind the host clock
+        shedder.observe(now - datetime.timedelta(seconds=33))
+        shedder.update(0.0)
+        self.assertTrue(shedder.shedding)
+
+if __name__ == '__main__':
+    unittest.main()
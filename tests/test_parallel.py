@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import unittest
+import binascii
+import os
+import struct
+import tempfile
+
+import scat.parallel
+import scat.util as util
+from scat.parsers.qualcomm import diagcmd
+from scat.parsers.qualcomm.qualcommparser import QualcommParser
+from scat.writers import NullWriter, FanoutWriter
+
+class CollectWriter:
+    def __init__(self):
+        self.packets = []
+
+    def write_cp(self, sock_content, radio_id=0, ts=None):
+        self.packets.append(sock_content)
+
+    def write_up(self, sock_content, radio_id=0, ts=None):
+        self.packets.append(sock_content)
+
+class TestParallel(unittest.TestCase):
+    def log_packet(self, log_id, body):
+        return util.generate_packet(struct.pack('<BBHHHQ', 0x10, 0, 12 + len(body), 12 + len(body), log_id, 0) + body)
+
+    def write_dump(self, fname):
+        # One LTE RRC and one LTE MAC packet
+        with open(fname, 'wb') as f:
+            f.write(b'\x7e')
+            f.write(self.log_packet(diagcmd.diag_log_get_lte_item_id(diagcmd.diag_log_code_lte.LOG_LTE_RRC_OTA_MESSAGE),
+                binascii.unhexlify('1e112011400132001914000016ad090000000002000000004c10')))
+            f.write(self.log_packet(diagcmd.diag_log_get_lte_item_id(diagcmd.diag_log_code_lte.LOG_LTE_MAC_RACH_RESPONSE),
+                binascii.unhexlify('0101a06906022400010001071BFF98FF000001231A0400181C010007000600465C80BD0648000000')))
+
+    def test_split_pcapng(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'a.qmdl')
+            self.write_dump(fname)
+            # A single job still writes one file per dump
+            scat.parallel.read_dump_parallel(QualcommParser, {'layer': ['rrc', 'mac']}, [fname], NullWriter(), 1,
+                split_output=os.path.join(tmpdir, 'out'), pcap_format='pcapng')
+
+            with open(os.path.join(tmpdir, 'out_a.pcapng'), 'rb') as f:
+                data = f.read()
+            self.assertEqual(data[0:4], b'\x0a\x0d\x0d\x0a')
+            # Section header, interface, three packets
+            blocks = []
+            pos = 0
+            while pos < len(data):
+                block_type, block_len = struct.unpack_from('<LL', data, pos)
+                blocks.append(block_type)
+                pos += block_len
+            self.assertListEqual(blocks, [0x0a0d0d0a, 1, 6, 6, 6])
+
+    def test_short_packets(self):
+        # Packets of one or two bytes are kept by both paths
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'a.qmdl')
+            self.write_dump(fname)
+            with open(fname, 'ab') as f:
+                f.write(util.generate_packet(b'\x60\x00'))
+
+            parser = QualcommParser()
+            parser.set_parameter({'events': True})
+            with open(fname, 'rb') as f:
+                sequential = [parser.decode_diag(frame[:-1]) for frame in util.iter_hdlc_frames(f.read(), start=1)]
+            parallel = [parser.decode_diag(pkt, hdlc_encoded=False, has_crc=False)
+                for pkt in scat.parallel.decode_dump_parallel(QualcommParser, {'events': True}, fname, 2)]
+
+            self.assertEqual(sequential[-1], b'\x60\x00')
+            self.assertListEqual(parallel, sequential)
+
+    def test_merge_layers(self):
+        # Layer filters of outputs apply to packets merged from worker processes
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fnames = [os.path.join(tmpdir, 'a.qmdl'), os.path.join(tmpdir, 'b.qmdl')]
+            for fname in fnames:
+                self.write_dump(fname)
+
+            all_writer = CollectWriter()
+            rrc_writer = CollectWriter()
+            writer = FanoutWriter()
+            writer.add_writer(all_writer, ['rrc', 'mac'])
+            writer.add_writer(rrc_writer, ['rrc'])
+            scat.parallel.read_dump_parallel(QualcommParser, {'layer': ['rrc', 'mac']}, fnames, writer, 2)
+
+            self.assertEqual(len(all_writer.packets), 6)
+            self.assertEqual(len(rrc_writer.packets), 2)
+            for pkt in rrc_writer.packets:
+                # GSMTAP type LTE RRC
+                self.assertEqual(pkt[2], 0x0d)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import unittest
+import datetime
+import os
+import struct
+import tempfile
+import time
+
+from scat.writers import PcapngWriter
+
+class TestPcapngWriter(unittest.TestCase):
+    def read_blocks(self, fname):
+        with open(fname, 'rb') as f:
+            data = f.read()
+
+        blocks = []
+        pos = 0
+        while pos < len(data):
+            block_type, block_len = struct.unpack('<LL', data[pos:pos+8])
+            self.assertEqual(block_len % 4, 0)
+            self.assertEqual(struct.unpack('<L', data[pos+block_len-4:pos+block_len])[0], block_len)
+            blocks.append((block_type, data[pos+8:pos+block_len-4]))
+            pos += block_len
+        self.assertEqual(pos, len(data))
+        return blocks
+
+    def write_packets(self, fname, exported_pdu):
+        ts = datetime.datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc)
+        writer = PcapngWriter(fname, buffer_size=0x40, flush_interval=None, exported_pdu=exported_pdu)
+        writer.write_cp(b'\x02\x04\x01', 0, ts)
+        writer.write_cp(b'\x02\x04\x01\x00\x00', 1, ts)
+        writer.write_up(b'\x45', 0, ts)
+        writer.__exit__(None, None, None)
+
+    def test_interfaces(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'out.pcapng')
+            self.write_packets(fname, False)
+            blocks = self.read_blocks(fname)
+
+        self.assertListEqual([x[0] for x in blocks], [0x0a0d0d0a, 1, 6, 1, 6, 6])
+        self.assertEqual(struct.unpack('<L', blocks[0][1][0:4])[0], 0x1a2b3c4d)
+
+        # One interface per radio, nanosecond resolution
+        self.assertEqual(struct.unpack('<H', blocks[1][1][0:2])[0], 1)
+        self.assertIn(b'radio0', blocks[1][1])
+        self.assertIn(b'\x09\x00\x01\x00\x09', blocks[1][1])
+        self.assertIn(b'radio1', blocks[3][1])
+
+        ts_ns = 1704164645678901000
+        if_ids = []
+        for block_type, body in (blocks[2], blocks[4], blocks[5]):
+            if_id, ts_high, ts_low, cap_len, orig_len = struct.unpack('<LLLLL', body[0:20])
+            self.assertEqual((ts_high << 32) | ts_low, ts_ns)
+            self.assertEqual(cap_len, orig_len)
+            if_ids.append(if_id)
+        self.assertListEqual(if_ids, [0, 1, 0])
+
+        # Same Ethernet/IP/UDP wrapper as PcapWriter
+        pkt = blocks[2][1][20:20+45]
+        self.assertEqual(pkt[12:14], b'\x08\x00')
+        self.assertEqual(struct.unpack('!H', pkt[36:38])[0], 4729)
+        self.assertEqual(pkt[42:], b'\x02\x04\x01')
+
+    def test_exported_pdu(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'out.pcapng')
+            self.write_packets(fname, True)
+            blocks = self.read_blocks(fname)
+
+        self.assertEqual(struct.unpack('<H', blocks[1][1][0:2])[0], 252)
+        cap_len = struct.unpack('<L', blocks[2][1][12:16])[0]
+        self.assertEqual(blocks[2][1][20:20+cap_len], b'\x00\x0c\x00\x08gsmtap\x00\x00\x00\x00\x00\x00\x02\x04\x01')
+        cap_len = struct.unpack('<L', blocks[5][1][12:16])[0]
+        self.assertEqual(blocks[5][1][20:20+cap_len], b'\x00\x0c\x00\x04ip\x00\x00\x00\x00\x00\x00\x45')
+
+    def test_flush_interval(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'out.pcapng')
+            writer = PcapngWriter(fname, flush_interval=0.05)
+            writer.write_cp(b'\x02\x04\x01')
+            # Written without another packet arriving
+            deadline = time.monotonic() + 5
+            while os.path.getsize(fname) == 0 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual([block[0] for block in self.read_blocks(fname)], [0x0a0d0d0a, 1, 6])
+            writer.__exit__(None, None, None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+import unittest
+import binascii
+import datetime
+import os
+import tempfile
+import time
+
+from scat.writers import PcapWriter
+
+class TestPcapWriter(unittest.TestCase):
+    def test_write_pkt(self):
+        ts = datetime.datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'out.pcap')
+            writer = PcapWriter(fname, buffer_size=0x40, flush_interval=None)
+            writer.write_cp(b'\x02\x04', 0, ts)
+            writer.write_up(b'\x45', 1, ts)
+            writer.__exit__(None, None, None)
+
+            with open(fname, 'rb') as f:
+                data = f.read()
+
+        self.assertEqual(data[0:24], binascii.unhexlify('d4c3b2a1020004000000000000000000ffff000001000000'))
+        # Ports and radio ID select the UDP destination port and IP address
+        self.assertEqual(data[24:84], binascii.unhexlify('257d9365f55b0a002c0000002c00000000000000000000000000000008004500001e000040004011ffff7f0000017f00000134191279000affff0204'))
+        self.assertEqual(data[84:], binascii.unhexlify('257d9365f55b0a002b0000002b00000000000000000000000000000008004500001d000140004011ffff7f0000017f0000023419b8ba0009ffff45'))
+
+    def test_flush_interval(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'out.pcap')
+            writer = PcapWriter(fname, flush_interval=0.05)
+            writer.write_cp(b'\x02\x04')
+            # Written without another packet arriving
+            deadline = time.monotonic() + 5
+            while os.path.getsize(fname) < 24 + 60 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(os.path.getsize(fname), 24 + 60)
+            writer.__exit__(None, None, None)
+
+if __name__ == '__main__':
+    unittest.main()
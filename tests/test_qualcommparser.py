@@ -3,9 +3,49 @@
 import unittest
 import binascii
 import datetime
+import json
+import os
+import struct
+import tempfile
 from collections import namedtuple
 
 from scat.parsers.qualcomm.qualcommparser import QualcommParser
+from scat.parsers.qualcomm import diagcmd
+import scat.util as util
+from scat.writers import NullWriter
+
+class FakeDiagDevice:
+    # Answers every command, ID range, level and event mask queries with fixed values
+    def __init__(self):
+        self.responses = b''
+        self.commands = []
+
+    def write(self, write_buf, encode_hdlc=False):
+        for frame in write_buf.split(b'\x7e'):
+            if len(frame) == 0:
+                continue
+            cmd = util.unwrap(frame)[:-2]
+            self.commands.append(cmd)
+            if cmd[0] == 0x00:
+                resp = binascii.unhexlify('004e6f76202032203230323132323a31333a31324f6374203132203230323130323a30303a303073647835352e63702a09ff64003000cf')
+            elif cmd[0] == 0x7c:
+                resp = binascii.unhexlify('7c010000f20c00004e010000524d35303051474c41425231314130364d34470000')
+            elif cmd[0] == 0x73 and cmd[4] == 0x01:
+                resp = struct.pack('<LLL', 0x73, 0x01, 0) + struct.pack('<16L', *([0] * 11 + [0x9ff] + [0] * 4))
+            elif cmd[0] == 0x7d and cmd[1] == 0x01:
+                resp = struct.pack('<BBHHH', 0x7d, 0x01, 0, 1, 0) + struct.pack('<HH', 0x1f40, 0x1f41)
+            elif cmd[0] == 0x7d and cmd[1] == 0x02:
+                resp = cmd[0:6] + b'\x00\x00' + struct.pack('<LL', 0x1f, 0x1e)
+            elif cmd[0] == 0x81:
+                resp = struct.pack('<BBHH', 0x81, 0, 0, 0x0c00) + b'\xff' * 0x180
+            else:
+                resp = cmd[0:8]
+            self.responses += util.generate_packet(resp)
+
+    def read(self, read_size, decode_hdlc=False):
+        buf = self.responses[0:read_size]
+        self.responses = self.responses[read_size:]
+        return buf
 
 class TestQualcommParser(unittest.TestCase):
     parser = QualcommParser()
@@ -108,5 +148,179 @@ class TestQualcommParser(unittest.TestCase):
         expected_cp = binascii.unhexlify('0204100000000000000000000000000012d544aa0009c7e8000000000000000000000000000000000000000000000000393530390000000000000000000000006c74655f6d6c315f6d642e6300000000000000000000000000000000000000000000093f53656e7420496e697420416371205265713b2065617266636e203234353320667265715f3130304b487a2038373433206d61785f667265715f6f6666736574203133353030202074617267657465645f6163715f666c61672030207461726765745f6369642030206d61782068662034206e756d5f626c6f636b65645f63656c6c73203020667363616e206d6f64653a2030')
         self.assertEqual(result['cp'][0], expected_cp)
 
+    def test_send_commands(self):
+        class ReplayIO:
+            # Returns all responses at once, after the commands are sent
+            def __init__(self, responses):
+                self.responses = responses
+                self.written = []
+
+            def write(self, write_buf, encode_hdlc=False):
+                self.written.append(write_buf)
+
+            def read(self, read_size, decode_hdlc=False):
+                buf = self.responses
+                self.responses = b''
+                return buf
+
+        ver = binascii.unhexlify('004e6f76202032203230323132323a31333a31324f6374203132203230323130323a30303a303073647835352e63702a09ff64003000cf')
+        responses = b''.join([
+            util.generate_packet(b'\x10\x00\x10\x00\x10\x00\x00\x00' + b'\x00' * 8),
+            util.generate_packet(b'\x13\x7c'),
+            util.generate_packet(b'\x60\x00'),
+            util.generate_packet(ver)])
+
+        parser = QualcommParser()
+        parser.set_io_device(ReplayIO(responses))
+        parser.set_parameter({'combine-stdout': True})
+        parser.set_writer(NullWriter())
+        results = parser.send_commands([(b'\x00', True), (b'\x7c', True), (b'\x60\x00', False)])
+
+        self.assertEqual(len(parser.io_device.written), 3)
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0]['stdout'], 'Compile: Nov  2 2021/22:13:12, Release: Oct 12 2021/02:00:00, Chipset: sdx55.cp')
+
+    def test_send_commands_split_response(self):
+        class ScriptedIO:
+            # Returns the given buffers one per read
+            def __init__(self, reads):
+                self.reads = reads
+
+            def write(self, write_buf, encode_hdlc=False):
+                pass
+
+            def read(self, read_size, decode_hdlc=False):
+                return self.reads.pop(0) if len(self.reads) > 0 else b''
+
+        ver = binascii.unhexlify('004e6f76202032203230323132323a31333a31324f6374203132203230323130323a30303a303073647835352e63702a09ff64003000cf')
+        build_id = binascii.unhexlify('7c010000f20c00004e010000524d35303051474c41425231314130364d34470000')
+        # Unsolicited packet split across the reads of two batches, its
+        # second part starts with the command code of the second batch
+        other = util.generate_packet(b'\x10\x00\x10\x00\x10\x00\x00\x00' + b'\x7c' * 8)
+        split = other.index(b'\x7c')
+
+        parser = QualcommParser()
+        parser.set_io_device(ScriptedIO([
+            b'\x7e' + util.generate_packet(ver) + other[:split],
+            other[split:] + util.generate_packet(build_id)]))
+        parser.set_parameter({'combine-stdout': True})
+        parser.set_writer(NullWriter())
+
+        results = parser.send_commands([(b'\x00', True)])
+        self.assertEqual(len(results), 1)
+        results = parser.send_commands([(b'\x7c', True)])
+        self.assertListEqual(results, [parser.parse_diag_ext_build_id(build_id)])
+
+    def test_capability_cache(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            commands = []
+            for i in range(2):
+                parser = QualcommParser()
+                parser.set_io_device(FakeDiagDevice())
+                parser.set_writer(NullWriter())
+                parser.set_parameter({'msgs': True, 'combine-stdout': True,
+                    'capability-cache': os.path.join(tmpdir, 'cache.json')})
+                parser.init_diag()
+                parser.prepare_diag()
+                commands.append(parser.io_device.commands)
+                self.assertDictEqual(parser.log_id_range, {11: 0x9ff})
+                self.assertListEqual(list(parser.emr_level_range[0][0:2]), [0x1f40, 0x1f41])
+
+            # Queries are skipped on a cache hit, the same masks are set
+            queries = [x for x in commands[0] if x[0] == 0x73 and x[4] == 0x01 or x[0] == 0x7d and x[1] in (0x01, 0x02)]
+            self.assertEqual(len(queries), 3)
+            self.assertListEqual([x for x in commands[0] if x not in queries], commands[1])
+
+    def test_capability_cache_malformed(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_name = os.path.join(tmpdir, 'cache.json')
+            commands = []
+            for i in range(2):
+                parser = QualcommParser()
+                parser.set_io_device(FakeDiagDevice())
+                parser.set_writer(NullWriter())
+                parser.set_parameter({'msgs': True, 'combine-stdout': True, 'capability-cache': cache_name})
+                if i == 0:
+                    parser.init_diag()
+                else:
+                    # Entry with missing keys, queried again
+                    with open(cache_name, 'r') as f:
+                        cache = json.load(f)
+                    for key in cache:
+                        del cache[key]['emr_id_range']
+                    with open(cache_name, 'w') as f:
+                        json.dump(cache, f)
+                    with self.assertLogs('scat.qualcommparser', 'WARNING'):
+                        parser.init_diag()
+                parser.prepare_diag()
+                commands.append(parser.io_device.commands)
+            self.assertListEqual(commands[0], commands[1])
+
+            # The entry was replaced by the queried capabilities
+            with open(cache_name, 'r') as f:
+                cache = json.load(f)
+            self.assertTrue(all('emr_id_range' in x for x in cache.values()))
+
+    def test_run_diag_lag_sample(self):
+        class ListShedder:
+            def __init__(self):
+                self.observed = []
+
+            def observe(self, device_ts):
+                self.observed.append(device_ts)
+
+            def update(self, backlog):
+                pass
+
+        body = binascii.unhexlify('1e112011400132001914000016ad090000000002000000004c10')
+        log_id = diagcmd.diag_log_get_lte_item_id(diagcmd.diag_log_code_lte.LOG_LTE_RRC_OTA_MESSAGE)
+        io_device = FakeDiagDevice()
+        io_device.block_until_data = False
+        # Log packet followed by a frame without timestamp in the same read
+        io_device.responses = (b'\x7e' + util.generate_packet(struct.pack('<BBHHHQ', 0x10, 0, 12 + len(body), 12 + len(body), log_id, 800 << 16) + body)
+            + util.generate_packet(b'\x4b\x00'))
+
+        parser = QualcommParser()
+        parser.set_io_device(io_device)
+        parser.set_writer(NullWriter())
+        parser.set_parameter({'layer': ['rrc']})
+        parser.load_shedder = ListShedder()
+        parser.run_diag()
+        self.assertListEqual(parser.load_shedder.observed, [datetime.datetime(1980, 1, 6, 0, 0, 1, tzinfo=datetime.timezone.utc)])
+
+    def test_exact_masks(self):
+        parser = QualcommParser()
+        parser.set_io_device(FakeDiagDevice())
+        parser.set_writer(NullWriter())
+        parser.set_parameter({'combine-stdout': True, 'log-codes': [0xb0c0, 0xb821, 0x412f],
+            'event-ids': [0x0a0, 0x1ff], 'emr-ssids': [0x1f41]})
+        self.assertTrue(parser.parse_events)
+        self.assertTrue(parser.parse_msgs)
+        parser.init_diag()
+        parser.io_device.commands = []
+        parser.prepare_diag()
+
+        log_masks = [x for x in parser.io_device.commands if x[0] == 0x73]
+        self.assertListEqual(log_masks, [
+            diagcmd.create_log_config_set_mask(0x4, 0x130, 0x12f),
+            diagcmd.create_log_config_set_mask(0xb, 0x822, 0x0c0, 0x821)])
+
+        event_masks = [x for x in parser.io_device.commands if x[0] == 0x82]
+        self.assertListEqual(event_masks, [diagcmd.create_event_mask_set(0x0c00, 0x0a0, 0x1ff)])
+        self.assertEqual(event_masks[0][6 + 0x0a0 // 8], 0x01)
+
+        emr_masks = [x for x in parser.io_device.commands if x[0] == 0x7d]
+        self.assertListEqual(emr_masks, [binascii.unhexlify('7d04411f411f00001f000000')])
+
+    def test_log_masks_byte_boundary(self):
+        # Highest items which are a multiple of 8 need one more mask byte
+        masks = diagcmd.create_log_config_set_masks(0xb0c0, 0x4008)
+        self.assertListEqual(masks, [
+            diagcmd.create_log_config_set_mask(0x4, 0x009, 0x008),
+            diagcmd.create_log_config_set_mask(0xb, 0x0c1, 0x0c0)])
+        self.assertEqual(len(masks[1]), 16 + 0x0c0 // 8 + 1)
+        self.assertEqual(masks[1][16 + 0x0c0 // 8], 0x01)
+        self.assertEqual(diagcmd.clear_log_config_mask_items(masks[1], 0xb0c0), masks[1][:-1] + b'\x00')
+
 if __name__ == '__main__':
     unittest.main()
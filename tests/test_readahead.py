@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import unittest
+import bz2
+import gzip
+import lzma
+import os
+import tempfile
+
+from scat.iodevices import FileIO
+from scat.iodevices.readahead import ReadAheadReader
+import scat.compression
+
+class TestReadAhead(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data = b''.join(bytes([i % 251]) * (i % 97) + i.to_bytes(4, 'little') for i in range(20000))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, content):
+        fname = os.path.join(self.tmpdir.name, name)
+        with open(fname, 'wb') as f:
+            f.write(content)
+        return fname
+
+    def read_all(self, reader, size=0x1000):
+        buf = b''
+        while True:
+            data = reader.read(size)
+            if len(data) == 0:
+                break
+            buf += data
+        reader.close()
+        return buf
+
+    def members(self, method):
+        # Many independent members, as written by CompressedRawWriter
+        step = 5000
+        return b''.join(scat.compression.compress_block(self.data[i:i + step], method)
+            for i in range(0, len(self.data), step))
+
+    def test_detect_method(self):
+        self.assertEqual(scat.compression.detect_method(self.write('a', gzip.compress(b'x'))), 'gzip')
+        self.assertEqual(scat.compression.detect_method(self.write('b', bz2.compress(b'x'))), 'bz2')
+        self.assertEqual(scat.compression.detect_method(self.write('c', lzma.compress(b'x'))), 'xz')
+        self.assertEqual(scat.compression.detect_method(self.write('d.gz', b'\x10\x00\x1f\x8b')), None)
+
+    def test_parallel_members(self):
+        for method in ('gzip', 'bz2'):
+            fname = self.write('multi', self.members(method))
+            reader = ReadAheadReader(fname, method, jobs=3, chunk_size=1000)
+            self.assertIsNotNone(reader.executor)
+            self.assertEqual(self.read_all(reader), self.data, method)
+
+    def test_single_member(self):
+        # No member boundary in reach, read by the single thread
+        fname = self.write('single', gzip.compress(self.data))
+        reader = ReadAheadReader(fname, 'gzip', jobs=3, chunk_size=100)
+        self.assertEqual(self.read_all(reader, 777), self.data)
+
+    def test_false_boundary(self):
+        # Stored blocks contain the payload as is, including gzip magic
+        payload = (b'\x1f\x8b\x08' + bytes(200)) * 1000
+        fname = self.write('stored', gzip.compress(payload, 0) + gzip.compress(self.data))
+        reader = ReadAheadReader(fname, 'gzip', jobs=2, chunk_size=1000)
+        self.assertEqual(self.read_all(reader), payload + self.data)
+
+    def test_fileio(self):
+        # Format is detected from the content, not the file name
+        fname = self.write('dump.qmdl', lzma.compress(self.data))
+        io_device = FileIO([fname])
+        self.assertEqual(self.read_all(io_device.f), self.data)
+
+if __name__ == '__main__':
+    unittest.main()
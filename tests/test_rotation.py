@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import unittest
+import gzip
+import os
+import struct
+import tempfile
+
+from scat.writers import SegmentRotation, PcapWriter, RawWriter
+
+class TestRotation(unittest.TestCase):
+    def test_raw_packets(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'out.qmdl')
+            writer = RawWriter(fname, b'H', b'T', rotation=SegmentRotation(max_packets=2))
+            for i in range(5):
+                writer.write_cp(bytes([0x30 + i]))
+            writer.__exit__(None, None, None)
+
+            self.assertListEqual(sorted(os.listdir(tmpdir)), ['out_00001.qmdl', 'out_00002.qmdl', 'out_00003.qmdl'])
+            with open(os.path.join(tmpdir, 'out_00001.qmdl'), 'rb') as f:
+                self.assertEqual(f.read(), b'H01T')
+            with open(os.path.join(tmpdir, 'out_00003.qmdl'), 'rb') as f:
+                self.assertEqual(f.read(), b'H4T')
+
+    def test_pcap_size_compress_keep(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'out.pcap')
+            rotation = SegmentRotation(max_size=200, compression='gzip', max_segments=2)
+            writer = PcapWriter(fname, rotation=rotation)
+            for i in range(10):
+                writer.write_cp(b'\x02\x04\x01' + bytes(50))
+            writer.__exit__(None, None, None)
+
+            # 24 bytes header and 2 records of 111 bytes per segment
+            self.assertListEqual(sorted(os.listdir(tmpdir)), ['out_00004.pcap.gz', 'out_00005.pcap.gz'])
+            with gzip.open(os.path.join(tmpdir, 'out_00005.pcap.gz'), 'rb') as f:
+                data = f.read()
+            self.assertEqual(len(data), 24 + 2 * 111)
+            self.assertEqual(struct.unpack('<L', data[0:4])[0], 0xa1b2c3d4)
+
+    def test_unknown_compression(self):
+        with self.assertRaises(ValueError):
+            SegmentRotation(max_size=1, compression='rar')
+
+if __name__ == '__main__':
+    unittest.main()
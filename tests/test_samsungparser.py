@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+import unittest
+import binascii
+import datetime
+import os
+import tempfile
+
+from scat.parsers.samsung.samsungparser import SamsungParser
+from scat.iodevices.fileio import FileIO
+
+class ListWriter:
+    def __init__(self):
+        self.cp = []
+
+    def write_cp(self, sock_content, radio_id=0, ts=None):
+        self.cp.append(sock_content)
+
+    def write_up(self, sock_content, radio_id=0, ts=None):
+        pass
+
+class TestSamsungParser(unittest.TestCase):
+    def test_run_dump(self):
+        pkt = binascii.unhexlify('7f3c0000390087ffa002020b418b35d0af0000000000000e067b010000ecc850fb14370000d007000001000e0615010000bc1bcc290000a406000000007e')
+        dump = pkt + b'\x00garbage' + pkt + pkt + pkt[:20]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'dump.sdmraw')
+            with open(fname, 'wb') as f:
+                f.write(dump)
+
+            for use_mmap in (False, True):
+                parser = SamsungParser()
+                writer = ListWriter()
+                io_device = FileIO([fname], use_mmap)
+                parser.set_io_device(io_device)
+                parser.set_writer(writer)
+                parser.set_parameter({'combine-stdout': True})
+
+                # Must return at the end of file
+                parser.run_dump()
+                io_device.__exit__(None, None, None)
+                self.assertEqual(len(writer.cp), 6)
+
+    def test_index_time_filter(self):
+        pkt = binascii.unhexlify('7f3c0000390087ffa002020b418b35d0af0000000000000e067b010000ecc850fb14370000d007000001000e0615010000bc1bcc290000a406000000007e')
+        start = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fname = os.path.join(tmpdir, 'dump.sdmraw')
+            with open(fname, 'wb') as f:
+                f.write(pkt * 3)
+
+            parser = SamsungParser()
+            writer = ListWriter()
+            io_device = FileIO([fname])
+            parser.set_io_device(io_device)
+            parser.set_writer(writer)
+            parser.set_parameter({'combine-stdout': True, 'index-filter': {'log_ids': None, 'start': start, 'end': None}})
+
+            # Raw SDM packets have no usable timestamps, the whole file is read
+            with self.assertLogs('scat.index', 'WARNING'):
+                parser.read_dump()
+            io_device.__exit__(None, None, None)
+            self.assertEqual(len(writer.cp), 6)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import unittest
+
+from scat.iodevices.serialio import RingBuffer
+
+class TestSerialIO(unittest.TestCase):
+    def test_ring_buffer(self):
+        ring = RingBuffer(8)
+        ring.put(b'01234')
+        self.assertEqual(ring.get(3, 0), b'012')
+
+        # Wraps around the end of the buffer
+        ring.put(b'56789')
+        self.assertEqual(len(ring), 7)
+        self.assertEqual(ring.get(100, 0), b'3456789')
+        self.assertEqual(ring.get(100, 0), b'')
+
+        # Overrun drops the data which does not fit
+        ring.put(b'abcdefghij')
+        self.assertEqual(ring.dropped_bytes, 2)
+        self.assertEqual(ring.get(100, 0), b'abcdefgh')
+
+    def test_ring_buffer_error(self):
+        ring = RingBuffer(8)
+        ring.put(b'0123')
+        ring.put_error(OSError('device disconnected'))
+
+        # Buffered data is returned before the error
+        self.assertEqual(ring.get(100, 0), b'0123')
+        with self.assertRaises(OSError):
+            ring.get(100, 0)
+        with self.assertRaises(OSError):
+            ring.get(100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+import unittest
+import socket
+
+from scat.writers import SocketWriter
+
+class FullSocket:
+    def send(self, data):
+        raise BlockingIOError()
+
+    def close(self):
+        pass
+
+class TestSocketWriter(unittest.TestCase):
+    def test_write(self):
+        recv_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        recv_sock.bind(('127.0.0.1', 0))
+        recv_sock.settimeout(1)
+        port = recv_sock.getsockname()[1]
+
+        # Find a port nobody listens on
+        closed_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        closed_sock.bind(('127.0.0.1', 0))
+        closed_port = closed_sock.getsockname()[1]
+        closed_sock.close()
+
+        writer = SocketWriter('127.0.0.1', port, closed_port)
+        writer.write_cp(b'\x02\x04\x01')
+        writer.write_cp(b'\x02\x04\x02')
+        self.assertEqual(recv_sock.recv(100), b'\x02\x04\x01')
+        self.assertEqual(recv_sock.recv(100), b'\x02\x04\x02')
+        self.assertEqual(len(writer.socks), 1)
+
+        # Unreachable port is counted, not raised
+        for i in range(4):
+            writer.write_up(b'\x45')
+        self.assertGreater(writer.refused_packets, 0)
+
+        # Full send buffer
+        writer.socks[(0, port)].close()
+        writer.socks[(0, port)] = FullSocket()
+        writer.write_cp(b'\x02\x04\x03')
+        self.assertEqual(writer.dropped_packets, 1)
+
+        # Both counters are reported on exit
+        with self.assertLogs('scat.socketwriter', 'WARNING') as logs:
+            writer.__exit__(None, None, None)
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn('Dropped 1 GSMTAP packets, socket send buffer full', logs.output[0])
+        self.assertIn('Dropped {} GSMTAP packets, destination port unreachable'.format(writer.refused_packets), logs.output[1])
+        recv_sock.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+
+import unittest
+import errno
+from array import array
+
+import usb.core
+
+from scat.iodevices.usbio import USBIO
+
+class FakeEndpoint:
+    def __init__(self, transfers):
+        self.transfers = transfers
+
+    def read(self, buf, timeout=None):
+        if len(self.transfers) == 0:
+            raise usb.core.USBError('No such device', errno=errno.ENODEV)
+        data = self.transfers.pop(0)
+        buf[0:len(data)] = array('B', data)
+        return len(data)
+
+class TestUSBIO(unittest.TestCase):
+    def test_reader_error(self):
+        io_device = USBIO()
+        io_device.r_handle = FakeEndpoint([b'\x01\x02\x7e'])
+        io_device.start_reader(transfer_size=0x10, num_buffers=2)
+
+        # Transfers read before the error are returned first
+        self.assertEqual(io_device.read(0x1000), b'\x01\x02\x7e')
+        with self.assertRaises(usb.core.USBError):
+            io_device.read(0x1000)
+        io_device.reader_thread.join(1)
+        self.assertFalse(io_device.reader_thread.is_alive())
+        io_device.stop_reader()
+
+if __name__ == '__main__':
+    unittest.main()
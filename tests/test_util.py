@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+import unittest
+import binascii
+
+import scat.util as util
+
+class TestUtil(unittest.TestCase):
+    def test_hdlc_deframer(self):
+        deframer = util.HdlcDeframer(16)
+
+        frames = [bytes(x) for x in deframer.feed(b'\x7e\x01\x02\x7e\x03')]
+        self.assertListEqual(frames, [b'\x01\x02\x7e'])
+        self.assertEqual(len(deframer), 1)
+
+        frames = [bytes(x) for x in deframer.feed(b'\x04\x7e\x7e\x05\x06\x7e')]
+        self.assertListEqual(frames, [b'\x03\x04\x7e', b'\x05\x06\x7e'])
+        self.assertEqual(len(deframer), 0)
+
+        # Input larger than the buffer is split across compactions
+        payload = b'\x11' * 10 + b'\x7e'
+        frames = [bytes(x) for x in deframer.feed(payload * 3)]
+        self.assertListEqual(frames, [payload] * 3)
+
+    def test_hdlc_deframer_overflow(self):
+        deframer = util.HdlcDeframer(16)
+
+        frames = [bytes(x) for x in deframer.feed(b'\xff' * 20 + b'\x7e\x01\x7e')]
+        self.assertEqual(deframer.dropped_bytes, 16)
+        self.assertListEqual(frames, [b'\xff\xff\xff\xff\x7e', b'\x01\x7e'])
+
+        list(deframer.feed(b'\x02\x03'))
+        self.assertEqual(deframer.flush(), b'\x02\x03')
+        self.assertIsNone(deframer.flush())
+
+    def test_dm_crc16(self):
+        self.assertEqual(util.dm_crc16(b'123456789'), 0x906e)
+        self.assertEqual(util.dm_crc16(b''), 0x0000)
+        self.assertEqual(util.dm_crc16(bytearray(b'\x7e\x7d\x00\xff')), util.dm_crc16(memoryview(b'\x7e\x7d\x00\xff')))
+
+        # DIAG_VERNO_F request
+        self.assertEqual(util.generate_packet(b'\x00'), binascii.unhexlify('0078f07e'))
+
+    def test_decode_diag_frame(self):
+        # DIAG_VERNO_F request, escape-free and with escaped CRC
+        self.assertEqual(util.decode_diag_frame(b'\x00\x78\xf0'), (b'\x00', None))
+        frame = util.generate_packet(b'\x7d\x01')[:-1]
+        self.assertEqual(util.decode_diag_frame(memoryview(frame)), (b'\x7d\x01', None))
+
+        self.assertEqual(util.decode_diag_frame(b'\x00\x78\xf1'), (b'\x00', 0xf178))
+        self.assertEqual(util.decode_diag_frame(b'\x00\x78\xf1', check_crc=False), (b'\x00', None))
+        self.assertEqual(util.decode_diag_frame(b'\x7d\x5e\x00\x00', hdlc_encoded=False, check_crc=False), (b'\x7d\x5e', None))
+
+    def test_unwrap(self):
+        payload = binascii.unhexlify('7d5e017d5d02')
+        self.assertEqual(util.unwrap(payload), b'\x7e\x01\x7d\x02')
+        self.assertEqual(util.unwrap(memoryview(payload)), b'\x7e\x01\x7d\x02')
+        self.assertEqual(util.unwrap(util.wrap(b'\x7d\x7e\x00')), b'\x7d\x7e\x00')
+
+if __name__ == '__main__':
+    unittest.main()